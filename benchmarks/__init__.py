@@ -0,0 +1,8 @@
+"""
+Benchmarks for the assembler. Each module can be run on its own, e.g.
+
+    PYTHONPATH=. python3 -m benchmarks.statements
+
+benchmarks.suite runs the whole corpus, and the stress programs generated by
+benchmarks.corpus, saving results as JSON to compare between commits.
+"""
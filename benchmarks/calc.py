@@ -0,0 +1,66 @@
+"""
+Assembly time of table generating sources, with { } expressions compiled and
+cached, and with every one interpreted by calc().
+"""
+import io
+import sys
+import time
+
+import octopy.calc
+from octopy.assemble import assemble
+
+def sine_table(entries):
+    lines = [": main", "  jump main", ": table"]
+    lines += [":byte {{ 128 + 127 * sin ( ( HERE - table ) * 2 * PI / {} ) }}".format(entries)
+              for _ in range(entries)]
+    return "\n".join(lines)
+
+def macro_table(entries):
+    """A table built by a macro, as sinusoid.8o does."""
+    lines = [":macro entry {",
+             "  :calc n { CALLS % 64 }",
+             "  :byte { ( n * n + 3 * n ) & 0xFF }",
+             "  :byte { 0x10 | ( n >> 2 ) }",
+             "}",
+             ": main", "  jump main"]
+    lines += ["  entry"] * entries
+    return "\n".join(lines)
+
+SOURCES = {
+    "sinusoid.8o": lambda: open("test/testdata/sinusoid.8o").read(),
+    "2000 entry sine table": lambda: sine_table(2000),
+    "1500 macro table entries": lambda: macro_table(1500),
+}
+
+def interpreted(texts):
+    return None
+
+def measure(source, compiler, repeat=5):
+    """Best time to assemble the source, and the ROM."""
+    octopy.calc.compile_expression = compiler
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        program = assemble(io.StringIO(source))
+        best = min(best, time.perf_counter() - start)
+    if program.error is not None:
+        raise program.error
+    return best, program.program
+
+def main(out=sys.stdout):
+    compiler = octopy.calc.compile_expression
+    out.write("{:<30} {:>12} {:>12} {:>8}\n".format(
+        "source", "calc() ms", "compiled ms", "speedup"))
+    try:
+        for name, make_source in SOURCES.items():
+            source = make_source()
+            slow, expected = measure(source, interpreted)
+            fast, rom = measure(source, compiler)
+            assert rom == expected, name
+            out.write("{:<30} {:>12.2f} {:>12.2f} {:>7.1f}x\n".format(
+                name, slow * 1000, fast * 1000, slow / fast))
+    finally:
+        octopy.calc.compile_expression = compiler
+
+if __name__ == "__main__":
+    main()
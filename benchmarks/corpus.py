@@ -0,0 +1,91 @@
+"""
+Synthetic stress programs, each generated at any scale, for finding out how
+the assembler copes with big sources and whether its time grows faster than
+the source does. Run on its own to write the corpus out as .8o files:
+
+    PYTHONPATH=. python3 -m benchmarks.corpus outdir/ [--scale N]
+"""
+import argparse
+import os
+import sys
+
+def labels(count):
+    """count one-byte data labels, every tenth one loaded with i := long."""
+    lines = [": main"]
+    lines += ["  i := long label{}".format(n) for n in range(0, count, 10)]
+    lines.append("  jump main")
+    lines += [": label{} 0x{:02X}".format(n, n & 0xFF) for n in range(count)]
+    return "\n".join(lines)
+
+def nesting(depth, repeats=3):
+    """begin/end and loop/again blocks nested depth deep."""
+    lines = [": main"]
+    for _ in range(repeats):
+        for level in range(depth):
+            lines.append("  " * level + "loop if v{:x} == {} begin".format(level % 15, level & 0xFF))
+        for level in reversed(range(depth)):
+            lines.append("  " * level + "end v{:x} += 1 again".format(level % 15))
+    lines.append("  jump main")
+    return "\n".join(lines)
+
+def macros(expansions, library=20):
+    """A library of macros with arguments, expanded over and over."""
+    lines = []
+    for m in range(library):
+        lines += [":macro op{} dst src n {{".format(m),
+                  "  dst := src",
+                  "  dst += n",
+                  "  if dst == {} then vf := n".format(m),
+                  "  i := hex dst",
+                  "  sprite dst src {}".format(m % 15 + 1),
+                  "}"]
+    lines.append(": main")
+    lines += ["  op{} v{:x} v{:x} {}".format(n % library, n % 8, 8 + n % 7, n % 200)
+              for n in range(expansions)]
+    return "\n".join(lines)
+
+def data(rows):
+    """A table of 16 byte rows, as level and sprite data is written."""
+    lines = [": main", "  i := long table", "  jump main", ": table"]
+    lines += ["  " + " ".join("0x{:02X}".format((row * 16 + n) * 7 & 0xFF) for n in range(16))
+              for row in range(rows)]
+    return "\n".join(lines)
+
+def calc(count):
+    """:calc and { } expressions, in the style of generated lookup tables."""
+    lines = [": main", "  jump main", ": table"]
+    for n in range(count):
+        lines += [":calc t{} {{ ( HERE - table ) * 2 * PI / {} }}".format(n, count),
+                  ":byte {{ 128 + 100 * sin t{} }}".format(n)]
+    return "\n".join(lines)
+
+# Each generator, with the size it's run at for a scale of 1. Scale 8 still
+# fits the XO-Chip address space.
+STRESS = {
+    "labels": (labels, 1250),
+    "nesting": (nesting, 16),
+    "macros": (macros, 250),
+    "data": (data, 400),
+    "calc": (calc, 500),
+}
+
+def generate(name, scale=1):
+    generator, base = STRESS[name]
+    return generator(base * scale)
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog="benchmarks.corpus",
+                                        description="Write the stress corpus out as sources.")
+    argparser.add_argument("outdir")
+    argparser.add_argument("--scale", type=int, default=8)
+    args = argparser.parse_args(argv)
+    os.makedirs(args.outdir, exist_ok=True)
+    for name in STRESS:
+        path = os.path.join(args.outdir, "{}-x{}.8o".format(name, args.scale))
+        with open(path, "w") as f:
+            f.write(generate(name, args.scale))
+        print(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,57 @@
+"""
+Code emission throughput of Program, on ROMs filling the CHIP-8 and XO-Chip
+address spaces, and on data placed far from the code with :org.
+"""
+import sys
+import time
+
+from octopy.program import Program
+
+def fill(program, words):
+    for n in range(words):
+        program.LDN(n & 0xF, n & 0xFF)
+        program.ALU(n & 0xF, (n >> 4) & 0xF, 4)
+        program.SPRITE(0, 1, n & 0xF)
+        program.emit_byte(n & 0xFF)
+        program.emit_byte(0)
+
+def chip8(program):
+    # Fills 0x200-0xFFF.
+    fill(program, 0xE00 // 8)
+
+def xo_chip(program):
+    # Fills 0x200-0xFFFF.
+    fill(program, 0xFE00 // 8)
+
+def far_org(program):
+    fill(program, 64)
+    for org in range(0x1000, 0x10000, 0x1000):
+        program.org(org)
+        fill(program, 32)
+
+WORKLOADS = {
+    "4K ROM": chip8,
+    "64K XO-Chip ROM": xo_chip,
+    "data at :org 0x1000..0xF000": far_org,
+}
+
+def measure(workload, repeat=5):
+    """Best time to fill a new Program, and the bytes emitted."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        program = Program()
+        workload(program)
+        size = program.size()
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+def main(out=sys.stdout):
+    out.write("{:<30} {:>10} {:>10} {:>12}\n".format("workload", "bytes", "ms", "MB/s"))
+    for name, workload in WORKLOADS.items():
+        seconds, size = measure(workload)
+        out.write("{:<30} {:>10,} {:>10.2f} {:>12.2f}\n".format(
+            name, size, seconds * 1000, size / seconds / 1e6))
+
+if __name__ == "__main__":
+    main()
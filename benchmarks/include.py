@@ -0,0 +1,65 @@
+"""
+Assembling a project split across included library files: with every file
+tokenized as it's included, with the libraries tokenized ahead of parsing
+across worker processes, and with them read back from a warm token cache.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from octopy.assemble import assemble_file
+
+def library(n, macros):
+    lines = []
+    for m in range(macros):
+        lines.append(":macro lib{}-{} x y {{".format(n, m))
+        lines += ["  v{:x} := x v{:x} += y  # step {}".format(k, k, k) for k in range(8)]
+        lines.append("}")
+    lines.append(": lib{}-sub".format(n))
+    lines.append("  lib{}-0 1 2".format(n))
+    lines.append("  ;")
+    return "\n".join(lines) + "\n"
+
+def project(directory, files, macros):
+    """Write a project of files libraries (each including the next) and a main."""
+    for n in range(files):
+        with open(os.path.join(directory, "lib{}.8o".format(n)), "w") as f:
+            if n + 1 < files and n % 2 == 0:
+                f.write(":include lib{}.8o\n".format(n + 1))
+            f.write(library(n, macros))
+    main = os.path.join(directory, "main.8o")
+    with open(main, "w") as f:
+        f.writelines(":include lib{}.8o\n".format(n) for n in range(0, files, 2))
+        f.write(": main\n")
+        f.writelines("  lib{}-sub\n".format(n) for n in range(files))
+        f.write("  loop again\n")
+    return main
+
+def timed(path, **kwargs):
+    start = time.perf_counter()
+    program = assemble_file(path, **kwargs)
+    elapsed = time.perf_counter() - start
+    assert program.error is None, program.error
+    return elapsed
+
+def main(out=sys.stdout):
+    out.write("{:<24}{:>12}{:>12}{:>12}{:>12}\n".format(
+        "project", "serial s", "parallel s", "cold s", "warm s"))
+    for files, macros in ((4, 200), (16, 400), (32, 1000)):
+        directory = tempfile.mkdtemp()
+        try:
+            path = project(directory, files, macros)
+            cache = os.path.join(directory, "cache")
+            serial = timed(path, jobs=1)
+            parallel = timed(path)
+            cold = timed(path, cache=cache)
+            warm = min(timed(path, cache=cache) for _ in range(3))
+        finally:
+            shutil.rmtree(directory)
+        out.write("{:<24}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}\n".format(
+            "{} files x {} macros".format(files, macros), serial, parallel, cold, warm))
+
+if __name__ == "__main__":
+    main()
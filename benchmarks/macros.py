@@ -0,0 +1,104 @@
+"""
+Assembly time of sources that expand the same macros over and over, with
+expansions replayed from the macro's cache and with every expansion parsed,
+and the cost per token of macros nested ever more deeply.
+"""
+import io
+import sys
+import time
+
+from octopy.assemble import assemble
+from octopy.parser import Parser
+
+def sprites(expansions):
+    """A sprite drawing macro, used with a handful of different arguments."""
+    lines = [":macro draw spr x y {",
+             "  i := spr",
+             "  v0 := x",
+             "  v1 := y",
+             "  sprite v0 v1 8",
+             "  if vf != 0 then v2 += 1",
+             "}"]
+    lines += [": sprite{} 0xFF 0x81 0x81 0x81 0x81 0x81 0x81 0xFF".format(n) for n in range(4)]
+    lines.append(": main")
+    lines += ["  draw sprite{} {} {}".format(n % 4, n % 8 * 8, n % 2 * 8)
+              for n in range(expansions)]
+    return "\n".join(lines)
+
+def math(expansions):
+    """An 8x8 bit multiply, unrolled into a loop with branches."""
+    lines = [":macro multiply a b {",
+             "  v2 := 0",
+             "  v3 := a",
+             "  v4 := b",
+             "  loop",
+             "    while v4 != 0",
+             "    v5 := v4",
+             "    vf := 1",
+             "    v5 &= vf",
+             "    if v5 != 0 then v2 += v3",
+             "    v3 <<= v3",
+             "    v4 >>= v4",
+             "  again",
+             "}",
+             ": main"]
+    lines += ["  multiply v{:x} v{:x}".format(6 + n % 3, 9 + n % 3) for n in range(expansions)]
+    return "\n".join(lines)
+
+def counted(expansions):
+    """A macro using CALLS, which can never be replayed."""
+    lines = [":macro count r {", "  i := CALLS", "  r += 1", "}", ": main"]
+    lines += ["  count v{:x}".format(n % 16) for n in range(expansions)]
+    return "\n".join(lines)
+
+SOURCES = {
+    "1000 sprite draws": lambda: sprites(1000),
+    "300 multiplies": lambda: math(300),
+    "1000 CALLS expansions": lambda: counted(1000),
+    "manymacro.8o": lambda: open("test/testdata/manymacro.8o").read(),
+}
+
+def nested(depth, tokens):
+    """A chain of macros depth deep, expanded to about tokens tokens."""
+    lines = [":macro m0 { v0 += 1 }"]
+    lines += [":macro m{} {{ m{} }}".format(n, n - 1) for n in range(1, depth + 1)]
+    lines.append(": main")
+    lines += ["  m{}".format(depth)] * max(1, tokens // (depth + 3))
+    return "\n".join(lines)
+
+DEPTHS = (1, 10, 50, 200)
+
+def measure(source, cache_size, repeat=5):
+    """Best time to assemble the source, and the ROM."""
+    Parser.expansion_cache_size = cache_size
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        program = assemble(io.StringIO(source))
+        best = min(best, time.perf_counter() - start)
+    if program.error is not None:
+        raise program.error
+    return best, program.program
+
+def main(out=sys.stdout):
+    cache_size = Parser.expansion_cache_size
+    out.write("{:<30} {:>10} {:>10} {:>8}\n".format("source", "parsed ms", "cached ms", "speedup"))
+    try:
+        for name, make_source in SOURCES.items():
+            source = make_source()
+            parsed, expected = measure(source, 0)
+            cached, rom = measure(source, cache_size)
+            assert rom == expected, name
+            out.write("{:<30} {:>10.2f} {:>10.2f} {:>7.1f}x\n".format(
+                name, parsed * 1000, cached * 1000, parsed / cached))
+    finally:
+        Parser.expansion_cache_size = cache_size
+
+    out.write("\n{:<30} {:>10} {:>10}\n".format("nesting depth", "ms", "us/token"))
+    for depth in DEPTHS:
+        tokens = 30000
+        seconds, _ = measure(nested(depth, tokens), cache_size)
+        out.write("{:<30} {:>10.2f} {:>10.2f}\n".format(depth, seconds * 1000, seconds / tokens * 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Peak memory and throughput of assembling a very large generated source, read
+as text lines and scanned from a memory map. Each run is in a fresh process,
+so its peak RSS is its own.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+ROWS_PER_LEVEL = 2048
+
+def write_source(path, megabytes):
+    """
+    Level data, as an asset pipeline would write it: rows of bytes with
+    comments, each level placed over the last with :org so the ROM stays small.
+    """
+    with open(path, "w") as f:
+        f.write(": main\n  jump main\n")
+        level = 0
+        while f.tell() < megabytes << 20:
+            f.write("# level {}\n:org 0x1000\n: level{}\n".format(level, level))
+            for row in range(ROWS_PER_LEVEL):
+                data = " ".join("0x{:02X}".format((level + row + n) & 0xFF) for n in range(16))
+                f.write("  {}  # level {} row {}\n".format(data, level, row))
+            level += 1
+
+CHILD = """
+import collections, resource, sys, time
+from octopy.assemble import assemble_file, mapped
+from octopy.tokenizer import tokenize, tokenize_bytes
+path, use_mmap = sys.argv[1], sys.argv[2] == "mmap"
+
+start = time.perf_counter()
+if use_mmap:
+    with mapped(path) as buffer:
+        collections.deque(tokenize_bytes(buffer), 0)
+else:
+    with open(path) as f:
+        collections.deque(tokenize(f), 0)
+scanned = time.perf_counter() - start
+
+start = time.perf_counter()
+program = assemble_file(path, use_mmap=use_mmap)
+assembled = time.perf_counter() - start
+assert program.error is None, program.error
+print(scanned, assembled, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def measure(path, mode):
+    """
+    Seconds taken to tokenize and to assemble, and peak RSS in KiB, in a new
+    process.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, "-c", CHILD, path, mode], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    scanned, assembled, rss = output.split()
+    return float(scanned), float(assembled), int(rss)
+
+def main(out=sys.stdout, megabytes=(4, 32)):
+    out.write("{:<10} {:<6} {:>12} {:>14} {:>14}\n".format(
+        "source", "path", "peak RSS KiB", "tokenize MB/s", "assemble MB/s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in megabytes:
+            path = os.path.join(tmp, "levels{}.8o".format(size))
+            write_source(path, size)
+            actual = os.path.getsize(path) / 1e6
+            for mode in ("lines", "mmap"):
+                scanned, assembled, rss = measure(path, mode)
+                out.write("{:<10} {:<6} {:>12,} {:>14.2f} {:>14.2f}\n".format(
+                    "{:.0f} MB".format(actual), mode, rss, actual / scanned, actual / assembled))
+
+if __name__ == "__main__":
+    main()
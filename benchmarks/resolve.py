@@ -0,0 +1,40 @@
+"""
+Linking time: Program.resolve() on ROMs with thousands of forward calls, and
+Program.relink() moving one of the labels they call.
+"""
+import io
+import sys
+import time
+
+from octopy.assemble import assemble
+
+def forward_calls(sites, labels=200):
+    lines = [": main"]
+    for n in range(sites // 2):
+        lines.append("f{} f{}".format(n % labels, n * 7 % labels))
+    lines.extend(": f{} ;".format(n) for n in range(labels))
+    return "\n".join(lines)
+
+def measure(sites, repeat=5):
+    """Best seconds to resolve, and to relink one label, and the ROM size."""
+    source = forward_calls(sites)
+    resolve = relink = float("inf")
+    for _ in range(repeat):
+        program = assemble(io.StringIO(source))
+        start = time.perf_counter()
+        program.resolve()
+        resolve = min(resolve, time.perf_counter() - start)
+        start = time.perf_counter()
+        program.relink({"f3": program.labels["f3"] + 2})
+        relink = min(relink, time.perf_counter() - start)
+    return resolve, relink, len(program.program)
+
+def main(out=sys.stdout):
+    out.write("{:>8} {:>10} {:>12} {:>12}\n".format("sites", "bytes", "resolve ms", "relink ms"))
+    for sites in (1000, 4000, 16000):
+        resolve, relink, size = measure(sites)
+        out.write("{:>8,} {:>10,} {:>12.3f} {:>12.3f}\n".format(
+            sites, size, resolve * 1000, relink * 1000))
+
+if __name__ == "__main__":
+    main()
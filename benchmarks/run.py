@@ -0,0 +1,33 @@
+"""
+Headless running: frames per second for the test programs that run as games,
+at Octo's 20 cycles a frame and at 1000 (XO-Chip speed).
+"""
+import os
+import sys
+import time
+
+from octopy.assemble import assemble_file
+from octopy.run import run
+
+TESTDATA = os.path.join(os.path.dirname(__file__), os.pardir, "test", "testdata")
+GAMES = ("clostro.8o", "fibble.8o", "octoballs.8o", "octolines.8o", "sinusoid.8o")
+
+def measure(path, cycles, frames=600, repeat=3):
+    """Best frames per second running path."""
+    program = assemble_file(path)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(program, frames, cycles=cycles)
+        best = min(best, time.perf_counter() - start)
+    return frames / best
+
+def main(out=sys.stdout):
+    out.write("{:<16} {:>12} {:>12}\n".format("program", "fps @20", "fps @1000"))
+    for name in GAMES:
+        path = os.path.join(TESTDATA, name)
+        out.write("{:<16} {:>12,.0f} {:>12,.0f}\n".format(
+            name, measure(path, 20), measure(path, 1000, frames=60)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Per-call cost of assembling small programs in-process, with assemble() on a
+file-like object and with an AssemblerSession. A session's overhead is what
+it adds to assemble() on an empty source; exits with 1 if that's over
+OVERHEAD_BUDGET. It's measured against assemble(), rather than on its own,
+so that the gate doesn't depend on how fast the machine is.
+"""
+import io
+import os
+import sys
+import time
+
+from octopy.assemble import assemble
+from octopy.session import AssemblerSession
+
+testdata = os.path.join(os.path.dirname(__file__), os.pardir, "test", "testdata")
+
+# Microseconds a session may add to assemble() on an empty source.
+OVERHEAD_BUDGET = 5
+
+def small_programs():
+    yield "empty", ""
+    yield "one statement", ": main ;"
+    yield "loop", ": main\n    v0 := 0\n    loop\n        v0 += 1\n        if v0 == 8 then return\n    again\n"
+    with open(os.path.join(testdata, "octoballs.8o")) as src:
+        yield "octoballs.8o", src.read()
+
+def per_call(functions, calls=2000, repeat=5):
+    """
+    Best microseconds per call of each function, taking turns so that they
+    all see the same load.
+    """
+    best = [float("inf")] * len(functions)
+    for _ in range(repeat):
+        for index, function in enumerate(functions):
+            start = time.perf_counter()
+            for _ in range(calls):
+                function()
+            best[index] = min(best[index], (time.perf_counter() - start) / calls)
+    return [seconds * 1e6 for seconds in best]
+
+def main(out=sys.stdout):
+    session = AssemblerSession()
+    overhead = None
+    out.write("{:<16} {:>8} {:>14} {:>14}\n".format("program", "bytes", "assemble() µs", "session µs"))
+    for name, text in small_programs():
+        plain, sessioned = per_call((lambda text=text: assemble(io.StringIO(text)),
+                                     lambda text=text: session.assemble(text)))
+        if overhead is None:
+            overhead = sessioned - plain
+        out.write("{:<16} {:>8} {:>14.1f} {:>14.1f}\n".format(
+            name, len(text), plain, sessioned))
+
+    out.write("\nsession overhead {:.1f}µs over assemble() (budget {}µs)\n".format(
+        overhead, OVERHEAD_BUDGET))
+    return 1 if overhead > OVERHEAD_BUDGET else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Statement dispatch throughput, in statements per second, for macro heavy and
+data heavy sources. Each source is also assembled with the old dispatch, which
+looked every statement up by formatting a method name after trying all the
+other interpretations, to show the difference the keyword table makes.
+"""
+import io
+import os
+import sys
+import time
+
+from octopy.assemble import assemble
+from octopy.parser import Parser, ParseError
+
+testdata = os.path.join(os.path.dirname(__file__), os.pardir, "test", "testdata")
+
+def testsource(name):
+    with open(os.path.join(testdata, name)) as src:
+        return src.read()
+
+def data_table(rows):
+    lines = [": main", "  i := table", "  load v7", "  jump main", ": table"]
+    lines += ["  0x{:02X} 0x{:02X} 0x{:02X} 0x{:02X} 0xFF".format(n & 0xFF, n >> 8, n % 7, n % 3)
+              for n in range(rows)]
+    return "\n".join(lines)
+
+def statement_heavy(count):
+    lines = [": main"]
+    for n in range(count):
+        lines += ["  clear", "  v0 := {}".format(n & 0xFF), "  i := hex v0",
+                  "  sprite v1 v2 5", "  if v0 == 3 then return", "  loop again"]
+    return "\n".join(lines)
+
+SOURCES = {
+    "octoballs.8o": lambda: testsource("octoballs.8o"),
+    "sinusoid.8o": lambda: testsource("sinusoid.8o"),
+    "data table (5000 rows)": lambda: data_table(5000),
+    "statements (2000 blocks)": lambda: statement_heavy(2000),
+}
+
+def legacy_expect_statement(self):
+    """The statement dispatch as it was before the keyword table."""
+    # pylint: disable=protected-access
+    start_type = "Parsing Statement"
+    try:
+        start_token = self.tokenizer.current()
+        cur = self.tokenizer.current().text
+        if cur in self.macros:
+            start_type = "Emitting Macro"
+            self.emit_macro()
+        elif self.tokenizer.accept_register() is not None:
+            self._Parser__expect_register_operation()
+        elif cur == ":":
+            self._Parser__handle_label()
+        elif cur == ";":
+            self._Parser__handle_return()
+        elif cur in self.emitter.labels:
+            self.emitter.CALL(self.tokenizer.expect_ident())
+        else:
+            num = self.tokenizer.accept_byte()
+            if num is not None:
+                self.emitter.emit_byte(num)
+            else:
+                methname = "_Parser__handle_{}".format(cur.replace(":", "").replace("-", "_"))
+                meth = getattr(self, methname, self.named_call)
+                meth()
+    except Exception as e:
+        raise ParseError("{}".format(start_type), start_token) from e
+
+def count_statements(source):
+    count = 0
+    expect_statement = Parser._Parser__expect_statement
+    def counting(self):
+        nonlocal count
+        count += 1
+        expect_statement(self)
+    Parser._Parser__expect_statement = counting
+    try:
+        assemble(io.StringIO(source))
+    finally:
+        Parser._Parser__expect_statement = expect_statement
+    return count
+
+def timed(source):
+    start = time.perf_counter()
+    program = assemble(io.StringIO(source))
+    elapsed = time.perf_counter() - start
+    if program.error is not None:
+        raise Exception("benchmark source failed to assemble: {}".format(program.error))
+    return elapsed
+
+def measure(source, repeat=7):
+    """
+    Statements per second with the current dispatch and with the old one.
+    Runs alternate between the two, so that noise affects both alike, and the
+    best of each is kept.
+    """
+    statements = count_statements(source)
+    expect_statement = Parser._Parser__expect_statement
+    current = legacy = float("inf")
+    try:
+        for _ in range(repeat):
+            Parser._Parser__expect_statement = expect_statement
+            current = min(current, timed(source))
+            Parser._Parser__expect_statement = legacy_expect_statement
+            legacy = min(legacy, timed(source))
+    finally:
+        Parser._Parser__expect_statement = expect_statement
+    return statements / current, statements / legacy
+
+def main(out=sys.stdout):
+    out.write("{:<28} {:>14} {:>14} {:>8}\n".format("source", "stmts/s", "old stmts/s", "speedup"))
+    for name, make_source in SOURCES.items():
+        current, legacy = measure(make_source())
+        out.write("{:<28} {:>14,.0f} {:>14,.0f} {:>7.2f}x\n".format(name, current, legacy, current / legacy))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+The assembler benchmark suite. run times assemble() phase by phase over the
+test/testdata corpus and the stress programs from benchmarks.corpus, records
+throughput and peak memory, and measures how the time for each stress program
+grows with its size. Results are saved as JSON, and compare checks a newer
+set of results against an older one, exiting with 1 if anything regressed:
+
+    PYTHONPATH=. python3 -m benchmarks.suite run -o before.json
+    PYTHONPATH=. python3 -m benchmarks.suite run -o after.json
+    PYTHONPATH=. python3 -m benchmarks.suite compare before.json after.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from octopy.assemble import assemble
+from octopy.parser import Parser
+from octopy.program import Program
+from octopy.tokenizer import Tokenizer, tokenize
+from benchmarks.corpus import STRESS, generate
+
+testdata = os.path.join(os.path.dirname(__file__), os.pardir, "test", "testdata")
+
+SCALES = (1, 2, 4, 8)
+# A growth exponent over this, from the smallest scale to the largest, is
+# flagged as super-linear.
+SUPERLINEAR = 1.25
+
+def corpus():
+    """(name, source) for every test program, then every stress program."""
+    for name in sorted(os.listdir(testdata)):
+        if name.endswith(".8o"):
+            with open(os.path.join(testdata, name)) as src:
+                yield name, src.read()
+    for name in STRESS:
+        yield "stress/{}".format(name), generate(name)
+
+def phases(source):
+    """
+    Seconds spent tokenizing, parsing (with emitting) and resolving. Tokens
+    are made up front, so that parsing can be timed on its own.
+    """
+    start = time.perf_counter()
+    tokens = list(tokenize(source.split("\n")))
+    tokenized = time.perf_counter()
+
+    program = Program()
+    tokenizer = Tokenizer(())
+    tokenizer.tokengen = iter(tokens)
+    Parser(tokenizer, program).parse()
+    parsed = time.perf_counter()
+
+    program.resolve()
+    resolved = time.perf_counter()
+    return {
+        "tokenize": tokenized - start,
+        "parse": parsed - tokenized,
+        "resolve": resolved - parsed,
+    }, len(tokens), len(program.program)
+
+def best_phases(source, repeat):
+    best = None
+    for _ in range(repeat):
+        times, tokens, size = phases(source)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+    return best, tokens, size
+
+def peak_memory(source):
+    """Peak traced memory, in bytes, of one assemble()."""
+    tracemalloc.start()
+    try:
+        program = assemble(io.StringIO(source))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if program.error is not None:
+        raise program.error
+    return peak
+
+def measure_program(source, repeat):
+    times, tokens, size = best_phases(source, repeat)
+    total = sum(times.values())
+    return {
+        "source_bytes": len(source.encode()),
+        "tokens": tokens,
+        "rom_bytes": size,
+        "phases": times,
+        "seconds": total,
+        "tokens_per_second": tokens / total,
+        "mb_per_second": len(source.encode()) / total / 1e6,
+        "peak_memory": peak_memory(source),
+    }
+
+def growth(sizes, seconds):
+    """
+    The exponent k in seconds ~ size^k, from a least squares fit on log
+    scales. 1 is linear.
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(s, 1e-9)) for s in seconds]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+            / sum((x - mean_x) ** 2 for x in xs))
+
+def measure_scaling(name, repeat):
+    # Sizes are in tokens, since indentation grows faster than the code does.
+    sizes, seconds = [], []
+    for scale in SCALES:
+        source = generate(name, scale)
+        best = min(time_assemble(source) for _ in range(repeat))
+        sizes.append(sum(1 for _ in tokenize(source.split("\n"))))
+        seconds.append(best)
+    exponent = growth(sizes, seconds)
+    return {
+        "scales": list(SCALES),
+        "tokens": sizes,
+        "seconds": seconds,
+        "exponent": exponent,
+        "superlinear": exponent > SUPERLINEAR,
+    }
+
+def time_assemble(source):
+    start = time.perf_counter()
+    program = assemble(io.StringIO(source))
+    seconds = time.perf_counter() - start
+    if program.error is not None:
+        raise program.error
+    return seconds
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(repeat, out=sys.stdout):
+    results = {
+        "meta": {
+            "commit": commit(),
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+        },
+        "programs": {},
+        "scaling": {},
+    }
+    out.write("{:<24} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}\n".format(
+        "program", "tokenize", "parse", "resolve", "total ms", "tokens/s", "peak KiB"))
+    for name, source in corpus():
+        result = results["programs"][name] = measure_program(source, repeat)
+        phase_ms = [result["phases"][phase] * 1000 for phase in ("tokenize", "parse", "resolve")]
+        out.write("{:<24} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>10,.0f} {:>10,}\n".format(
+            name, *phase_ms, result["seconds"] * 1000, result["tokens_per_second"],
+            result["peak_memory"] // 1024))
+
+    out.write("\n{:<24} {}\n".format("scaling", "   ".join(
+        "x{} ms".format(scale) for scale in SCALES) + "   exponent"))
+    for name in STRESS:
+        result = results["scaling"][name] = measure_scaling(name, repeat)
+        out.write("{:<24} {}   {:.2f}{}\n".format(
+            name, " ".join("{:>7.1f}".format(s * 1000) for s in result["seconds"]),
+            result["exponent"], "  SUPER-LINEAR" if result["superlinear"] else ""))
+    return results
+
+def compare(old, new, threshold, out=sys.stdout):
+    """
+    Print how the new results differ from the old, and return the number of
+    regressions: programs that got slower or used more memory by more than
+    threshold (as a fraction), and scaling that got worse.
+    """
+    regressions = 0
+    out.write("{:<24} {:>10} {:>10} {:>8} {:>10}\n".format(
+        "program", "old ms", "new ms", "change", "memory"))
+    for name, after in new["programs"].items():
+        before = old["programs"].get(name)
+        if before is None:
+            continue
+        change = after["seconds"] / before["seconds"] - 1
+        memory = after["peak_memory"] / before["peak_memory"] - 1
+        # Differences under a tenth of a millisecond are noise.
+        slower = change > threshold and after["seconds"] - before["seconds"] > 1e-4
+        bigger = memory > threshold
+        flags = "  REGRESSION" if slower or bigger else ""
+        regressions += slower or bigger
+        out.write("{:<24} {:>10.2f} {:>10.2f} {:>+7.0%} {:>+9.0%}{}\n".format(
+            name, before["seconds"] * 1000, after["seconds"] * 1000, change, memory, flags))
+
+    out.write("\n{:<24} {:>10} {:>10}\n".format("scaling", "old", "new"))
+    for name, after in new["scaling"].items():
+        before = old["scaling"].get(name)
+        if before is None:
+            continue
+        worse = after["superlinear"] and after["exponent"] > before["exponent"] + 0.1
+        regressions += worse
+        out.write("{:<24} {:>10.2f} {:>10.2f}{}\n".format(
+            name, before["exponent"], after["exponent"], "  REGRESSION" if worse else ""))
+
+    out.write("\n{} regression{}\n".format(regressions, "" if regressions == 1 else "s"))
+    return regressions
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog="benchmarks.suite", description=__doc__.split("\n\n")[0])
+    commands = argparser.add_subparsers(dest="command", required=True)
+    runner = commands.add_parser("run", help="run the suite")
+    runner.add_argument("-o", "--output", help="save the results to this JSON file")
+    runner.add_argument("-r", "--repeat", type=int, default=3,
+                        help="runs of each measurement, keeping the best (default: 3)")
+    comparer = commands.add_parser("compare", help="compare two saved results")
+    comparer.add_argument("old")
+    comparer.add_argument("new")
+    comparer.add_argument("-t", "--threshold", type=float, default=0.10,
+                          help="fraction by which a result may get worse (default: 0.10)")
+    args = argparser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.repeat)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    return 1 if compare(old, new, args.threshold) else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""
+Symbolizing trace addresses with a binary symbol index: lookups per second
+one at a time (label_at) and a whole trace at once (labels_at), against
+reading the text .sym file back in with regular expressions.
+"""
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from octopy.assemble import assemble
+from octopy.symbols import write_symbols
+from octopy.symindex import SymbolIndex, write_symbol_index
+
+SYMBOL = re.compile(r"^(\S+) = (0x[0-9A-F]+)$", re.M)
+
+def source(labels):
+    return "\n".join(": l{} v0 := {}".format(n, n % 256) for n in range(labels)) + "\n: main jump main"
+
+def measure(labels, lookups=200000):
+    """Seconds to parse the text symbols, open the index, and look up each way."""
+    program = assemble(io.StringIO(source(labels)))
+    text = io.StringIO()
+    write_symbols(program, text)
+    start = time.perf_counter()
+    parsed = {name: int(pc, 16) for (name, pc) in SYMBOL.findall(text.getvalue())}
+    parse = time.perf_counter() - start
+    assert len(parsed) >= labels
+
+    fd, path = tempfile.mkstemp(suffix=".symx")
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            write_symbol_index(program, fout)
+        rng = random.Random(0)
+        trace = [rng.randrange(0x200, 0x200 + len(program.program)) for _ in range(lookups)]
+        start = time.perf_counter()
+        index = SymbolIndex(path)
+        load = time.perf_counter() - start
+        with index:
+            start = time.perf_counter()
+            for address in trace:
+                index.label_at(address)
+            single = time.perf_counter() - start
+            start = time.perf_counter()
+            index.labels_at(trace)
+            batch = time.perf_counter() - start
+    finally:
+        os.unlink(path)
+    return parse, load, lookups / single, lookups / batch
+
+def main(out=sys.stdout):
+    out.write("{:>8} {:>12} {:>12} {:>14} {:>14}\n".format(
+        "labels", "parse ms", "mmap ms", "label_at/s", "labels_at/s"))
+    for labels in (100, 1000, 10000):
+        parse, load, single, batch = measure(labels)
+        out.write("{:>8,} {:>12.3f} {:>12.3f} {:>14,.0f} {:>14,.0f}\n".format(
+            labels, parse * 1000, load * 1000, single, batch))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Memory and garbage collector load of macro heavy sources, against the tree
+from before the TokenStore, when every macro body and cluster was a list of
+Tokens. That tree is exported from git (the parent of the commit that added
+the TokenStore, or the revision given), and each assembly is run in a new
+process, with one tree or the other on its path:
+
+    PYTHONPATH=. python3 -m benchmarks.tokens [revision]
+"""
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+CHILD = """
+import gc, io, sys, time, tracemalloc
+from octopy.assemble import assemble
+source = sys.stdin.read()
+gc.collect()
+collections = gc.get_stats()[0]["collections"]
+tracemalloc.start()
+start = time.perf_counter()
+program = assemble(io.StringIO(source))
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+assert program.error is None, program.error
+print(elapsed, peak, gc.get_stats()[0]["collections"] - collections)
+"""
+
+def macro_heavy(expansions, body_lines=10):
+    lines = [":macro draw x y spr {"]
+    for n in range(body_lines):
+        lines.append("  i := spr v{:x} := x v{:x} := y sprite v{:x} v{:x} {}".format(
+            n % 8, 8 + n % 8, n % 8, 8 + n % 8, n % 15 + 1))
+    lines.append("}")
+    # Sprites first, so they have addresses that fit however big main gets.
+    lines += [": sprite{} 0xFF".format(n) for n in range(4)]
+    lines.append(": main")
+    lines += ["  draw {} {} sprite{}".format(n % 64, n % 32, n % 4) for n in range(expansions)]
+    return "\n".join(lines)
+
+def library(macros, used, body_lines=10):
+    """Many macros defined, as in a shared library, but only a few used."""
+    lines = []
+    for m in range(macros):
+        lines.append(":macro lib{} x y {{".format(m))
+        lines += ["  v{:x} := x v{:x} += y".format(n % 16, n % 16) for n in range(body_lines)]
+        lines.append("}")
+    lines.append(": main")
+    lines += ["  lib{} {} {}".format(m, m % 256, m % 7) for m in range(used)]
+    return "\n".join(lines)
+
+SOURCES = {
+    "2000 expansions of 40 tokens": lambda: macro_heavy(2000),
+    "500 expansions of 200 tokens": lambda: macro_heavy(500, 50),
+    "library of 1000 macros, 20 used": lambda: library(1000, 20),
+}
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=ROOT, check=True,
+                          stdout=subprocess.PIPE).stdout
+
+def before_token_store():
+    """The revision before the one that added the TokenStore."""
+    added = git("log", "--reverse", "--format=%H", "-S", "class TokenStore",
+                "--", "octopy/tokenizer.py").split()
+    return added[0].decode() + "^"
+
+def export(revision, directory):
+    """Write the octopy package as it was at revision into directory."""
+    with tarfile.open(fileobj=io.BytesIO(git("archive", revision, "octopy"))) as archive:
+        archive.extractall(directory)
+
+def profile(source, tree):
+    """
+    Seconds taken, peak traced memory in bytes, and young generation
+    collections during one assembly, with the octopy package in tree.
+    """
+    # Run from tree too, since python -c puts the working directory first.
+    env = dict(os.environ, PYTHONPATH=tree)
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=tree, env=env, input=source,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    seconds, peak, collections = output.split()
+    return float(seconds), int(peak), int(collections)
+
+def main(out=sys.stdout, revision=None):
+    revision = revision or before_token_store()
+    out.write("against {}\n".format(git("rev-parse", "--short", revision).decode().strip()))
+    out.write("{:<32} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}\n".format(
+        "source", "peak KiB", "old KiB", "gen0 gc", "old gen0", "seconds", "old s"))
+    with tempfile.TemporaryDirectory() as before:
+        export(revision, before)
+        for name, make_source in SOURCES.items():
+            source = make_source()
+            seconds, peak, collections = profile(source, ROOT)
+            old_seconds, old_peak, old_collections = profile(source, before)
+            out.write("{:<32} {:>10,.0f} {:>10,.0f} {:>8} {:>10} {:>10.3f} {:>8.3f}\n".format(
+                name, peak / 1024, old_peak / 1024, collections, old_collections, seconds,
+                old_seconds))
+
+if __name__ == "__main__":
+    main(revision=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,24 +1,91 @@
+import json
 import os
 import sys
 
-from octopy.assemble import assemble
+from octopy.assemble import assemble_file
+from octopy.include import default_cache
+from octopy.symbols import write_symbols
+from octopy.symindex import write_symbol_index
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: octoypy <infile.8o>")
+        print("Usage: octoypy [-O] [--prune[=label,...]] [--cost] [--map] [--cache] "
+              "[--stats[=json]] <infile.8o> [outfile.ch8] [outfile.sym]")
+        print("       octoypy batch [-o outdir] [-j jobs] [--cache] <file|dir|glob>...")
+        print("       octoypy serve [--socket path] [--watch dir]")
+        print("       octoypy run [-f frames] [-c cycles] <infile.8o>")
         sys.exit()
 
-    f = open(sys.argv[1])
+    if sys.argv[1] == "batch":
+        from octopy.batch import main
+        sys.exit(main(sys.argv[2:]))
+
+    if sys.argv[1] == "serve":
+        from octopy.server import main
+        sys.exit(main(sys.argv[2:]))
+
+    if sys.argv[1] == "run":
+        from octopy.run import main
+        sys.exit(main(sys.argv[2:]))
+
+    stats, stats_format = None, "table"
+    for flag in ("--stats", "--stats=table", "--stats=json"):
+        if flag in sys.argv:
+            from octopy.stats import Stats
+            stats = Stats()
+            stats_format = flag.partition("=")[2] or "table"
+            sys.argv.remove(flag)
+
+    optimize = "-O" in sys.argv
+    if optimize:
+        sys.argv.remove("-O")
+
+    cost = "--cost" in sys.argv
+    if cost:
+        sys.argv.remove("--cost")
+
+    source_map = "--map" in sys.argv
+    if source_map:
+        sys.argv.remove("--map")
+
+    cache = None
+    if "--cache" in sys.argv:
+        cache = default_cache()
+        sys.argv.remove("--cache")
+
+    prune, keep = False, ()
+    for arg in sys.argv[1:]:
+        if arg == "--prune" or arg.startswith("--prune="):
+            prune = True
+            keep = tuple(name for name in arg.partition("=")[2].split(",") if name)
+            sys.argv.remove(arg)
 
     path, filename = os.path.split(sys.argv[1])
     basename, ext = os.path.splitext(filename)
 
 
-    program = assemble(f)
+    program = assemble_file(sys.argv[1], hooks=stats, optimize=optimize, prune=prune, keep=keep,
+                            source_map=source_map, recover=True, cache=cache)
+
+    if stats is not None:
+        if stats_format == "json":
+            print(json.dumps(stats.as_dict(), indent=2), file=sys.stderr)
+        else:
+            print(stats.table(), file=sys.stderr)
+
+    if program.pruning is not None:
+        print(program.pruning.table(), file=sys.stderr)
+
+    if program.report is not None:
+        print(program.report.table(), file=sys.stderr)
+
+    if cost and program.error is None:
+        from octopy.cost import analyze
+        print(analyze(program).table(), file=sys.stderr)
 
     if program.error is not None:
         print("Assembly failed:")
-        print(program.error)
+        print("\n\n".join(str(error) for error in program.errors))
         sys.exit(-1)
 
     if len(sys.argv) > 2:
@@ -34,23 +101,12 @@ if __name__ == "__main__":
         outname = basename + ".sym"
 
     fout = open(outname, 'w')
-    for name, pc in program.labels.items():
-        fout.write("{} = 0x{:04X}\n".format(name, pc))
-    for name, pc in program.consts.items():
-        if name not in program.labels:
-            fout.write("{} = {}\n".format(name, pc))
-
-    breakpoints = program.debugger.breakpoints
-
-    for name, (token, pc) in breakpoints.items():
-        fout.write("{} = 0x{:04X}   # breakpoint: {}\n".format(name, pc, token))
-
-    format_breakpoint = "0x{:04X}".format
-    formatted_breakpoints = (format_breakpoint(pc) for (token, pc) in breakpoints.values())
-    fout.write("breakpoints=[{}]\n".format(", ".join(formatted_breakpoints)))
+    write_symbols(program, fout)
 
-    format_monitor = "(0x{:04X}, {})".format
-    monitors = program.debugger.monitors
-    formatted_monitors = (format_monitor(addr, monlen) for (addr, monlen) in monitors)
+    with open(os.path.splitext(outname)[0] + ".symx", "wb") as fout:
+        write_symbol_index(program, fout)
 
-    fout.write("monitors=[{}]\n".format(", ".join(formatted_monitors)))
+    if source_map:
+        from octopy.sourcemap import write_source_map
+        with open(os.path.splitext(outname)[0] + ".map", "wb") as fout:
+            write_source_map(program, fout)
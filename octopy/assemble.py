@@ -1,17 +1,187 @@
+import mmap
+import os
+from contextlib import contextmanager
+
+from octopy.include import Includes
+from octopy.optimize import Optimizer
 from octopy.parser import Parser, ParseError
-from octopy.tokenizer import Tokenizer
-from octopy.program import Program
+from octopy.prune import Pruner
+from octopy.tokenizer import CONSTS, REGISTERS, Tokenizer
+from octopy.program import Program, Unsettled
+from octopy.sourcemap import SourceMap
+from octopy.stats import Instruments
+
+# Sources bigger than this are memory-mapped rather than read as text lines.
+MAP_THRESHOLD = 1 << 20
+
+# Assemblies of a source with :org { } expressions using names defined after
+# them, before giving up on their addresses settling.
+MAX_PASSES = 16
+
+def assemble(f, hooks=None, consts=CONSTS, registers=REGISTERS, optimize=False,
+             prune=False, keep=(), source_map=None, recover=False, includes=None):
+    """
+    Assemble a source, given as an iterable of lines (like an open file), or
+    as its UTF-8 bytes (like an mmap). Events are reported to hooks, if
+    given (see octopy.stats). consts and registers are the names defined
+    before the source starts. With optimize, the code is run through the
+    peephole optimizer before it's resolved, and what it changed is left in
+    program.report (see octopy.optimize). With prune, code and data that
+    nothing reached from main (or the labels in keep) uses are taken out
+    first, and what was taken out is left in program.pruning (see
+    octopy.prune). With source_map, the name of the source, where each
+    byte came from is left in program.source_map (see octopy.sourcemap).
+    With recover, parsing carries on after an error, from the next
+    statement, and every error (every unresolved name among them) is left
+    in program.errors; program.error is the first. Code with errors isn't
+    pruned or optimized. includes finds the files :include reads (see
+    octopy.include); by default, they're found from the working directory,
+    and nothing is cached.
+
+    A source with :org { } expressions using names defined after them is
+    assembled again, guessing the addresses found by the last assembly, until
+    the guesses are right.
+    """
+    hints = ()
+    includes = includes or Includes()
+    for _ in range(MAX_PASSES):
+        # Only the last pass is reported to hooks.
+        instruments = Instruments(hooks) if hooks is not None else None
+        program, unsettled = assemble_once(f, instruments, consts, registers, hints, optimize,
+                                           keep if prune else None, source_map, recover,
+                                           includes)
+        if unsettled is None:
+            break
+        f = rewind(f)
+        if f is None:
+            program.error = ParseError(
+                ":org { } using names defined after it needs a source that can be read again",
+                unsettled.token)
+            program.errors = [program.error]
+            break
+        hints = unsettled.hints
+    else:
+        program.error = ParseError(
+            "addresses from :org {{ }} still changing after {} passes".format(MAX_PASSES),
+            unsettled.token)
+        program.errors = [program.error]
+    if instruments is not None:
+        instruments.finish(program)
+    return program
 
-def assemble(f):
+def assemble_once(f, instruments, consts, registers, hints, optimize=False, keep=None,
+                  source_map=None, recover=False, includes=None):
+    """
+    One assembly of the source, guessing the addresses of :org { } from
+    hints. Returns the program, and the Unsettled raised by resolving it if
+    the guesses were wrong. keep is the labels to prune from, as well as
+    main, or None not to prune. source_map is the name of the source to
+    map, or None not to. With recover, errors are collected rather than
+    stopping the assembly. includes reads the files included. instruments
+    are told about the assembly, if given (see octopy.stats).
+    """
     program = Program()
-    tokenizer = Tokenizer(f)
+    program.hints = hints
+    if source_map is not None:
+        program.source_map = SourceMap(source_map)
+    program.symbolic = optimize or keep is not None
+    report = pruning = None
+    tokenizer = Tokenizer(f, consts, registers)
+    if instruments is not None:
+        instruments.tokenizer(tokenizer)
+        program.hooks = instruments
+    unsettled = parser = None
+    errors = [] if recover else None
     try:
-        parser = Parser(tokenizer, program)
+        parser = Parser(tokenizer, program, errors=errors, includes=includes,
+                        hooks=instruments)
         parser.parse()
-        program.resolve()
+        if not errors:
+            labels = dict(program.labels)
+            if keep is not None:
+                pruning = Pruner(program, keep).run()
+            if optimize:
+                report = Optimizer(program).run()
+            move_consts(tokenizer.consts, labels, program.labels)
+        if instruments is not None:
+            instruments.switch("resolve")
+        program.resolve(errors)
 
     except ParseError as error:
         program.error = error
+    except Unsettled as error:
+        unsettled = error
+
+    if errors:
+        if program.error is not None:
+            errors.append(program.error)
+        program.errors = errors
+        program.error = errors[0]
+    elif program.error is not None:
+        program.errors = [program.error]
 
     program.consts = tokenizer.consts
-    return program
+    program.consts.update(program.calculated)
+    if parser is not None:
+        program.includes = parser.included
+    program.report = report
+    program.pruning = pruning
+    if pruning is not None:
+        for name in pruning.dropped:
+            program.consts.pop(name, None)
+    return program, unsettled
+
+def move_consts(consts, before, labels):
+    """
+    Move the consts that are labels from where they were before to where
+    they are now, for the :calc expressions left until the program is
+    resolved, which read the labels they use from the consts.
+    """
+    for name, pc in before.items():
+        if name in labels and consts.get(name) == pc:
+            consts[name] = labels[name]
+
+def rewind(source):
+    """The source, ready to be read again from the start, or None."""
+    if isinstance(source, (bytes, bytearray, mmap.mmap, list, tuple)):
+        return source
+    if hasattr(source, "seek"):
+        source.seek(0)
+        return source
+    return None
+
+@contextmanager
+def mapped(path):
+    """The contents of a file, memory-mapped read-only."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped.
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+def assemble_file(path, use_mmap=None, hooks=None, consts=CONSTS, registers=REGISTERS,
+                  optimize=False, prune=False, keep=(), source_map=False, recover=False,
+                  cache=None, jobs=None):
+    """
+    Assemble the source file at path. By default, big files are scanned
+    straight from a memory map, so that memory use stays bounded however big
+    they are. With source_map, program.source_map is kept, naming the file
+    as path. The files it includes are found from the directory it's in,
+    and tokenized before it's parsed, by up to jobs worker processes, and
+    kept in the directory cache if one is given.
+    """
+    source_map = path if source_map else None
+    includes = Includes(path, cache, jobs)
+    if use_mmap is None:
+        use_mmap = os.path.getsize(path) > MAP_THRESHOLD
+    with mapped(path) as buffer:
+        includes.prefetch(buffer)
+        if use_mmap:
+            return assemble(buffer, hooks, consts, registers, optimize, prune, keep, source_map,
+                            recover, includes)
+    # Decoded as UTF-8, like the mapped bytes, whatever the locale.
+    with open(path, encoding="utf-8") as f:
+        return assemble(f, hooks, consts, registers, optimize, prune, keep, source_map, recover,
+                        includes)
@@ -0,0 +1,168 @@
+"""
+Batch assembly of many sources at once.
+
+Inputs may be files, directories (searched recursively for .8o files) or glob
+patterns. Sources are spread across a pool of worker processes, so the
+interpreter start-up is paid once per worker rather than once per file, and the
+.ch8/.sym outputs are written into a tree under the output directory that
+mirrors the layout of the inputs.
+"""
+import argparse
+import glob
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from octopy.assemble import assemble_file
+from octopy.include import default_cache
+from octopy.symbols import write_symbols
+from octopy.symindex import write_symbol_index
+
+# Exit codes, so CI can tell a broken source from a broken invocation.
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+SOURCE_EXT = ".8o"
+
+class Job(NamedTuple):
+    source: str
+    outbase: str
+    # Where to keep tokenized includes, if anywhere.
+    cache: str = None
+    # The source of an earlier job with the same outbase, if there is one.
+    clash: str = None
+
+class Result(NamedTuple):
+    source: str
+    error: str
+    size: int
+
+def glob_root(pattern):
+    """
+    The leading part of a glob pattern that contains no wildcards. Matches are
+    mirrored relative to it.
+    """
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+def find_sources(inputs):
+    """
+    Expand the inputs into (root, source) pairs, where root is the directory
+    the source's output location is mirrored from.
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(SOURCE_EXT):
+                        yield item, os.path.join(dirpath, filename)
+        elif glob.has_magic(item):
+            root = glob_root(item)
+            for source in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(source):
+                    yield root, source
+        else:
+            # Missing files are passed along so they show up as failures.
+            yield os.path.dirname(item) or os.curdir, item
+
+def plan(inputs, outdir, cache=None):
+    jobs = []
+    seen = set()
+    outbases = {}
+    for root, source in find_sources(inputs):
+        source = os.path.normpath(source)
+        if source in seen:
+            continue
+        seen.add(source)
+        relative = os.path.relpath(source, root)
+        # Sources outside of their root (../ in a plain path) keep just their name.
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(source)
+        outbase = os.path.splitext(os.path.join(outdir, relative))[0]
+        # Only the first source to map to an output keeps it; the others fail.
+        clash = outbases.setdefault(os.path.normcase(os.path.abspath(outbase)), source)
+        jobs.append(Job(source, outbase, cache, None if clash == source else clash))
+    return jobs
+
+def build(job):
+    """
+    Assemble a single source and write its outputs. Runs in a worker process,
+    so errors are returned as text rather than raised.
+    """
+    if job.clash is not None:
+        return Result(job.source, "would overwrite the outputs of {}".format(job.clash), 0)
+    try:
+        return assemble_job(job)
+    except (OSError, UnicodeDecodeError) as error:
+        return Result(job.source, str(error), 0)
+    except Exception: # pylint: disable=broad-except
+        # A crash is this source's failure, rather than the end of the batch.
+        return Result(job.source, "assembler crash:\n" + traceback.format_exc(), 0)
+
+def assemble_job(job):
+    # The sources are already spread across processes, so their includes
+    # are tokenized where they are.
+    program = assemble_file(job.source, cache=job.cache, jobs=1)
+    if program.error is not None:
+        return Result(job.source, str(program.error), 0)
+
+    os.makedirs(os.path.dirname(job.outbase) or os.curdir, exist_ok=True)
+    with open(job.outbase + ".ch8", "wb") as fout:
+        fout.write(program.program)
+    with open(job.outbase + ".sym", "w", encoding="utf-8") as fout:
+        write_symbols(program, fout)
+    with open(job.outbase + ".symx", "wb") as fout:
+        write_symbol_index(program, fout)
+    return Result(job.source, None, len(program.program))
+
+def run(jobs, workers):
+    """
+    Build all of the jobs, yielding results in job order.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(build, jobs)
+        return
+
+    # Several jobs per round trip keeps the pool busy on catalogs of small files.
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(build, jobs, chunksize=chunksize)
+
+def report(results, out=sys.stdout, err=sys.stderr):
+    """
+    Write each failure to err, then a summary to out. Returns the exit code.
+    """
+    failures = [result for result in results if result.error is not None]
+    for result in failures:
+        err.write("{}:\n".format(result.source))
+        for line in result.error.splitlines():
+            err.write("    {}\n".format(line))
+    out.write("{} assembled, {} failed\n".format(len(results) - len(failures), len(failures)))
+    return EXIT_FAILED if failures else EXIT_OK
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog="octopy batch", description="Assemble many sources.")
+    argparser.add_argument("inputs", nargs="+", help="source files, directories or globs")
+    argparser.add_argument("-o", "--outdir", default=os.curdir, help="root of the output tree")
+    argparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                           help="worker processes (default: one per core)")
+    argparser.add_argument("--cache", action="store_true",
+                           help="keep tokenized includes in {}".format(default_cache()))
+    # argparse exits with status 2 (EXIT_USAGE) on bad arguments.
+    args = argparser.parse_args(argv)
+
+    jobs = plan(args.inputs, args.outdir, default_cache() if args.cache else None)
+    if len(jobs) == 0:
+        print("No sources found", file=sys.stderr)
+        return EXIT_USAGE
+
+    results = list(run(jobs, min(args.jobs, len(jobs))))
+    return report(results)
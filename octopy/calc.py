@@ -1,7 +1,12 @@
+import copy
 import math
 import operator
+from collections import ChainMap
+from functools import lru_cache
+from typing import NamedTuple
 
 from octopy.errors import ParseError
+from octopy.tokenizer import Kind, classify
 
 def calc(tokenizer, rom_lookup, group_open=None):
     result = 0
@@ -83,3 +88,184 @@ standard_unary_ops = {
     #"@": is per-copy
     #"strlen": strlen, TODO
 }
+
+# "@" is unary too, but looks up the ROM passed in at evaluation.
+unary_op_names = frozenset(standard_unary_ops).union(("@",))
+
+class Interpret(Exception):
+    """
+    Raised when only calc() can say what an expression means, or report what
+    is wrong with it.
+    """
+
+class Constant(NamedTuple):
+    value: object
+
+@lru_cache(maxsize=1 << 12)
+def compile_expression(texts):
+    """
+    Compile an expression, given as the texts of its tokens in source order,
+    into a function of (consts, calls, rom_lookup) that gives what calc()
+    would, with the parts that don't use any names worked out up front.
+    Returns None for expressions calc() would reject.
+
+    The function raises Interpret if the expression uses a name that isn't
+    defined, or a name that's defined but was compiled as an operator or
+    literal, so calc() can be used instead.
+    """
+    guards = set()
+    try:
+        tree = compile_group(iter(reversed(texts)), guards)
+    except Interpret:
+        return None
+    compiled = evaluator(tree)
+    if not guards:
+        return compiled
+    guards = frozenset(guards)
+    def guarded(consts, calls, rom_lookup):
+        if any(name in consts for name in guards):
+            raise Interpret()
+        return compiled(consts, calls, rom_lookup)
+    return guarded
+
+def compile_group(texts, guards, group_open=None):
+    """
+    Mirrors calc(), reading the texts last first, but builds the expression
+    instead of evaluating it.
+    """
+    result = Constant(0)
+    pending_op = "+"
+    text = next(texts, None)
+    while text is not None:
+        if text == "(":
+            if group_open is None:
+                raise Interpret()
+            break
+        if pending_op is not None:
+            if text == ")":
+                num = compile_group(texts, guards, text)
+            else:
+                num = operand(text, guards)
+            if num is None:
+                if pending_op not in unary_op_names or text not in binary_ops:
+                    raise Interpret()
+                result = unary(pending_op, result)
+                pending_op = text
+            else:
+                if pending_op not in binary_ops:
+                    raise Interpret()
+                result = binary(binary_ops[pending_op], num, result)
+                pending_op = None
+        else:
+            pending_op = text
+        text = next(texts, None)
+
+    if pending_op in unary_op_names:
+        result = unary(pending_op, result)
+    elif pending_op in binary_ops:
+        raise Interpret()
+    if group_open is not None and text != "(":
+        raise Interpret()
+    return result
+
+def operand(text, guards):
+    """What calc() would read as a number, or None for an operator."""
+    if text == "CALLS":
+        return lambda consts, calls, rom_lookup: calls[-1]
+    kind, value = classify(text)
+    if kind is Kind.NUMBER:
+        # Consts are looked up first, and can have names like -1.
+        if text[0] in "+-":
+            guards.add(text)
+        return Constant(value)
+    if text in binary_ops:
+        guards.add(text)
+        return None
+    def lookup(consts, _calls, _rom_lookup):
+        value = consts.get(text)
+        if value is None:
+            raise Interpret()
+        return value
+    return lookup
+
+def evaluator(tree):
+    if isinstance(tree, Constant):
+        value = tree.value
+        return lambda consts, calls, rom_lookup: value
+    return tree
+
+def unary(op, tree):
+    if op == "@":
+        inner = evaluator(tree)
+        return lambda consts, calls, rom_lookup: rom_lookup(inner(consts, calls, rom_lookup))
+    function = standard_unary_ops[op]
+    if isinstance(tree, Constant):
+        try:
+            return Constant(function(tree.value))
+        except Exception: # pylint: disable=broad-except
+            # Left for calc() to raise when it's evaluated.
+            pass
+    inner = evaluator(tree)
+    return lambda consts, calls, rom_lookup: function(inner(consts, calls, rom_lookup))
+
+def binary(function, left, right):
+    if isinstance(left, Constant) and isinstance(right, Constant):
+        try:
+            return Constant(function(left.value, right.value))
+        except Exception: # pylint: disable=broad-except
+            pass
+    if isinstance(left, Constant):
+        lvalue = left.value
+        inner = evaluator(right)
+        return lambda consts, calls, rom_lookup: function(lvalue, inner(consts, calls, rom_lookup))
+    if isinstance(right, Constant):
+        rvalue = right.value
+        inner = evaluator(left)
+        return lambda consts, calls, rom_lookup: function(inner(consts, calls, rom_lookup), rvalue)
+    linner, rinner = evaluator(left), evaluator(right)
+    return lambda consts, calls, rom_lookup: function(
+        linner(consts, calls, rom_lookup), rinner(consts, calls, rom_lookup))
+
+
+def evaluate(tokens, tokenizer, rom_lookup):
+    """
+    The value of an expression, given as its tokens in source order, with
+    the consts and CALLS of the tokenizer.
+    """
+    expression = compile_expression(tuple(token.text for token in tokens))
+    if expression is not None:
+        try:
+            return expression(tokenizer.consts, tokenizer.calls, rom_lookup)
+        except Exception: # pylint: disable=broad-except
+            # calc() gives the answer, or the error, for anything unusual.
+            pass
+    return calc(tokenizer.copy(reversed(tokens)), rom_lookup)
+
+def undefined(tokens, consts):
+    """The names used by an expression that aren't defined."""
+    return [token for token in tokens
+            if classify(token.text)[0] is Kind.IDENT and token.text not in consts
+            and token.text not in binary_ops and token.text not in unary_op_names
+            and token.text != "CALLS"]
+
+class Deferred():
+    """
+    An expression using names that weren't defined yet, to be evaluated once
+    they are. The names it used that were defined keep the meaning they had
+    then, as do HERE and CALLS.
+    """
+    def __init__(self, tokens, tokenizer):
+        consts = tokenizer.consts
+        self.tokens = tokens
+        self.known = {token.text: consts[token.text] for token in tokens if token.text in consts}
+        self.consts = consts
+        self.tokenizer = copy.copy(tokenizer)
+        self.tokenizer.calls = tokenizer.calls[-1:]
+
+    def evaluate(self, deferred_consts, rom_lookup):
+        """
+        The value now, looking names up in the consts as they are now, and
+        then in deferred_consts.
+        """
+        self.tokenizer.consts = ChainMap(self.known, self.consts, deferred_consts)
+        return evaluate(self.tokens, self.tokenizer, rom_lookup)
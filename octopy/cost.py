@@ -0,0 +1,316 @@
+"""
+Static cost analysis of an assembled program (octopy --cost).
+
+The code is found by following the control flow of the resolved ROM from
+0x200, and split into subroutines: one starting at 0x200 (main) and one at
+each address something calls. Each subroutine's instructions make a
+control-flow graph, and the targets of its back edges are its loop headers.
+The graph is cut at the loop headers into segments, each running from the
+entry or a loop header to a return, an exit, or the next loop header (the
+same one again being the next time round the loop). For every segment, the
+report gives the fewest and most instructions on a path through it, both on
+its own and including the calls it makes, and lists the expensive
+instructions on the most expensive path:
+
+    sprite      n rows (or 16 for a 16x16 sprite), drawn a row at a time
+    bcd         three bytes stored
+    load/save   n registers
+
+A call counts the entry segment of what it calls, so when that loops, the
+count is only up to its first loop header, and is marked with a +.
+
+Also reported is the deepest call stack that main can reach, or that it is
+unbounded because of recursion. Code reached by jump0 can't be followed, and
+is noted instead.
+"""
+from typing import NamedTuple
+
+from octopy.optimize import EXIT, RETURN, is_skip
+from octopy.run import STACK
+
+class Heavy(NamedTuple):
+    address: int
+    kind: str
+    amount: int
+
+    def __str__(self):
+        return "0x{:04X} {}".format(self.address, summary([self]))
+
+class Segment(NamedTuple):
+    address: int
+    best: int
+    worst: int
+    # Including the calls made on the path.
+    best_calls: int
+    worst_calls: int
+    # Whether something called loops, so worst_calls is only up to its loop.
+    loops: bool
+    heavy: tuple
+
+class Subroutine(NamedTuple):
+    name: str
+    address: int
+    instructions: int
+    segments: tuple
+    calls: tuple
+    # The deepest stack of calls below it, or None if that's unbounded.
+    depth: int
+
+    @property
+    def entry(self):
+        return self.segments[0]
+
+def heavy(op, pc):
+    """The Heavy for op at pc, or None if it isn't one."""
+    kind, x, y, nn = op >> 12, op >> 8 & 0xF, op >> 4 & 0xF, op & 0xFF
+    if kind == 0xD:
+        return Heavy(pc, "sprite", op & 0xF or 16)
+    if kind == 0xF and nn == 0x33:
+        return Heavy(pc, "bcd", 3)
+    if kind == 0xF and nn in (0x55, 0x65):
+        return Heavy(pc, "save" if nn == 0x55 else "load", x + 1)
+    if kind == 0x5 and op & 0xF in (0x2, 0x3):
+        return Heavy(pc, "save" if op & 0xF == 0x2 else "load", abs(x - y) + 1)
+    return None
+
+def summary(instructions):
+    """How many of each kind of Heavy there are, and how much they do."""
+    totals = {}
+    for instruction in instructions:
+        count, amount = totals.get(instruction.kind, (0, 0))
+        totals[instruction.kind] = (count + 1, amount + instruction.amount)
+    units = {"sprite": "rows", "bcd": "bytes"}
+    by_amount = sorted(totals.items(), key=lambda item: -item[1][1])
+    return ", ".join("{} x{} ({} {})".format(kind, count, amount, units.get(kind, "registers"))
+                     for kind, (count, amount) in by_amount)
+
+class Analysis():
+    """
+    Each subroutine, in address order, with the cost of its segments, and
+    the deepest call stack from main (None if unbounded). notes says what
+    couldn't be followed.
+    """
+    def __init__(self):
+        self.subroutines = []
+        self.depth = 0
+        self.notes = []
+
+    def subroutine(self, name):
+        for subroutine in self.subroutines:
+            if subroutine.name == name:
+                return subroutine
+        raise KeyError(name)
+
+    def table(self):
+        depth = "unbounded" if self.depth is None else self.depth
+        lines = ["{:<24}{:>12}".format("subroutines", len(self.subroutines)),
+                 "{:<24}{:>12}".format("stack depth", depth),
+                 "",
+                 "{:<24}{:>8}{:>8}{:>8}{:>10}{:>10}".format(
+                     "subroutine", "address", "best", "worst", "w/ calls", "depth")]
+        for subroutine in self.subroutines:
+            for n, segment in enumerate(subroutine.segments):
+                if n == 0:
+                    name = subroutine.name
+                    depth = "-" if subroutine.depth is None else subroutine.depth
+                else:
+                    name, depth = "  loop", ""
+                calls = "{}{}".format(segment.worst_calls, "+" if segment.loops else "")
+                lines.append("{:<24}  0x{:04X}{:>8}{:>8}{:>10}{:>10}".format(
+                    name, segment.address, segment.best, segment.worst, calls, depth))
+                if segment.heavy:
+                    lines.append("    {}".format(summary(segment.heavy)))
+        if self.depth is not None and self.depth > STACK:
+            lines.append("stack depth {} is more than {}".format(self.depth, STACK))
+        for note in self.notes:
+            lines.append("not followed: {}".format(note))
+        return "\n".join(lines)
+
+class Analyzer():
+    def __init__(self, program):
+        self.program = program
+        self.rom = program.program
+        self.analysis = Analysis()
+        # Subroutines with a path from their entry to a loop.
+        self.looping = set()
+        self.names = {}
+        for name, pc in program.labels.items():
+            self.names.setdefault(pc, name)
+
+    def op(self, pc):
+        offset = pc - 0x200
+        return self.rom[offset] << 8 | self.rom[offset+1]
+
+    def size(self, pc):
+        return 4 if self.inside(pc) and self.op(pc) == 0xF000 else 2
+
+    def inside(self, pc):
+        return 0x200 <= pc and pc - 0x200 + 2 <= len(self.rom)
+
+    def successors(self, pc):
+        """The addresses control goes to after pc, and the address it calls, if any."""
+        op = self.op(pc)
+        kind = op >> 12
+        after = pc + self.size(pc)
+        if op in (RETURN, EXIT):
+            return (), None
+        if kind == 0x1:
+            return (op & 0xFFF,), None
+        if kind == 0x2:
+            return (after,), op & 0xFFF
+        if kind == 0xB:
+            self.analysis.notes.append("jump0 at 0x{:04X}".format(pc))
+            return (), None
+        if is_skip(op):
+            return (after, after + self.size(after)), None
+        return (after,), None
+
+    def graph(self, entry):
+        """The instructions of the subroutine at entry: pc to successors, and what it calls."""
+        graph, calls = {}, []
+        pending = [entry]
+        while pending:
+            pc = pending.pop()
+            if pc in graph:
+                continue
+            if not self.inside(pc):
+                self.analysis.notes.append("0x{:04X} is outside the program".format(pc))
+                graph[pc] = ()
+                continue
+            successors, called = self.successors(pc)
+            graph[pc] = successors
+            pending.extend(successors)
+            if called is not None:
+                calls.append((pc, called))
+        return graph, calls
+
+    def run(self):
+        graphs = {}
+        pending = [0x200]
+        while pending:
+            entry = pending.pop()
+            if entry in graphs:
+                continue
+            graphs[entry] = self.graph(entry)
+            for _, called in graphs[entry][1]:
+                pending.append(called)
+
+        # Callees first, so calls can count them; recursion is left uncounted.
+        order, depths, state = [], {}, {}
+        stack = [(0x200, iter(sorted({called for _, called in graphs[0x200][1]})))]
+        state[0x200] = 1
+        recursive = False
+        while stack:
+            entry, callees = stack[-1]
+            for called in callees:
+                if state.get(called) == 1:
+                    recursive = True
+                elif called not in state:
+                    state[called] = 1
+                    stack.append((called, iter(sorted({c for _, c in graphs[called][1]}))))
+                    break
+            else:
+                stack.pop()
+                state[entry] = 2
+                order.append(entry)
+
+        costs = {}
+        for entry in order:
+            graph, calls = graphs[entry]
+            below = [depths.get(called) for called in {c for _, c in calls}]
+            if any(depth is None for depth in below) or any(
+                    called not in costs for _, called in calls):
+                depth = None
+            else:
+                depth = max((depth + 1 for depth in below), default=0)
+            depths[entry] = depth
+            segments = self.segments(entry, graph, dict(calls), costs)
+            costs[entry] = segments[0]
+            name = self.names.get(entry)
+            if name is None:
+                name = "main" if entry == 0x200 else "0x{:04X}".format(entry)
+            self.analysis.subroutines.append(Subroutine(
+                name, entry, len(graph), tuple(segments),
+                tuple(sorted(self.names.get(called, "0x{:04X}".format(called))
+                             for called in {c for _, c in calls})),
+                depth))
+        self.analysis.subroutines.sort(key=lambda subroutine: subroutine.address)
+        self.analysis.depth = None if recursive else depths[0x200]
+        if recursive:
+            self.analysis.notes.append("recursive calls")
+        self.analysis.notes = list(dict.fromkeys(self.analysis.notes))
+        return self.analysis
+
+    def segments(self, entry, graph, calls, costs):
+        """The segments of the subroutine at entry, the entry's first."""
+        # Depth first, for the back edges (whose targets are the loop
+        # headers) and a post order, which has every other edge's target
+        # before its source.
+        headers, order, state = set(), [], {entry: 1}
+        stack = [(entry, iter(graph[entry]))]
+        while stack:
+            pc, successors = stack[-1]
+            for successor in successors:
+                if state.get(successor) == 1:
+                    headers.add(successor)
+                elif successor not in state:
+                    state[successor] = 1
+                    stack.append((successor, iter(graph[successor])))
+                    break
+            else:
+                stack.pop()
+                state[pc] = 2
+                order.append(pc)
+
+        # Where the count with calls stops short: at a call to something
+        # that loops (or is recursive), and after, back to the start.
+        loops, hits = set(), set()
+        best, worst, best_calls, worst_calls, choice = {}, {}, {}, {}, {}
+        for pc in order:
+            cost = callee_best = callee_worst = 1
+            called = calls.get(pc)
+            if called is not None:
+                callee = costs.get(called)
+                if callee is None:
+                    loops.add(pc)
+                else:
+                    callee_best += callee.best_calls
+                    callee_worst += callee.worst_calls
+                    if callee.loops or callee.address in self.looping:
+                        loops.add(pc)
+            following = [successor for successor in graph[pc] if successor not in headers]
+            ends = len(following) < len(graph[pc]) or not following
+            if len(following) < len(graph[pc]):
+                hits.add(pc)
+            options = [(worst[successor], successor) for successor in following]
+            if ends:
+                options.append((0, None))
+            most, choice[pc] = max(options, key=lambda option: option[0])
+            worst[pc] = cost + most
+            best[pc] = cost + (0 if ends else min(best[s] for s in following))
+            worst_calls[pc] = callee_worst + max(
+                [worst_calls[s] for s in following] + ([0] if ends else []))
+            best_calls[pc] = callee_best + (0 if ends else min(best_calls[s] for s in following))
+            for successor in following:
+                if successor in loops:
+                    loops.add(pc)
+                if successor in hits:
+                    hits.add(pc)
+        if entry in hits:
+            self.looping.add(entry)
+
+        segments = []
+        for start in [entry] + sorted(headers - {entry}):
+            expensive, pc = [], start
+            while pc is not None:
+                instruction = heavy(self.op(pc), pc) if self.inside(pc) else None
+                if instruction is not None:
+                    expensive.append(instruction)
+                pc = choice[pc]
+            segments.append(Segment(start, best[start], worst[start], best_calls[start],
+                                    worst_calls[start], start in loops, tuple(expensive)))
+        return segments
+
+def analyze(program):
+    """The cost Analysis of an assembled program."""
+    return Analyzer(program).run()
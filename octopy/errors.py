@@ -17,3 +17,6 @@ class ParseError(Exception):
             err = err.__cause__
 
         return "\n".join(lines)
+
+class EmitError(ValueError):
+    """Code or data that the program can't put where it was asked to."""
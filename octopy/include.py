@@ -0,0 +1,325 @@
+"""
+:include, and the on-disk cache of tokenized files behind it.
+
+    :include "lib/sprites.8o"
+
+reads the file named (relative to the directory of the file the :include is
+in, with or without the quotes) as if its text were there. A file is only read
+the first time it's included, so libraries can include what they use without
+being read twice; a file that includes itself, directly or through the files
+it includes, is an error. Files can't be included from inside a macro.
+
+Each included file is tokenized once, into columns like a TokenStore's. Before
+parsing starts, prefetch() finds the files the source includes, then the files
+they include, and so on, a level of the graph at a time, tokenizing each level
+across a pool of worker processes when there's enough of it to be worth that.
+Parsing then reads their tokens from memory.
+
+With a cache directory, tokenized files are kept there, named by the SHA-256
+of their contents, so a file that hasn't changed is read back rather than
+tokenized again, whatever it's called and whichever project includes it.
+Nothing is ever removed from the cache. Entries are written like the symbol
+index (see octopy/symindex.py):
+
+    header          HEADER: the magic, the version, and the counts of tokens
+                    and texts, and the size of the string data
+    tokens          u32 text numbers
+                    u32 lines
+                    u32 fields
+    texts           u32 offsets, one more than there are texts
+                    the texts, UTF-8
+"""
+import errno
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from concurrent import futures
+from itertools import repeat
+
+from octopy.symindex import Mapped, write_sections
+from octopy.tokenizer import BLOCK_SIZE, Token, byte_lines, classify, split_fields
+
+MAGIC = b"OCTOTOKS"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIII")
+
+INCLUDE = b":include"
+
+def default_cache():
+    """Where the command line keeps tokenized files."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "octopy", "tokens")
+
+def unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return text[1:-1]
+    return text
+
+class TokenFile():
+    """
+    The tokens of a file: the number of each token's text in texts, its line
+    and its field.
+    """
+    def __init__(self, texts, text_ids, lines, fields):
+        self.texts = texts
+        self.text_ids = text_ids
+        self.lines = lines
+        self.fields = fields
+
+    def __len__(self):
+        return len(self.text_ids)
+
+    def tokens(self, name):
+        """Generate the Tokens, from the file name."""
+        texts = self.texts
+        classes = [classify(text) for text in texts]
+        new = tuple.__new__
+        for text_id, line, field in zip(self.text_ids, self.lines, self.fields):
+            kind, value = classes[text_id]
+            yield new(Token, (texts[text_id], line, field, kind, value, name))
+
+    def includes(self):
+        """The text after each :include."""
+        if ":include" not in self.texts:
+            return []
+        include = self.texts.index(":include")
+        text_ids = self.text_ids
+        return [self.texts[text_ids[n+1]] for n in range(len(text_ids) - 1)
+                if text_ids[n] == include]
+
+def tokenize_file(data):
+    """The TokenFile of the UTF-8 bytes of a source."""
+    ids, texts = {}, []
+    text_ids, lines, fields = array("I"), array("I"), array("I")
+    for line_num, line in enumerate(byte_lines(data), 1):
+        for field_num, field in enumerate(split_fields(line), 1):
+            if field.startswith(b"#"):
+                break
+            text_id = ids.get(field)
+            if text_id is None:
+                text_id = ids[field] = len(texts)
+                texts.append(field.decode())
+            text_ids.append(text_id)
+            lines.append(line_num)
+            fields.append(field_num)
+    return TokenFile(texts, text_ids, lines, fields)
+
+def source_includes(data):
+    """
+    The text after each :include in the bytes of a source, which can be an
+    mmap. Only the lines with one in are split, and like byte_lines(), an
+    mmap is scanned a block at a time, with the pages scanned let go.
+    """
+    found = []
+    done = 0
+    for start in range(0, len(data), BLOCK_SIZE):
+        end = start + BLOCK_SIZE + len(INCLUDE) - 1
+        position = data.find(INCLUDE, max(start, done), end)
+        while position >= 0:
+            line = data.rfind(b"\n", 0, position) + 1
+            done = data.find(b"\n", position)
+            done = len(data) if done < 0 else done
+            fields = split_fields(data[line:done])
+            for n, field in enumerate(fields[:-1]):
+                if field.startswith(b"#"):
+                    break
+                if field == INCLUDE:
+                    found.append(fields[n+1].decode())
+            position = data.find(INCLUDE, done, end)
+        if hasattr(data, "madvise") and start > 0:
+            data.madvise(mmap.MADV_DONTNEED, 0, start - start % mmap.PAGESIZE)
+    return found
+
+def write_token_file(tokens, fout):
+    """Write a TokenFile to the binary file fout."""
+    strings = bytearray()
+    offsets = [0]
+    for text in tokens.texts:
+        strings.extend(text.encode("utf-8"))
+        offsets.append(len(strings))
+    sections = [array("I", tokens.text_ids), array("I", tokens.lines),
+                array("I", tokens.fields), array("I", offsets)]
+    header = HEADER.pack(MAGIC, VERSION, 0, len(tokens), len(tokens.texts), len(strings))
+    write_sections(fout, header, sections, strings)
+
+class CachedTokens(Mapped):
+    """
+    A file written by write_token_file(), mapped from path. Use it as a
+    context manager, or call close() when done.
+    """
+    header = HEADER
+    magic = MAGIC
+    version = VERSION
+    kind = "token file"
+
+    def load(self, counts):
+        tokens, texts, size = counts
+        section = self.section
+        self.text_ids = section("I", tokens)
+        self.lines = section("I", tokens)
+        self.fields = section("I", tokens)
+        self.offsets = section("I", texts + 1)
+        self.data = self.string_data(size)
+
+    def token_file(self):
+        """A TokenFile of the tokens, copied out, so that this can be closed."""
+        data, offsets = self.data, self.offsets
+        texts = [str(data[offsets[n]:offsets[n+1]], "utf-8") for n in range(len(offsets) - 1)]
+        return TokenFile(texts, array("I", self.text_ids), array("I", self.lines),
+                         array("I", self.fields))
+
+class TokenCache():
+    """Tokenized files kept in directory, by the SHA-256 of their contents."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + ".tok")
+
+    def get(self, digest):
+        """The TokenFile kept for digest, or None."""
+        try:
+            with CachedTokens(self.path(digest)) as cached:
+                return cached.token_file()
+        except (OSError, ValueError):
+            # Missing, or not written by this version.
+            return None
+
+    def put(self, digest, tokens):
+        # Written to one side and moved into place, so that another process
+        # never reads half of one.
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                write_token_file(tokens, fout)
+            os.replace(temporary, self.path(digest))
+        except OSError:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+
+def read(path):
+    """The contents of the file at path, and their digest."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+def file_digest(path):
+    """The digest of the contents of the file at path, or None if it can't be read."""
+    try:
+        return read(path)[1]
+    except OSError:
+        return None
+
+def scan(path, cache=None):
+    """
+    The TokenFile of the file at path, read back from the cache directory if
+    it's been tokenized before, and kept there if it hasn't, and the digest
+    of the contents it came from.
+    """
+    data, digest = read(path)
+    store = TokenCache(cache) if cache is not None else None
+    tokens = store.get(digest) if store is not None else None
+    if tokens is None:
+        tokens = tokenize_file(data)
+        if store is not None:
+            store.put(digest, tokens)
+    return tokens, digest
+
+def prescan(path, cache):
+    """scan() in a worker process, where errors are left for parsing to report."""
+    try:
+        return scan(path, cache)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+class Includes():
+    """
+    The files :include reads, tokenized once each, for the source at path
+    (or one in the working directory). cache is the directory to keep
+    tokenized files in, if any, and jobs how many worker processes
+    prefetch() can use (one per core by default).
+    """
+    # Less than this much source to tokenize isn't worth starting workers for.
+    parallel_size = 1 << 18
+
+    def __init__(self, path=None, cache=None, jobs=None):
+        self.path = path
+        self.cache = cache
+        # Counting the cores is left for prefetch(), which most sources don't need.
+        self.jobs = jobs
+        # Real paths to TokenFiles, and to the digests of what they were
+        # tokenized from (or of what's there now, if they weren't read).
+        self.files = {}
+        self.digests = {}
+
+    def name(self, including, text):
+        """The name of the file text names, in the file including (None for the source)."""
+        base = self.path if including is None else including
+        return os.path.normpath(os.path.join(os.path.dirname(base or ""), unquote(text)))
+
+    def load(self, name):
+        """The TokenFile of the file name."""
+        key = os.path.realpath(name)
+        tokens = self.files.get(key)
+        if tokens is None:
+            # A file that can't be read is noted too, in case it turns up.
+            self.digests[key] = None
+            tokens, self.digests[key] = scan(name, self.cache)
+            self.files[key] = tokens
+        return tokens
+
+    def digest(self, key):
+        """The digest of the file at the real path key, or None if it can't be read."""
+        if key not in self.digests:
+            self.digests[key] = file_digest(key)
+        return self.digests[key]
+
+    def prefetch(self, data):
+        """
+        Tokenize every file that the source, whose bytes are data, includes,
+        directly or not, before parsing it. Files that can't be read are left
+        for parsing to report.
+        """
+        pool = None
+        jobs = self.jobs or os.cpu_count() or 1
+        pending = [self.name(None, text) for text in source_includes(data)]
+        try:
+            while pending:
+                level = {}
+                for name in pending:
+                    key = os.path.realpath(name)
+                    if key not in self.files and key not in level and os.path.isfile(name):
+                        level[key] = name
+                names = list(level.values())
+                size = sum(os.path.getsize(name) for name in names)
+                if (pool is None and jobs > 1 and len(names) > 1
+                        and size >= self.parallel_size):
+                    # The pool (and multiprocessing) is only imported when used.
+                    pool = futures.ProcessPoolExecutor(max_workers=min(jobs, len(names)))
+                if pool is not None:
+                    found = pool.map(prescan, names, repeat(self.cache))
+                else:
+                    found = map(prescan, names, repeat(self.cache))
+                pending = []
+                for key, name, scanned in zip(level, names, found):
+                    if scanned is not None:
+                        tokens, self.digests[key] = scanned
+                        self.files[key] = tokens
+                        pending.extend(self.name(name, text) for text in tokens.includes())
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+class NoIncludes(Includes):
+    """
+    Includes for a source that isn't a file, which reads none: each :include
+    is an error, rather than naming a file in the working directory.
+    """
+    def load(self, name):
+        raise PermissionError(errno.EACCES, "sources given as text can't include files", name)
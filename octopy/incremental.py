@@ -0,0 +1,315 @@
+"""
+Incremental re-assembly.
+
+The source is split into regions, each starting at a top-level label. Every
+region is parsed on its own and what it produced is remembered: the code it
+emitted (a Program Fragment, including its fixups), the consts, aliases and
+macros it defined, the files it included, and the answer to every name it
+looked up that was defined before it. On the next build, a region whose text
+is unchanged, whose lookups still give the same answers, and whose included
+files haven't changed, is replayed instead of being parsed again, so only
+edited regions, and the regions that depend on what changed, are
+re-tokenized. Everything is then linked with Program.resolve(), exactly
+as assemble() does.
+"""
+import io
+from typing import NamedTuple
+
+from octopy.assemble import assemble
+from octopy.errors import EmitError, ParseError
+from octopy.include import Includes
+from octopy.parser import Parser, MacroEntry
+from octopy.program import Program, Fragment, Unsettled
+from octopy.tokenizer import Tokenizer, tokenize
+
+MISSING = object()
+
+# Stands in for the value of a const that holds one of the region's own label
+# addresses, which moves with the region.
+LABEL = object()
+
+class Journal(dict):
+    """
+    A dict that, while recording, notes the first lookup of each name that it
+    didn't set itself, every name that was set, and the names it set that
+    were looked up again.
+    """
+    def __init__(self, items, snapshot):
+        super().__init__(items)
+        self.snapshot = snapshot
+        self.reads = None
+        self.writes = None
+        self.echoes = None
+
+    def start(self):
+        self.reads = {}
+        self.writes = {}
+        self.echoes = set()
+
+    def stop(self):
+        reads, writes, echoes = self.reads, self.writes, self.echoes
+        self.reads = self.writes = self.echoes = None
+        return reads, writes, echoes
+
+    def freeze(self, reads):
+        """
+        Split recorded lookups into the names that were found, with what was
+        seen, and the names that were missing.
+        """
+        found = {name: seen for name, seen in reads.items() if seen is not MISSING}
+        missing = frozenset(name for name, seen in reads.items() if seen is MISSING)
+        return found, missing
+
+    def unchanged(self, frozen):
+        """
+        Whether the lookups recorded by freeze() would give the same answers now.
+        """
+        found, missing = frozen
+        if not self.keys().isdisjoint(missing):
+            return False
+        # The view comparisons run in C, and most regions make dozens of lookups.
+        if self.snapshot is same_value:
+            return found.items() <= self.items()
+        if self.snapshot is presence:
+            return found.keys() <= self.keys()
+        get, snapshot = super().get, self.snapshot
+        for name, seen in found.items():
+            # A name that's gone since can't be snapshotted.
+            value = get(name, MISSING)
+            if value is MISSING or snapshot(value) != seen:
+                return False
+        return True
+
+    def __note(self, name):
+        if self.reads is None:
+            return
+        if name in self.writes:
+            self.echoes.add(name)
+        elif name not in self.reads:
+            value = super().get(name, MISSING)
+            self.reads[name] = MISSING if value is MISSING else self.snapshot(value)
+
+    def __contains__(self, name):
+        self.__note(name)
+        return super().__contains__(name)
+
+    def __getitem__(self, name):
+        self.__note(name)
+        return super().__getitem__(name)
+
+    def get(self, name, default=None):
+        self.__note(name)
+        return super().get(name, default)
+
+    def __setitem__(self, name, value):
+        if self.writes is not None:
+            self.writes[name] = value
+        super().__setitem__(name, value)
+
+def same_value(value):
+    return value
+
+def presence(_):
+    return True
+
+def macro_key(entry):
+    """
+    What a macro expands to, ignoring where its tokens came from, since that
+    changes whenever lines are added above it.
+    """
+    macro = entry.macro
+    return (macro.name, tuple(macro.args), macro.tokens.texts(), entry.calls)
+
+class State(NamedTuple):
+    consts: Journal
+    registers: Journal
+    macros: Journal
+    labels: Journal
+    files: Journal
+    shadowed: Journal
+
+class Region(NamedTuple):
+    """
+    What is remembered about one region of the source. The fragment holds the
+    emitted bytes (and so the byte range, from its base), fixups and labels.
+    Regions that can't be replayed have no fragment. files is the digest of
+    each file read by an :include in the region, by real path, and included
+    the (including file, included file) pairs they added to the graph.
+    """
+    text: str
+    first_line: int
+    fragment: Fragment
+    relocatable: bool
+    reads: tuple
+    consts: dict
+    registers: dict
+    macros: dict
+    calls: dict
+    files: dict
+    included: tuple
+
+def split_regions(lines):
+    """
+    Split source lines into regions, each starting at a label statement at the
+    beginning of a line outside of any { } block. Yields (first_line, lines).
+    """
+    depth = 0
+    start = 0
+    for num, line in enumerate(lines):
+        if ":" not in line and "{" not in line and "}" not in line:
+            continue
+        fields = line.split()
+        if depth == 0 and num > start and fields[0] == ":":
+            yield start + 1, lines[start:num]
+            start = num
+        for field in fields:
+            if field.startswith("#"):
+                break
+            if field == "{":
+                depth += 1
+            elif field == "}":
+                depth -= 1
+    yield start + 1, lines[start:]
+
+class IncrementalAssembler():
+    """
+    Assembles successive versions of one source, re-parsing only the regions
+    that need it. The result always matches assemble() on the same text.
+    path is where the source is, which files it includes are found from, and
+    cache the directory to keep tokenized files in, if any.
+    """
+    def __init__(self, path=None, cache=None):
+        self.path = path
+        self.cache = cache
+        # The Includes of the last build.
+        self.includes = None
+        self.regions = []
+        self.parsed = 0
+        self.__cache = {}
+        self.__looked_up = False
+
+    def assemble(self, source):
+        program = Program()
+        tokenizer = Tokenizer(())
+        state = State(
+            Journal(tokenizer.consts, same_value),
+            Journal(tokenizer.registers, same_value),
+            Journal({}, macro_key),
+            Journal({}, presence),
+            Journal({}, presence),
+            Journal({}, presence))
+        tokenizer.consts = state.consts
+        tokenizer.registers = state.registers
+        program.labels = state.labels
+        # Included files are read again for each build, since they may have
+        # changed; the cache saves tokenizing the ones that haven't.
+        self.includes = Includes(self.path, self.cache, jobs=1)
+        parser = Parser(tokenizer, program, includes=self.includes)
+        parser.macros = state.macros
+        parser.files = state.files
+        state.shadowed.update(parser.shadowed)
+        parser.shadowed = state.shadowed
+
+        # ROM lookups read bytes from anywhere in the program, so regions
+        # using them are always parsed.
+        lookup = program.lookup
+        def recording_lookup(n):
+            self.__looked_up = True
+            return lookup(n)
+        program.lookup = recording_lookup
+
+        regions = []
+        self.parsed = 0
+        try:
+            for first_line, lines in split_regions(source.split("\n")):
+                text = "\n".join(lines)
+                region = self.__cache.get(text)
+                if region is not None and self.__replayable(region, program, state):
+                    self.__replay(region, program, state, parser)
+                    region = region._replace(first_line=first_line)
+                else:
+                    region = self.__parse(text, first_line, lines, tokenizer, parser, state)
+                    self.parsed += 1
+                regions.append(region)
+            program.resolve()
+        except (ParseError, EmitError, Unsettled):
+            # Let a full assembly produce the error, exactly as it would be
+            # reported without incremental builds.
+            self.regions = regions
+            self.includes = Includes(self.path, self.cache, jobs=1)
+            return assemble(io.StringIO(source), includes=self.includes)
+
+        self.regions = regions
+        self.__cache = {region.text: region for region in regions if region.fragment is not None}
+        program.consts = dict(state.consts)
+        program.consts.update(program.calculated)
+        program.labels = dict(state.labels)
+        program.includes = parser.included
+        return program
+
+    def __replayable(self, region, program, state):
+        base = program.pc()
+        if base != region.fragment.base:
+            # A label at 0x200 gets a jump to main in front of it.
+            if not region.relocatable or base == 0x200:
+                return False
+        if any(self.includes.digest(key) != digest for key, digest in region.files.items()):
+            return False
+        return all(journal.unchanged(frozen) for journal, frozen in zip(state, region.reads))
+
+    @staticmethod
+    def __replay(region, program, state, parser):
+        program.replay(region.fragment)
+        for key in region.files:
+            state.files[key] = True
+        for including, name in region.included:
+            parser.included.setdefault(including, []).append(name)
+        for name, value in region.consts.items():
+            state.consts[name] = state.labels[name] if value is LABEL else value
+        for name, value in region.registers.items():
+            state.registers[name] = value
+        for name, macro in region.macros.items():
+            state.macros[name] = MacroEntry(macro, 0)
+        for name, calls in region.calls.items():
+            state.macros[name].calls = calls
+        for names in (region.consts, region.registers, region.macros):
+            for name in names:
+                if name in parser.statements:
+                    state.shadowed[name] = True
+
+    def __parse(self, text, first_line, lines, tokenizer, parser, state):
+        # pylint: disable=too-many-arguments
+        program = parser.emitter
+        mark = program.mark()
+        self.__looked_up = False
+        for journal in state:
+            journal.start()
+
+        tokenizer.tokengen = tokenize(lines, first_line)
+        tokenizer.repeat_token = False
+        included = {including: len(names) for including, names in parser.included.items()}
+        tokenizer.advance()
+        parser.parse()
+
+        reads, writes, echoes = zip(*(journal.stop() for journal in state))
+        fragment = program.fragment(mark)
+        if fragment is None or self.__looked_up:
+            return Region(text, first_line, None, False, (), {}, {}, {}, {}, {}, ())
+
+        labels = {name: fragment.base + offset for (name, offset) in fragment.labels}
+        consts = {name: LABEL if labels.get(name, MISSING) == value else value
+                  for name, value in writes[0].items()}
+        macros = {name: entry.macro for name, entry in writes[2].items()}
+        calls = {name: state.macros[name].calls
+                 for name in list(reads[2]) + list(macros) if name in state.macros}
+        # Anything that used HERE saw the region's address, and anything that
+        # used one of the region's own labels has its address as a number,
+        # rather than as a relocation.
+        relocatable = (fragment.relocatable and "HERE" not in consts
+                       and not any(consts.get(name) is LABEL for name in echoes[0]))
+        reads = tuple(journal.freeze(seen) for journal, seen in zip(state, reads))
+        files = {key: self.includes.digests[key] for key in writes[4]}
+        included = tuple((including, name) for including, names in parser.included.items()
+                         for name in names[included.get(including, 0):])
+        return Region(text, first_line, fragment, relocatable, reads,
+                      consts, writes[1], macros, calls, files, included)
@@ -0,0 +1,386 @@
+"""
+A peephole optimizer for the code the parser emits (octopy -O).
+
+It runs between parsing and resolving, on a program parsed with symbolic
+labels (see Program.symbolic), where every address in the code is either a
+fixup (by name) or a relocation (an address inside the program), so code can
+be rewritten and taken out, with everything after it moving back. The code is
+found by following the control flow from 0x200; anything not reached that
+way is left as it is. Each round makes these changes, until there are none
+left to make:
+
+    thread      a jump or call to a jump goes straight to where that jumps
+    tail call   call X followed by return becomes jump X
+    jump next   a jump to the instruction after it (with the skip before
+                it, if any) is taken out
+    return      a return nothing can reach any more is taken out
+    reload      a load of a register with what it was just loaded with is
+                taken out
+    dead load   a load of a register that the next instruction loads again
+                is taken out
+
+Code is only taken out when everything that could refer to it is known: not
+with jump0 (computed jumps) or numeric addresses into the program, which are
+noted in the report instead. Nothing is taken out before an address that was
+used as a number (a label in a { } expression or as a byte, HERE, or @), so
+that the number stays right. Instructions at labels used as data (by i :=,
+i := long, :unpack or { } expressions), which may be modified as the program
+runs, are never touched.
+"""
+from typing import NamedTuple
+
+from octopy.program import ADDRESS, LONG, UNPACK, Fixups
+
+# Rounds of changes before giving up on the code settling.
+MAX_ROUNDS = 32
+
+RETURN = 0x00EE
+EXIT = 0x00FD
+
+class Instruction(NamedTuple):
+    offset: int
+    size: int
+    op: int
+
+class Change(NamedTuple):
+    address: int
+    kind: str
+    detail: str
+
+class Report():
+    """
+    What the optimizer changed: each change, in the order made, the bytes
+    taken out, and the labels that moved (with their old and new addresses).
+    notes says why code couldn't be taken out, if it couldn't. The address
+    of each change is where the code was in the round it was made.
+    """
+    def __init__(self):
+        self.changes = []
+        self.removed = 0
+        self.moved = {}
+        self.notes = []
+        self.rounds = 0
+
+    def count(self, kind):
+        return sum(1 for change in self.changes if change.kind == kind)
+
+    def table(self):
+        lines = ["{:<24}{:>12}".format("change", "count")]
+        kinds = dict.fromkeys(change.kind for change in self.changes)
+        for kind in kinds:
+            lines.append("{:<24}{:>12}".format(kind, self.count(kind)))
+        lines.append("{:<24}{:>12}".format("bytes removed", self.removed))
+        lines.append("{:<24}{:>12}".format("labels moved", len(self.moved)))
+        lines.append("")
+        for change in self.changes:
+            lines.append("0x{:04X}  {:<12}{}".format(change.address, change.kind, change.detail))
+        for note in self.notes:
+            lines.append("not removing code: {}".format(note))
+        return "\n".join(lines)
+
+def is_skip(op):
+    kind = op >> 12
+    return (kind in (0x3, 0x4) or (kind in (0x5, 0x9) and op & 0xF == 0)
+            or (kind == 0xE and op & 0xFF in (0x9E, 0xA1)))
+
+def loads(op):
+    """
+    The register op sets without reading it, or None: vx := n, vx := vy,
+    vx := delay, vx := key and vx := random.
+    """
+    kind, x = op >> 12, op >> 8 & 0xF
+    if kind in (0x6, 0xC):
+        return x
+    if kind == 0x8 and op & 0xF == 0 and op >> 4 & 0xF != x:
+        return x
+    if kind == 0xF and op & 0xFF in (0x07, 0x0A):
+        return x
+    return None
+
+def reloads(op):
+    """The register set by a load that can be repeated without effect, or None."""
+    kind, x = op >> 12, op >> 8 & 0xF
+    if kind == 0x6 or (kind == 0x8 and op & 0xF == 0 and op >> 4 & 0xF != x):
+        return x
+    return None
+
+class Optimizer():
+    def __init__(self, program):
+        self.program = program
+        self.report = Report()
+        self.rom = bytearray()
+        self.sites = {}
+        self.relocations = set()
+        self.notes = []
+        self.fixed = set()
+        self.horizon = 0
+        self.code = {}
+        self.targets = set()
+        self.before = {}
+
+    def run(self):
+        program = self.program
+        labels = dict(program.labels)
+        for _ in range(MAX_ROUNDS):
+            self.report.rounds += 1
+            if not self.round():
+                break
+        self.report.moved = {name: (pc, program.labels[name]) for (name, pc) in labels.items()
+                             if program.labels[name] != pc}
+        return self.report
+
+    def round(self):
+        """Make one round of changes. Returns whether there were any."""
+        program = self.program
+        self.rom = bytearray(program.program)
+        self.sites = {(offset, how): token
+                      for (token, offset, how) in program.fixups.since(0)}
+        self.relocations = set(program.relocations)
+        self.notes = []
+        self.fixed = self.fixed_offsets()
+        self.trace()
+        rewritten = self.rewrite()
+        program.fixups = Fixups((token, offset, how)
+                                for ((offset, how), token) in self.sites.items())
+        program.relocations = sorted(self.relocations)
+        # Nothing before an address used as a number can move.
+        self.horizon = max((address - 0x200 for (_, address) in program.pins), default=0)
+        runs = self.removals() if not self.notes else []
+        if self.notes:
+            self.report.notes = list(dict.fromkeys(self.notes))
+        if runs:
+            program.remove(runs)
+            self.report.removed += sum(length for (_, length) in runs)
+        return rewritten or bool(runs)
+
+    def change(self, offset, kind, detail):
+        self.report.changes.append(Change(offset + 0x200, kind, detail))
+
+    def fixed_offsets(self):
+        """
+        The offsets of bytes that mustn't change: those at labels used as data,
+        the loads of :unpacks, and deferred bytes.
+        """
+        program = self.program
+        names = set()
+        for (offset, how), token in self.sites.items():
+            if how != ADDRESS or self.rom[offset] >> 4 == 0xA:
+                names.add(token.text)
+        expressions = [expression for (_, expression) in program.deferred_bytes]
+        expressions.extend(program.deferred_consts.values())
+        expressions.extend(expression for (expression, _) in program.guesses)
+        for expression in expressions:
+            names.update(token.text for token in expression.tokens)
+        fixed = {program.labels[name] - 0x200 for name in names if name in program.labels}
+        for (offset, how) in self.sites:
+            if how == UNPACK:
+                fixed.update(range(offset - 4, offset))
+        fixed.update(offset for (offset, _) in program.deferred_bytes)
+        return fixed
+
+    def target(self, instruction):
+        """
+        Where an instruction with an address operand goes, as an offset, and
+        how it refers to it: the token of its fixup, "relocation", or
+        "number" for a numeric address. The offset is None if it isn't known
+        yet (a fixup naming a :calc).
+        """
+        offset = instruction.offset
+        token = self.sites.get((offset, ADDRESS))
+        if token is not None:
+            pc = self.program.labels.get(token.text)
+            return (None if pc is None else pc - 0x200), token
+        address = instruction.op & 0xFFF
+        if offset in self.relocations:
+            return address - 0x200, "relocation"
+        return address - 0x200, "number"
+
+    def decode(self, offset):
+        rom = self.rom
+        op = rom[offset] << 8 | rom[offset+1]
+        return Instruction(offset, 4 if op == 0xF000 else 2, op)
+
+    def trace(self):
+        """
+        Find the code reachable from 0x200, into code (by offset), and every
+        offset something refers to into targets.
+        """
+        rom, code = self.rom, {}
+        size = len(rom)
+        targets = {pc - 0x200 for pc in self.program.labels.values()}
+        work = [0] if size >= 2 else []
+        while work:
+            offset = work.pop()
+            while offset not in code:
+                if offset < 0 or offset + 2 > size:
+                    break
+                instruction = self.decode(offset)
+                code[offset] = instruction
+                op, kind = instruction.op, instruction.op >> 12
+                after = offset + instruction.size
+                if kind in (0x1, 0x2, 0xA, 0xB):
+                    goes, how = self.target(instruction)
+                    if goes is None:
+                        self.notes.append("jump to a :calc at 0x{:04X}".format(offset + 0x200))
+                    else:
+                        if how == "number" and 0 <= goes < size:
+                            self.numeric(goes, offset)
+                        targets.add(goes)
+                        if kind != 0xA:
+                            work.append(goes)
+                if op == 0xF000 and after <= size and (offset + 2, LONG) not in self.sites:
+                    goes = (rom[offset+2] << 8 | rom[offset+3]) - 0x200
+                    if 0 <= goes < size:
+                        self.numeric(goes, offset)
+                if kind == 0xB:
+                    self.notes.append("jump0 at 0x{:04X}".format(offset + 0x200))
+                if kind in (0x1, 0xB) or op in (RETURN, EXIT):
+                    break
+                if is_skip(op) and after + 2 <= size:
+                    work.append(after + self.decode(after).size)
+                offset = after
+        ends = sorted(code)
+        for offset, following in zip(ends, ends[1:]):
+            if offset + code[offset].size > following:
+                self.notes.append("overlapping code at 0x{:04X}".format(following + 0x200))
+        self.code = code
+        self.targets = targets
+        self.before = {instruction.offset + instruction.size: instruction
+                       for instruction in code.values()}
+
+    def numeric(self, goes, offset):
+        self.notes.append("numeric address 0x{:03X} at 0x{:04X}".format(
+            goes + 0x200, offset + 0x200))
+
+    def touchable(self, instruction):
+        offset = instruction.offset
+        return not any(offset + n in self.fixed for n in range(instruction.size))
+
+    def skipped(self, instruction):
+        """Whether the instruction can be skipped over by the one before it."""
+        previous = self.before.get(instruction.offset)
+        return previous is not None and is_skip(previous.op)
+
+    def replace(self, instruction, op):
+        """Note that an instruction was rewritten as op."""
+        instruction = instruction._replace(op=op)
+        self.code[instruction.offset] = instruction
+        self.before[instruction.offset + instruction.size] = instruction
+
+    def retarget(self, instruction, goes, how):
+        """Point an instruction at goes, referred to the way how says."""
+        offset = instruction.offset
+        if how == "relocation":
+            address = goes + 0x200
+            self.sites.pop((offset, ADDRESS), None)
+            self.relocations.add(offset)
+            self.rom[offset] = self.rom[offset] & 0xF0 | address >> 8
+            self.rom[offset+1] = address & 0xFF
+            self.program.store(offset + 0x200, self.rom[offset:offset+2])
+            self.replace(instruction, self.rom[offset] << 8 | self.rom[offset+1])
+        else:
+            self.relocations.discard(offset)
+            self.sites[(offset, ADDRESS)] = how
+
+    def rewrite(self):
+        """Thread jumps and turn tail calls into jumps, in place."""
+        code = self.code
+        changed = False
+        for instruction in sorted(code.values()):
+            kind = instruction.op >> 12
+            if kind not in (0x1, 0x2) or not self.touchable(instruction):
+                continue
+            goes, how = self.target(instruction)
+            if how == "number" or goes is None:
+                continue
+            if kind == 0x1 and goes == instruction.offset + 2:
+                # Better taken out than threaded.
+                continue
+            final, final_how, seen = goes, how, {instruction.offset}
+            while final in code and final not in seen:
+                following = code[final]
+                if following.op >> 12 != 0x1 or not self.touchable(following):
+                    break
+                seen.add(final)
+                onward, onward_how = self.target(following)
+                if onward_how == "number" or onward is None:
+                    break
+                final, final_how = onward, onward_how
+            if final != goes and final not in seen:
+                self.retarget(instruction, final, final_how)
+                self.change(instruction.offset, "thread", "0x{:04X} -> 0x{:04X}".format(
+                    goes + 0x200, final + 0x200))
+                changed = True
+            after = code.get(instruction.offset + 2)
+            if kind == 0x2 and after is not None and after.op == RETURN:
+                op = code[instruction.offset].op & 0x0FFF | 0x1000
+                self.rom[instruction.offset] = op >> 8
+                self.program.store(instruction.offset + 0x200, (op >> 8,))
+                self.replace(instruction, op)
+                self.change(instruction.offset, "tail call", "call -> jump 0x{:04X}".format(
+                    final + 0x200))
+                changed = True
+        return changed
+
+    def removals(self):
+        """
+        The runs of code to take out, as (offset, length). Each one, with the
+        instructions either side of it, is kept apart from the others, so
+        that what's decided about one isn't undone by another.
+        """
+        code, targets = self.code, self.targets
+        claimed, runs = set(), []
+
+        def take(kind, detail, first, *instructions, context=()):
+            """
+            Take out the instructions, if first (the first of them, or of
+            context, those they depend on staying the same) can't be skipped.
+            """
+            previous = self.before.get(first.offset)
+            last = instructions[-1]
+            window = {first.offset, last.offset + last.size}
+            window.update(instruction.offset for instruction in instructions)
+            if previous is not None:
+                window.add(previous.offset)
+            if not window.isdisjoint(claimed) or self.skipped(first):
+                return
+            if instructions[0].offset < self.horizon:
+                self.notes.append("0x{:04X} is used as a number".format(self.horizon + 0x200))
+                return
+            if not all(map(self.touchable, instructions + context)):
+                return
+            claimed.update(window)
+            for instruction in instructions:
+                runs.append((instruction.offset, instruction.size))
+            self.change(first.offset, kind, detail)
+
+        for instruction in sorted(code.values()):
+            op, offset = instruction.op, instruction.offset
+            following = code.get(offset + instruction.size)
+            previous = self.before.get(offset)
+            if op >> 12 == 0x1:
+                goes, how = self.target(instruction)
+                if how != "number" and goes == offset + 2:
+                    if self.skipped(instruction):
+                        take("jump next", "with the skip before it",
+                             previous, previous, instruction)
+                    else:
+                        take("jump next", "", instruction, instruction)
+            elif op == RETURN and previous is not None and previous.op >> 12 == 0x1:
+                # Only reached by falling through the jump, if nothing refers
+                # to it and the jump can't be skipped.
+                if offset not in targets:
+                    take("return", "after a jump", previous, instruction, context=(previous,))
+            elif previous is not None and reloads(op) is not None and op == previous.op:
+                if offset not in targets:
+                    take("reload", "v{:X} again".format(reloads(op)), previous, instruction,
+                         context=(previous,))
+            elif following is not None and reloads(op) is not None:
+                if loads(following.op) == reloads(op):
+                    take("dead load", "v{:X} loaded again".format(reloads(op)), instruction,
+                         instruction, context=(following,))
+        return runs
+
+def optimize(program):
+    """Optimize a parsed, symbolic program in place. Returns a Report."""
+    return Optimizer(program).run()
@@ -1,76 +1,359 @@
+import os
 from dataclasses import dataclass
 from typing import NamedTuple
 
-from octopy.calc import calc
+from octopy.calc import Deferred, evaluate, undefined
 from octopy.errors import ParseError
+from octopy.include import Includes
+from octopy.program import Fragment, Mark
+from octopy.tokenizer import KEYWORDS, OPERATORS, TokenSpan
+
+DIGITS = "0123456789"
+
+
+# Names that mean something different at each expansion, or that define
+# something, so expansions using them can't be replayed.
+DEFINITIONS = ("label", "next", "alias", "breakpoint", "monitor", "const", "calc", "macro", "org")
+VOLATILE = frozenset(("CALLS", "HERE", "@", ":")).union(
+    *((name, ":" + name) for name in DEFINITIONS))
 
 
 class Macro(NamedTuple):
     """
-    Holds the name, argument list, and unprocessed tokens for a macro.
+    Holds the name, argument list, and unprocessed tokens for a macro. The
+    body is compiled when the macro is defined: slots maps each offset in the
+    body where an argument is used to the argument's index, and names holds
+    every other name used. Expansions that can be replayed are kept by their
+    argument texts.
     """
     name: str
     args: list
-    tokens: list
+    tokens: TokenSpan
+    slots: dict
+    names: frozenset
+    reusable: bool
+    expansions: dict
     def __repr__(self):
         return "{}({}): <{}>".format(self.name, self.args, self.tokens)
 
+def compile_macro(name, args, tokens):
+    names = frozenset(text for text in tokens.texts() if text[0] not in DIGITS).difference(args)
+    return Macro(name, args, tokens, tokens.slots(args), names, names.isdisjoint(VOLATILE), {})
+
+class Expansion(NamedTuple):
+    """
+    The code a macro expansion emitted, the text of the token after it if the
+    code depended on that, and what each name used meant at the time.
+    """
+    fragment: Fragment
+    lookahead: str
+    names: tuple
+    seen: tuple
+
+class Recording(NamedTuple):
+    """
+    An expansion being parsed that may be kept, with the tokenizer's depth
+    of macro nesting inside its body.
+    """
+    macro: Macro
+    key: tuple
+    mark: Mark
+    expanded: int
+    depth: int
+
 @dataclass
 class MacroEntry():
     macro: Macro
     calls: int
 
+def statement_table(cls):
+    """
+    Map each statement and directive keyword to the handler method for it.
+    Directives may be written with or without their leading colon.
+    """
+    prefix = "_{}__handle_".format(cls.__name__)
+    table = {}
+    for name in dir(cls):
+        if name.startswith(prefix):
+            keyword = name[len(prefix):].replace("_", "-")
+            handler = getattr(cls, name)
+            table[keyword] = handler
+            table[":" + keyword] = handler
+    return table
+
 class Parser():
-    def __init__(self, tokenizer, emitter, macros=None):
+    # The __handle_ methods are only called through statement_table().
+    # pylint: disable=unused-private-member
+    # Expansions kept for each macro, before they're all dropped. 0 turns
+    # replaying expansions off.
+    expansion_cache_size = 1024
+
+    def __init__(self, tokenizer, emitter, macros=None, errors=None, includes=None,
+                 hooks=None):
+        """
+        With a list of errors, parse() carries on after each error, adding it
+        to the list, rather than raising it (see __recover). includes finds
+        and tokenizes the files :include reads (see octopy.include). hooks,
+        if given, are told about each statement and expansion (see
+        octopy.stats).
+        """
         self.emitter = emitter
+        self.errors = errors
         self.macros = macros or {}
         self.tokenizer = tokenizer
+        self.includes = includes or Includes()
+        self.hooks = hooks
+        # The files each file included: the dependency graph.
+        self.included = {}
+        # The real paths of the files read so far, since each is only read
+        # once: the keys of a dict, so that it can be journaled (see
+        # octopy.incremental).
+        self.files = {}
+        # The statements macros, aliases, labels or consts have been given
+        # the names of (a dict, so that it can be journaled, like files).
+        # There are fewer statements than predefined names.
+        self.shadowed = {name: True for name in self.statements
+                         if name in tokenizer.consts or name in tokenizer.registers
+                         or name in self.macros}
+        self.__expanded = 0
+        self.__recording = []
+        if emitter.symbolic:
+            tokenizer.labels = emitter.labels
+            tokenizer.pins = emitter.pins
+        self.source_map = emitter.source_map
+        if self.source_map is not None:
+            # A replayed expansion would be put down to its call, rather than
+            # to the lines of the macro.
+            self.expansion_cache_size = 0
         self.tokenizer.advance()
 
     def parse(self):
-        while self.tokenizer.current() is not None:
-            self.__expect_statement()
-            self.tokenizer.advance()
+        tokenizer = self.tokenizer
+        source_map = self.source_map
+        recovering = self.errors is not None
+        hooks = self.hooks
+        while tokenizer.current() is not None:
+            if hooks is not None:
+                # Statements read from macro bodies are part of expanding them.
+                hooks.switch("macro" if tokenizer.frames else "parse")
+            if source_map is not None:
+                site = tokenizer.sites[-1] if tokenizer.sites else None
+                token = tokenizer.current()
+                source_map.add(self.emitter.pc(), token, site, source_map.file(token.file))
+            start = (tokenizer.current(), self.emitter.pc()) if recovering else None
+            try:
+                self.__expect_statement()
+            except ParseError as error:
+                if not recovering:
+                    raise
+                self.__recover(error, *start)
+                continue
+            if self.__recording:
+                self.__end_expansions(after_statement=True)
+            tokenizer.advance()
+            if self.__recording:
+                self.__end_expansions(after_statement=False)
+        if hooks is not None:
+            hooks.switch("parse")
 
     def error(self, msg):
         raise ParseError(msg, self.tokenizer.current())
 
+    def __recover(self, error, token, pc):
+        """
+        Note the error from the statement starting at token, and skip to
+        the next statement or label on a later line, outside any { }. A
+        statement that failed before emitting anything leaves a placeholder
+        (a byte for data, otherwise two), so that the addresses after it
+        stay close to what they would have been.
+        """
+        tokenizer = self.tokenizer
+        self.errors.append(error)
+        self.__recording.clear()
+        if self.emitter.pc() == pc and token.text[0] != ":":
+            for _ in range(1 if token.text[0] in DIGITS else 2):
+                self.emitter.emit_byte(0)
+        depth = 0
+        current = tokenizer.current()
+        while current is not None:
+            if depth <= 0 and current is not token and (
+                    current.line != token.line or current.file != token.file) and (
+                    current.text in self.statements or current.text in (":", ";")
+                    or not (current.text in OPERATORS or current.text in KEYWORDS)):
+                return
+            if current.text == "{":
+                depth += 1
+            elif current.text == "}":
+                depth -= 1
+            current = tokenizer.advance()
+
     def emit_macro(self):
         """
         Swap out the program tokens for this macro, and then parse normally.
+        Code from an expansion that only emits code is kept, and replayed
+        when the macro is used again with the same arguments and every name
+        the body uses still means the same.
         """
-        macro = self.macros[self.tokenizer.current().text]
-        macroargs = {k:self.tokenizer.advance() for k in macro.macro.args}
-        self.tokenizer.emit_macro(macro.calls, macro.macro.tokens, macroargs)
-        macro.calls += 1
+        tokenizer = self.tokenizer
+        call = tokenizer.current()
+        entry = self.macros[call.text]
+        macro = entry.macro
+        args = [tokenizer.advance() for _ in macro.args]
+        key = tuple(arg.text for arg in args)
+        self.__expanded += 1
+        expanded = self.__expanded
+
+        reuse = macro.reusable and self.expansion_cache_size
+        expansion = macro.expansions.get(key) if reuse else None
+        if expansion is not None and expansion.lookahead is not None:
+            # The body ends with a statement that looked at the token after it.
+            following = tokenizer.advance()
+            tokenizer.unadvance()
+            if following is None or following.text != expansion.lookahead:
+                expansion = None
+        if expansion is not None and self.__meanings(expansion.names) == expansion.seen:
+            if self.hooks is not None:
+                self.hooks.expansion(macro.name, 0)
+            self.emitter.replay(expansion.fragment)
+            entry.calls += 1
+            return
+
+        site = None
+        if self.source_map is not None:
+            parent = tokenizer.sites[-1] if tokenizer.sites else None
+            site = self.source_map.call(parent, macro.name, call, self.source_map.file(call.file))
+        if self.hooks is not None:
+            self.hooks.expansion(macro.name, len(macro.tokens))
+        mark = self.emitter.mark()
+        tokenizer.emit_macro(entry.calls, macro.tokens, macro.slots, args, site)
+        entry.calls += 1
+        if reuse and VOLATILE.isdisjoint(key):
+            self.__recording.append(
+                Recording(macro, key, mark, expanded, len(tokenizer.calls)))
+
+    def __end_expansions(self, after_statement):
+        """
+        Keep the expansions being recorded that the tokenizer has finished
+        with. Those that ended during a statement, rather than between two,
+        are only kept if the statement just looked at the token after the
+        macro and gave it back (like load v3 does, looking for - vN).
+        """
+        tokenizer = self.tokenizer
+        depth = len(tokenizer.calls)
+        while self.__recording and self.__recording[-1].depth > depth:
+            recording = self.__recording.pop()
+            lookahead = None
+            if after_statement:
+                following = tokenizer.current()
+                if not tokenizer.repeat_token or following is None:
+                    continue
+                lookahead = following.text
+            self.__keep(recording, lookahead)
+
+    def __keep(self, recording, lookahead):
+        macro = recording.macro
+        # Expansions of other macros inside this one counted their calls.
+        if recording.expanded != self.__expanded:
+            return
+        fragment = self.emitter.fragment(recording.mark)
+        if fragment is None or not fragment.relocatable:
+            return
+        if len(macro.expansions) >= self.expansion_cache_size:
+            macro.expansions.clear()
+        names = macro.names.union(text for text in recording.key if text[0] not in DIGITS)
+        if lookahead is not None:
+            names = names.union((lookahead,))
+        names = tuple(names)
+        macro.expansions[recording.key] = Expansion(
+            fragment, lookahead, names, self.__meanings(names))
+
+    def __meanings(self, names):
+        """
+        What each name means right now: its const value, its register, and
+        whether it's a macro or a label.
+        """
+        consts, registers = self.tokenizer.consts, self.tokenizer.registers
+        macros, labels = self.macros, self.emitter.labels
+        return (tuple(map(consts.get, names)), tuple(map(registers.get, names)),
+                tuple(map(macros.__contains__, names)), tuple(map(labels.__contains__, names)))
 
     def __expect_statement(self):
         start_type = "Parsing Statement"
+        start_token = self.tokenizer.current()
+        hooks = self.hooks
         try:
-            start_token = self.tokenizer.current()
-            cur = self.tokenizer.current().text
-            if cur in self.macros:
+            cur = start_token.text
+            handler = self.statements.get(cur)
+            if handler is not None and cur not in self.shadowed:
+                if hooks is not None:
+                    hooks.statement(cur.lstrip(":"))
+                handler(self)
+            elif cur[0] in DIGITS:
+                # Names can't start with a digit, so this can only be data.
+                if hooks is not None:
+                    hooks.statement("data")
+                self.__data_statement()
+            elif cur in self.macros:
                 start_type = "Emitting Macro"
-                self.emit_macro()
+                if hooks is None:
+                    self.emit_macro()
+                else:
+                    hooks.statement("expansion")
+                    previous = hooks.switch("macro")
+                    self.emit_macro()
+                    hooks.switch(previous)
             elif self.tokenizer.accept_register() is not None:
+                if hooks is not None:
+                    hooks.statement("register")
                 self.__expect_register_operation()
             elif cur == ":":
+                if hooks is not None:
+                    hooks.statement("label")
                 self.__handle_label()
             elif cur == ";":
+                if hooks is not None:
+                    hooks.statement("return")
                 self.__handle_return()
             elif cur in self.emitter.labels:
+                if hooks is not None:
+                    hooks.statement("call")
                 self.emitter.CALL(self.tokenizer.expect_ident())
             else:
                 num = self.tokenizer.accept_byte()
                 if num is not None:
+                    if hooks is not None:
+                        hooks.statement("byte")
                     self.emitter.emit_byte(num)
                 else:
-                    methname = "_Parser__handle_{}".format(cur.replace(":", "").replace("-", "_"))
-                    meth = getattr(self, methname, self.named_call)
+                    # Statements the table doesn't have, since they're spelt
+                    # with _ for - or with more colons (scroll_down, ::const),
+                    # which looking handlers up by name has always allowed.
+                    keyword = cur.replace(":", "").replace("_", "-")
+                    methname = "_Parser__handle_{}".format(keyword.replace("-", "_"))
+                    meth = getattr(self, methname, None)
+                    if meth is None:
+                        keyword, meth = "call", self.named_call
+                    if hooks is not None:
+                        hooks.statement(keyword)
                     meth()
         except Exception as e:
             raise ParseError("{}".format(start_type), start_token) from e
 
+    def __data_statement(self):
+        num = self.tokenizer.accept_byte()
+        if num is None:
+            self.named_call()
+        else:
+            self.emitter.emit_byte(num)
+
+    def __define(self, name):
+        """
+        Note a macro, alias, label or const being defined, which takes
+        precedence over a statement with the same name.
+        """
+        if name in self.statements:
+            self.shadowed[name] = True
+
     def named_call(self):
         self.emitter.CALL(self.tokenizer.expect_ident())
 
@@ -81,6 +364,7 @@ class Parser():
         name = self.tokenizer.next_ident()
         self.emitter.track_label(name, offset)
         self.tokenizer.add_const(name.text, self.emitter.pc() + offset)
+        self.__define(name.text)
 
     def __handle_alias(self):
         dst = self.tokenizer.next_ident().text
@@ -91,6 +375,7 @@ class Parser():
         else:
             src = self.tokenizer.expect_register()
         self.tokenizer.add_register(dst, int(src))
+        self.__define(dst)
 
     def __handle_breakpoint(self):
         name = self.tokenizer.next_ident()
@@ -103,7 +388,10 @@ class Parser():
 
     def __handle_byte(self):
         if self.tokenizer.advance().text == "{":
-            value = self.__calc_expr()
+            value = self.__calc_expr(defer=True)
+            if isinstance(value, Deferred):
+                self.emitter.emit_deferred_byte(value)
+                return
             if value < -127 or value > 255:
                 self.error("byte expression result {} out of range".format(value))
         else:
@@ -114,20 +402,87 @@ class Parser():
         name = self.tokenizer.next_ident().text
         if self.tokenizer.advance().text != "{":
             self.error("expected { to start calc expression")
-        value = self.__calc_expr()
+        value = self.__calc_expr(defer=True)
+        self.__define(name)
+        if isinstance(value, Deferred):
+            # Whatever the name meant before doesn't hold any more.
+            self.tokenizer.consts.pop(name, None)
+            self.emitter.defer_const(name, value)
+            return
         self.tokenizer.add_const(name, value)
 
-    def __calc_expr(self):
-        tokens = self.__token_cluster()
-        calc_tokenizer = self.tokenizer.copy(reversed(tokens))
-        calc_tokenizer.add_const("HERE", self.emitter.pc())
-        return calc(calc_tokenizer, self.emitter.lookup)
+    def __calc_expr(self, defer=False):
+        """
+        Evaluate the { } expression starting here. With defer, an expression
+        using names that aren't defined yet gives a Deferred, to be evaluated
+        when the program is resolved.
+        """
+        hooks = self.hooks
+        if hooks is None:
+            return self.__evaluate(defer)
+        previous = hooks.switch("calc")
+        try:
+            return self.__evaluate(defer)
+        finally:
+            hooks.switch(previous)
+
+    def __evaluate(self, defer):
+        tokens = list(self.__cluster())
+        tokenizer = self.tokenizer
+        tokenizer.add_const("HERE", self.emitter.pc())
+        if self.emitter.symbolic:
+            self.__pin(tokens)
+        try:
+            return evaluate(tokens, tokenizer, self.emitter.lookup)
+        except ParseError:
+            if not defer or not undefined(tokens, tokenizer.consts):
+                raise
+            return Deferred(tokens, tokenizer)
+
+    def __pin(self, tokens):
+        """
+        Log the addresses a { } expression in a symbolic program may use the
+        value of: labels defined so far, HERE, and (for @) anywhere at all.
+        """
+        labels, pins = self.emitter.labels, self.emitter.pins
+        for token in tokens:
+            if token.text in labels:
+                pins.append((token, labels[token.text]))
+            elif token.text == "HERE":
+                pins.append((token, self.emitter.pc()))
+            elif token.text == "@":
+                pins.append((token, 0x10000))
 
 
     def __handle_const(self):
         name = self.tokenizer.next_ident().text
         value = self.tokenizer.advance(self.tokenizer.expect_number)
         self.tokenizer.add_const(name, value)
+        self.__define(name)
+
+    def __handle_include(self):
+        tokenizer = self.tokenizer
+        if tokenizer.frames:
+            self.error(":include can't be used in a macro")
+        token = tokenizer.advance()
+        includes = self.includes
+        name = includes.name(tokenizer.file, token.text)
+        key = os.path.realpath(name)
+        reading = [includes.path if file is None else file for (_, file) in tokenizer.sources]
+        reading.append(includes.path if tokenizer.file is None else tokenizer.file)
+        keys = [None if file is None else os.path.realpath(file) for file in reading]
+        if key in keys:
+            cycle = reading[keys.index(key):] + [name]
+            self.error("{} includes itself: {}".format(name, " -> ".join(cycle)))
+        self.included.setdefault(reading[-1], []).append(name)
+        if key in self.files:
+            return
+        self.files[key] = True
+        try:
+            tokens = includes.load(name)
+        except (OSError, UnicodeDecodeError) as error:
+            self.error("can't include {}: {}".format(name, getattr(error, "strerror", error)))
+        tokenizer.include(tokens.tokens(name), name)
 
     def __handle_macro(self):
         name = self.tokenizer.next_ident().text
@@ -137,11 +492,15 @@ class Parser():
             args.append(arg)
             arg = self.tokenizer.advance().text
         tokens = self.__token_cluster()
-        self.macros[name] = MacroEntry(Macro(name, args, tokens), 0)
+        self.macros[name] = MacroEntry(compile_macro(name, args, tokens), 0)
+        self.__define(name)
 
     def __handle_org(self):
         if self.tokenizer.advance().text == "{":
-            addr = self.__calc_expr()
+            addr = self.__calc_expr(defer=True)
+            if isinstance(addr, Deferred):
+                # Assembled again until the guess is right.
+                addr = self.emitter.guess(addr)
             if addr < -0x7FFF or addr > 0xFFFF:
                 self.error("""
                   register expression result '{}' is out of range [0x-7FFF,0xFFFF]
@@ -160,8 +519,8 @@ class Parser():
         self.__handle_label(offset=1)
 
 
-    def __token_cluster(self):
-        tokens = []
+    def __cluster(self):
+        """The tokens up to the } closing the current { block."""
         token = self.tokenizer.advance()
         depth = 1
         while depth > 0:
@@ -170,9 +529,15 @@ class Parser():
             if token.text == "}":
                 depth -= 1
             if depth > 0:
-                tokens.append(token)
+                yield token
                 token = self.tokenizer.advance()
-        return tokens
+
+    def __token_cluster(self):
+        store = self.tokenizer.store
+        start = len(store)
+        for token in self.__cluster():
+            store.append(token)
+        return store.span(start)
 
 
     ##############
@@ -205,12 +570,13 @@ class Parser():
         dst = self.tokenizer.expect_register()
         op = self.tokenizer.advance().text
         src = self.tokenizer.advance().text
-        srcnum = self.tokenizer.accept_byte()
-        reg = self.tokenizer.accept_register()
 
-        if reg is not None:
+        if self.tokenizer.accept_register() is not None:
             self.__register_register_op(op, dst)
-        elif srcnum is not None:
+            return
+
+        srcnum = self.tokenizer.accept_byte()
+        if srcnum is not None:
             self.__register_const_op(op, dst, srcnum)
         elif src == "delay":
             self.emitter.LDD(dst)
@@ -429,3 +795,5 @@ class Parser():
 
     def __handle_return(self):
         self.emitter.RET()
+
+Parser.statements = statement_table(Parser)
@@ -1,37 +1,456 @@
+from array import array
+from bisect import bisect_right
+from collections import ChainMap
+from collections.abc import Mapping
+from itertools import accumulate, islice
 from typing import NamedTuple
 
-from octopy.errors import ParseError
+from octopy.errors import EmitError, ParseError
 from octopy.tokenizer import Token
 
 class Unresolved(NamedTuple):
-    jumpsandcalls: list
     begins: list
     loops: list
     whiles: list
-    unpacks: dict
 
 class Debugger(NamedTuple):
     breakpoints: dict
     monitors: list
 
+class Mark(NamedTuple):
+    offset: int
+    orgs: int
+    fixups: int
+    relocations: int
+    labels: int
+    breakpoints: int
+    monitors: int
+    deferred: int
+    blocks: tuple
+
+class Fragment(NamedTuple):
+    """
+    A self-contained run of emitted code, with everything recorded alongside
+    it, that can be replayed elsewhere in a program. Offsets are relative to
+    the start of the fragment.
+    """
+    base: int
+    data: bytes
+    fixups: tuple
+    relocations: tuple
+    labels: tuple
+    breakpoints: tuple
+    monitors: tuple
+    relocatable: bool
+
+def tail(items, count):
+    """The last count items of an ordered mapping view, in order."""
+    return tuple(reversed(tuple(islice(reversed(items), count))))
+
+# How a fixup site is patched, kept in the low bits of each entry.
+ADDRESS = 0 # the 12 bit address operand of the instruction at the offset
+LONG = 1    # the 16 bit word at the offset, after an i := long
+UNPACK = 2  # the v0 and v1 loads of an :unpack, ending at the offset
+HOW_BITS = 2
+HOW_MASK = (1 << HOW_BITS) - 1
+
+class Fixups():
+    """
+    Addresses to fill in once labels are known. Each name referred to gets an
+    id, and the sites referring to it are kept in an array for that id (as
+    offset << HOW_BITS | how), so that all of them are patched in one pass,
+    and can be patched again on their own if the label moves. Sites are also
+    logged in the order they were added, with the token that referred to the
+    name, so that those added since a mark can be captured.
+    """
+    def __init__(self, sites=()):
+        self.ids = {}
+        self.names = []
+        self.sites = []
+        self.entries = array("I")
+        self.tokens = []
+        for token, offset, how in sites:
+            self.add(token, offset, how)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, token, offset, how):
+        name = token.text
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.sites.append(array("I"))
+        entry = offset << HOW_BITS | how
+        self.sites[symbol].append(entry)
+        self.entries.append(entry)
+        self.tokens.append(token)
+
+    def since(self, count):
+        """(token, offset, how) for each site after the first count."""
+        return tuple((token, entry >> HOW_BITS, entry & HOW_MASK)
+                     for token, entry in zip(self.tokens[count:], self.entries[count:]))
+
+    def missing(self, labels):
+        """
+        The token of the first site referring to a name that isn't a label,
+        looking at unpacks first, or None.
+        """
+        names = frozenset(name for name in self.names if name not in labels)
+        if not names:
+            return None
+        sites = tuple(zip(self.tokens, self.entries))
+        for token, entry in sites:
+            if entry & HOW_MASK == UNPACK and token.text in names:
+                return token
+        for token, entry in sites:
+            if token.text in names:
+                return token
+        return None
+
+    def unresolved(self, labels):
+        """The token of the first site referring to each name that isn't a label."""
+        first = {}
+        for token in self.tokens:
+            if token.text not in labels:
+                first.setdefault(token.text, token)
+        return list(first.values())
+
+    def patch(self, rom, labels, names=None):
+        """
+        Write the address of each label into the sites referring to it: all
+        of them, or only those for the given names.
+        """
+        ids = self.ids
+        if names is None:
+            symbols = range(len(self.names))
+        else:
+            symbols = [ids[name] for name in names if name in ids]
+        for symbol in symbols:
+            target = int(labels[self.names[symbol]])
+            high, low = target >> 8, target & 0xFF
+            for entry in self.sites[symbol]:
+                offset = entry >> HOW_BITS
+                how = entry & HOW_MASK
+                if how == ADDRESS:
+                    rom[offset] = (rom[offset] & 0xF0) | high
+                    rom[offset+1] = low
+                elif how == LONG:
+                    rom[offset] = high & 0xFF
+                    rom[offset+1] = low
+                else:
+                    rom[offset-1] = low
+                    rom[offset-3] = (rom[offset-3] & 0xF0) | (high & 0xF)
+
+class Unsettled(Exception):
+    """
+    Raised by resolve() when an :org { } expression using names defined after
+    it turned out to give a different address than the one guessed. Assembling
+    again, with the values given as hints, makes the next guess.
+    """
+    def __init__(self, hints, token):
+        super().__init__("addresses of :org {{ }} not settled, at {}".format(token))
+        self.hints = hints
+        self.token = token
+
+class DeferredConsts(Mapping):
+    """
+    The values of :calc consts that had to wait for names defined after them,
+    each evaluated the first time it's looked up.
+    """
+    def __init__(self, deferred, rom_lookup):
+        self.deferred = deferred
+        self.rom_lookup = rom_lookup
+        self.values = {}
+        self.evaluating = set()
+        # The error each const that couldn't be evaluated gave, raised again
+        # whenever it's looked up, so that it's only reported once.
+        self.errors = {}
+
+    def __contains__(self, name):
+        return name in self.deferred
+
+    def __getitem__(self, name):
+        value = self.values.get(name)
+        if value is not None:
+            return value
+        if name in self.errors:
+            raise self.errors[name]
+        deferred = self.deferred[name]
+        if name in self.evaluating:
+            raise ParseError("{} is defined in terms of itself".format(name), deferred.tokens[0])
+        self.evaluating.add(name)
+        try:
+            value = self.values[name] = self.evaluate(deferred)
+        except ParseError as error:
+            self.errors[name] = error
+            raise
+        finally:
+            self.evaluating.discard(name)
+        return value
+
+    def __iter__(self):
+        return iter(self.deferred)
+
+    def __len__(self):
+        return len(self.deferred)
+
+    def evaluate(self, deferred):
+        return deferred.evaluate(self, self.rom_lookup)
+
+class Segment():
+    """
+    A run of bytes written contiguously, from start (an offset from 0x200).
+    data may have room for more than the length written.
+    """
+    __slots__ = ("start", "data", "length")
+
+    def __init__(self, start, size=0):
+        self.start = start
+        self.data = bytearray(size)
+        self.length = 0
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+    def reserve(self, size):
+        """Make room for size bytes from the start."""
+        if len(self.data) < size:
+            self.data.extend(bytes(max(size, len(self.data) * 2) - len(self.data)))
+
+class Image():
+    """
+    Reads and writes the bytes of a list of segments by their offset from
+    0x200, with the gaps between them reading as zero.
+    """
+    def __init__(self, segments):
+        self.segments = segments
+        self.starts = [segment.start for segment in segments]
+
+    def locate(self, offset):
+        index = bisect_right(self.starts, offset) - 1
+        if index >= 0:
+            segment = self.segments[index]
+            if offset < segment.end:
+                return segment
+        return None
+
+    def __getitem__(self, offset):
+        segment = self.locate(offset)
+        return 0 if segment is None else segment.data[offset - segment.start]
+
+    def __setitem__(self, offset, value):
+        segment = self.locate(offset)
+        segment.data[offset - segment.start] = value
+
 # pylint: disable=too-many-public-methods
+# The size of the CHIP-8 address space, from 0x200.
+CHIP8_SIZE = 0x1000 - 0x200
+
 class Program():
     def __init__(self):
-        self.program = bytearray()
+        # Code is written straight into segments, starting with one with room
+        # for a whole CHIP-8 program. :org past the end of what's written
+        # starts a new segment, rather than filling the gap, and the ROM image
+        # is only put together when it's read. The segment being written to
+        # is kept in __rom, with its start and end, and the offset that can be
+        # written to without making room.
+        self.__segments = [Segment(0, CHIP8_SIZE)]
+        self.__segment = self.__segments[0]
+        self.__rom = self.__segment.data
+        self.__base = 0
+        self.__high = 0
+        self.__limit = CHIP8_SIZE
         self.__offset = 0
         self.error = None
+        # Every error, when assembled with recover (the first is error).
+        self.errors = []
+        # The files each file included (see octopy.include).
+        self.includes = {}
         self.labels = {}
         self.debugger = Debugger({}, [])
-        self.unresolved = Unresolved([], [], [], [], {})
+        self.unresolved = Unresolved([], [], [])
+        self.fixups = Fixups()
+        # Offsets of address operands pointing back into the program itself,
+        # which need adjusting if the code around them moves.
+        self.relocations = []
+        # Expressions waiting for names defined after them: the bytes they
+        # give, the consts they define, and the :org addresses guessed for
+        # them (from hints, given by an earlier assembly of the same source).
+        self.deferred_bytes = []
+        self.deferred_consts = {}
+        self.guesses = []
+        self.hints = ()
+        # The values of deferred_consts, once resolved.
+        self.calculated = {}
+        # With symbolic set, every use of a label as a location is a fixup,
+        # even once it's defined, so that the code can be moved about before
+        # it's resolved. Uses of addresses as numbers, which can't move, are
+        # kept in pins, as (token, address).
+        self.symbolic = False
+        self.pins = []
+        # Where each statement came from, if a SourceMap is given.
+        self.source_map = None
+        # Told about each fixup, if set (see octopy.stats).
+        self.hooks = None
+        self.__deferrals = 0
+        self.__orgs = 0
+        self.__main_jump = None
 
     def pc(self):
         return self.__offset + 0x200
 
     def org(self, org):
-        self.__offset = org - 0x200
+        self.__orgs += 1
+        offset = self.__offset = org - 0x200
+        if not self.__base <= offset <= self.__high:
+            self.__switch(offset)
+
+    def __sync(self):
+        self.__segment.length = self.__high - self.__base
+
+    def __select(self, segment):
+        self.__segment = segment
+        self.__rom = segment.data
+        self.__base = segment.start
+        self.__high = segment.end
+        self.__limit = segment.start + len(segment.data)
+        index = self.__segments.index(segment)
+        if index + 1 < len(self.__segments):
+            self.__limit = min(self.__limit, self.__segments[index + 1].start)
+
+    def __switch(self, offset):
+        """Write to the segment that offset is in or just after, or a new one."""
+        self.__sync()
+        segments = self.__segments
+        index = bisect_right([segment.start for segment in segments], offset)
+        if index > 0 and offset <= segments[index - 1].end:
+            self.__select(segments[index - 1])
+            return
+        segment = Segment(offset)
+        segments.insert(index, segment)
+        self.__select(segment)
+
+    def __image(self):
+        """The ROM, to read and write by offset."""
+        self.__sync()
+        if len(self.__segments) == 1 and self.__base == 0:
+            return self.__rom
+        return Image(self.__segments)
+
+    def segments(self):
+        """
+        The parts of the ROM that were written, as (address, bytes), in
+        address order. Gaps between them are left out.
+        """
+        self.__sync()
+        runs = []
+        for segment in self.__segments:
+            if segment.length == 0:
+                continue
+            data = segment.data[:segment.length]
+            if runs and runs[-1][0] + len(runs[-1][1]) == segment.start + 0x200:
+                runs[-1][1].extend(data)
+            else:
+                runs.append((segment.start + 0x200, data))
+        return [(address, bytes(data)) for (address, data) in runs]
+
+    def size(self):
+        """The length of the ROM image, from 0x200 to the last byte written."""
+        self.__sync()
+        return max((segment.end for segment in self.__segments if segment.length), default=0)
+
+    @property
+    def program(self):
+        """The ROM image, up to the last byte written."""
+        size = self.size()
+        if len(self.__segments) == 1 and self.__base == 0:
+            return self.__rom[:size]
+        image = bytearray(size)
+        for segment in self.__segments:
+            image[segment.start:segment.end] = segment.data[:segment.length]
+        return image
 
     def lookup(self, n):
-        return self.program[n - 0x200]
+        index = n - 0x200
+        size = self.size()
+        if not -size <= index < size:
+            raise IndexError("no ROM at 0x{:04X}".format(n))
+        return self.__image()[index % size]
+
+    def store(self, address, data):
+        """Overwrite bytes already written, from address."""
+        image = self.__image()
+        offset = address - 0x200
+        for byte in data:
+            image[offset] = byte
+            offset += 1
+
+    def remove(self, runs):
+        """
+        Take out runs of bytes, given as (offset, length) in offset order,
+        before the program is resolved. Each segment closes up around them,
+        and everything after them in the segment moves back: labels, fixups,
+        relocations and the addresses they hold, deferred bytes and
+        breakpoints. Anything referring to the start of a run refers to
+        whatever follows it.
+        """
+        self.__sync()
+        runs = sorted(runs)
+        starts = [offset for (offset, _) in runs]
+        gone = list(accumulate(length for (_, length) in runs))
+        segments = self.__segments
+        bases = [segment.start for segment in segments]
+
+        def removed(offset):
+            index = bisect_right(starts, offset) - 1
+            if index < 0:
+                return 0
+            start, length = runs[index]
+            return gone[index] - length + min(length, offset - start)
+
+        def move(offset):
+            base = bases[max(bisect_right(bases, offset) - 1, 0)]
+            return offset - removed(offset) + removed(base)
+
+        def kept(offset):
+            index = bisect_right(starts, offset) - 1
+            return index < 0 or offset >= runs[index][0] + runs[index][1]
+
+        for segment in segments:
+            data = segment.data[:segment.length]
+            for start, length in reversed(runs):
+                if segment.start <= start < segment.end:
+                    del data[start - segment.start:start - segment.start + length]
+            segment.data = data
+            segment.length = len(data)
+        self.__offset = move(self.__offset)
+        self.__select(self.__segment)
+
+        self.labels = {name: move(pc - 0x200) + 0x200 for (name, pc) in self.labels.items()}
+        self.fixups = Fixups((token, move(offset), how)
+                             for (token, offset, how) in self.fixups.since(0)
+                             if kept(offset - 1 if how == UNPACK else offset))
+        image = self.__image()
+        relocations = []
+        for offset in self.relocations:
+            if kept(offset):
+                offset = move(offset)
+                target = (image[offset] & 0xF) << 8 | image[offset+1]
+                self.__resolve_addrop(offset, move(target - 0x200) + 0x200)
+                relocations.append(offset)
+        self.relocations = relocations
+        self.deferred_bytes = [(move(offset), expression)
+                               for (offset, expression) in self.deferred_bytes if kept(offset)]
+        breakpoints = self.debugger.breakpoints
+        for name, (token, pc) in breakpoints.items():
+            breakpoints[name] = (token, move(pc - 0x200) + 0x200)
+        if self.__main_jump is not None:
+            self.__main_jump = move(self.__main_jump) if kept(self.__main_jump) else None
+        if self.source_map is not None:
+            self.source_map.move(lambda address: move(address - 0x200) + 0x200)
 
     def breakpoint(self, name):
         self.debugger.breakpoints[name.text] = (name, self.pc())
@@ -39,36 +458,82 @@ class Program():
     def monitor(self, addr, monlen):
         self.debugger.monitors.append((addr, monlen))
 
-    def __emit(self, op):
-        if self.__offset < 0:
-            raise Exception("Can't emit data below 0x200. org: {}".format(self.__offset))
-        additional_size = self.__offset + len(op) - len(self.program)
-        self.program.extend([0] * additional_size)
-        self.program[self.__offset:self.__offset+len(op)] = op
-        self.__offset += len(op)
+    def __reserve(self, length):
+        """
+        Check there's room for length bytes at the current offset, and return
+        where they go in __rom.
+        """
+        offset = self.__offset
+        end = offset + length
+        if end > self.__limit:
+            self.__make_room(end)
+        self.__high = max(self.__high, end)
+        self.__offset = end
+        return offset - self.__base
+
+    def __make_room(self, end):
+        """
+        Grow the segment being written to up to end, taking in the segments
+        after it that it runs into.
+        """
+        offset = self.__offset
+        if offset < 0:
+            raise EmitError("Can't emit data below 0x200. org: {}".format(offset))
+        self.__sync()
+        segment = self.__segment
+        segments = self.__segments
+        index = segments.index(segment)
+        while index + 1 < len(segments) and segments[index + 1].start < end:
+            following = segments.pop(index + 1)
+            length = following.end - segment.start
+            segment.reserve(length)
+            segment.data[following.start - segment.start:length] = following.data[:following.length]
+            segment.length = max(segment.length, length)
+        segment.reserve(end - segment.start)
+        self.__select(segment)
+
+    def __emit(self, data):
+        offset = self.__reserve(len(data))
+        self.__rom[offset:offset + len(data)] = data
+
+    def __emit_op(self, high, low):
+        offset = self.__reserve(2)
+        rom = self.__rom
+        rom[offset] = high
+        rom[offset+1] = low
 
     def __xyn_op(self, op, x, y, n):
-        self.__emit((op << 4 | x, y << 4 | n))
+        self.__emit_op(op << 4 | x, y << 4 | n)
 
     def __xn_op(self, op, x, n):
-        self.__emit((op << 4 | x, n))
+        self.__emit_op(op << 4 | x, n)
 
-    def __n_op(self, op, n):
+    def __n_op(self, op, n, how=ADDRESS):
         if isinstance(n, int):
-            self.__emit((op << 4 | n >> 8, n & 0xFF))
+            self.__emit_op(op << 4 | n >> 8, n & 0xFF)
         elif isinstance(n, Token):
-            self.unresolved.jumpsandcalls.append((n, self.__offset))
-            self.__emit((op << 4 | 5, 0x55))
+            if self.hooks is not None:
+                self.hooks.fixup("jumpsandcalls")
+            self.fixups.add(n, self.__offset, how)
+            self.__emit_op(op << 4 | 5, 0x55)
         else:
-            raise Exception("Only number or token for n_op")
+            raise EmitError("Only number or token for n_op")
 
     def __resolve_addrop(self, jumpspot, value):
-        self.program[jumpspot] &= 0xF0
-        self.program[jumpspot] |= (value >> 8)
-        self.program[jumpspot+1] = value & 0xFF
+        rom = self.__rom
+        if self.__base <= jumpspot < self.__high:
+            jumpspot -= self.__base
+        else:
+            rom = self.__image()
+        rom[jumpspot] &= 0xF0
+        rom[jumpspot] |= (value >> 8)
+        rom[jumpspot+1] = value & 0xFF
 
     def __add_main_jump(self):
-        self.unresolved.jumpsandcalls.append((Token("main", 0, 0), 0))
+        self.__main_jump = self.__offset
+        if self.hooks is not None:
+            self.hooks.fixup("jumpsandcalls")
+        self.fixups.add(Token("main", 0, 0), self.__offset, ADDRESS)
         self.JMP(0x555)
 
     def __pop_end_jump(self, offset=0):
@@ -76,12 +541,14 @@ class Program():
             return False
 
         endjump = self.unresolved.begins.pop()
+        self.relocations.append(endjump)
         self.__resolve_addrop(endjump, self.pc() + offset)
         return True
 
 
     def emit_byte(self, byte):
-        self.__emit((byte,))
+        offset = self.__reserve(1)
+        self.__rom[offset] = byte
 
     def SYS(self, n):
         self.__n_op(0, n)
@@ -125,8 +592,8 @@ class Program():
     def LDI(self, n):
         self.__n_op(0xA, n)
     def LDIL(self, addr):
-        self.__emit((0xF0, 0x00))
-        self.__n_op(0, addr)
+        self.__emit_op(0xF0, 0x00)
+        self.__n_op(0, addr, LONG)
     def JMP0(self, n):
         self.__n_op(0xB, n)
     def RAND(self, x, n):
@@ -184,15 +651,21 @@ class Program():
     def emit_else(self):
         if not self.__pop_end_jump(2):
             return False
+        if self.hooks is not None:
+            self.hooks.fixup("begins")
         self.unresolved.begins.append(self.__offset)
         self.JMP(0x333)
         return True
 
     def emit_begin(self):
+        if self.hooks is not None:
+            self.hooks.fixup("begins")
         self.unresolved.begins.append(self.__offset)
         self.JMP(0x333)
 
     def emit_while(self):
+        if self.hooks is not None:
+            self.hooks.fixup("whiles")
         self.unresolved.whiles[-1].append(self.__offset)
         self.JMP(0x444)
 
@@ -206,26 +679,178 @@ class Program():
     def end_loop(self):
         whiles = self.unresolved.whiles.pop()
         for whilespot in whiles:
+            self.relocations.append(whilespot)
             self.__resolve_addrop(whilespot, self.pc()+2)
 
         ret = self.unresolved.loops.pop()
+        self.relocations.append(self.__offset)
         self.JMP(ret)
 
     def emit_unpack(self, msn, name):
         self.LDN(0, msn << 4)
         self.LDN(1, 0)
-        self.unresolved.unpacks[self.__offset] = name
-
-    def resolve(self):
-        for pc, token in self.unresolved.unpacks.items():
-            if token.text not in self.labels:
-                raise ParseError("Unresolved name", token)
-            target = self.labels[token.text]
-            self.program[pc-1] = target & 0xFF
-            self.program[pc-3] |= (target >> 8) & 0xF
-
-        for (token, location) in self.unresolved.jumpsandcalls:
-            if token.text not in self.labels:
+        if self.hooks is not None:
+            self.hooks.fixup("unpacks")
+        self.fixups.add(name, self.__offset, UNPACK)
+
+    def emit_deferred_byte(self, deferred):
+        self.__deferrals += 1
+        self.deferred_bytes.append((self.__offset, deferred))
+        self.emit_byte(0)
+
+    def defer_const(self, name, deferred):
+        self.__deferrals += 1
+        self.deferred_consts[name] = deferred
+
+    def guess(self, deferred):
+        """
+        An address for an :org whose expression can't be evaluated yet.
+        """
+        self.__deferrals += 1
+        index = len(self.guesses)
+        address = self.hints[index] if index < len(self.hints) else self.pc()
+        self.guesses.append((deferred, address))
+        return address
+
+    def resolve(self, errors=None):
+        """
+        Fill in the addresses and deferred bytes, and work out every deferred
+        const, whether anything uses it or not, into calculated. With a list
+        of errors, each error is added to it, and everything else still
+        filled in, rather than the first being raised.
+        """
+        deferred = DeferredConsts(self.deferred_consts, self.lookup)
+        try:
+            hints = [int(deferred.evaluate(expression)) for (expression, _) in self.guesses]
+        except ParseError as error:
+            if errors is None:
+                raise
+            # The guesses can't be checked; the error says why.
+            errors.append(error)
+            hints = [address for (_, address) in self.guesses]
+        for (expression, address), hint in zip(self.guesses, hints):
+            if hint != address:
+                raise Unsettled(hints, expression.tokens[0])
+
+        targets = ChainMap(self.labels, deferred) if self.deferred_consts else self.labels
+        image = self.__image()
+        if errors is None:
+            token = self.fixups.missing(targets)
+            if token is not None:
                 raise ParseError("Unresolved name", token)
-            target = self.labels[token.text]
-            self.__resolve_addrop(location, target)
+            self.fixups.patch(image, targets)
+        else:
+            errors.extend(ParseError("Unresolved name", token)
+                          for token in self.fixups.unresolved(targets))
+            for name in self.fixups.names:
+                if name in targets:
+                    try:
+                        self.fixups.patch(image, targets, (name,))
+                    except ParseError as error:
+                        errors.append(error)
+
+        for (offset, expression) in self.deferred_bytes:
+            try:
+                value = deferred.evaluate(expression)
+                if value < -127 or value > 255:
+                    raise ParseError("byte expression result {} out of range".format(value),
+                                     expression.tokens[0])
+            except ParseError as error:
+                if errors is None:
+                    raise
+                errors.append(error)
+                continue
+            image[offset] = int(value) & 0xFF
+
+        for name in self.deferred_consts:
+            try:
+                self.calculated[name] = deferred[name]
+            except ParseError as error:
+                if errors is None:
+                    raise
+                if not any(error is reported for reported in errors):
+                    errors.append(error)
+
+    def relink(self, moved):
+        """
+        Move labels to new addresses after resolve(), given as a dict of name
+        to address, patching only the sites that refer to them.
+        """
+        self.labels.update(moved)
+        self.fixups.patch(self.__image(), self.labels, moved)
+
+    def __blocks(self):
+        unresolved = self.unresolved
+        whiles = tuple(tuple(w) for w in unresolved.whiles)
+        return (tuple(unresolved.begins), tuple(unresolved.loops), whiles)
+
+    def mark(self):
+        """
+        Remember the current state, so that whatever is emitted from here on
+        can be captured with fragment().
+        """
+        return Mark(
+            self.__offset, self.__orgs,
+            len(self.fixups),
+            len(self.relocations), len(self.labels),
+            len(self.debugger.breakpoints), len(self.debugger.monitors),
+            self.__deferrals, self.__blocks())
+
+    def fragment(self, mark):
+        """
+        Capture everything emitted since mark as a Fragment. Returns None if
+        the code wasn't emitted contiguously, or if it closed or extended
+        blocks opened before the mark, since then it touched bytes outside of
+        itself, or if it left expressions to evaluate when it's resolved.
+        """
+        if (self.__orgs != mark.orgs or self.__blocks() != mark.blocks
+                or self.__deferrals != mark.deferred):
+            return None
+        start = mark.offset
+        base = start + 0x200
+        return Fragment(
+            base,
+            bytes(self.__rom[start - self.__base:self.__offset - self.__base]),
+            tuple((token, offset - start, how) for (token, offset, how)
+                  in self.fixups.since(mark.fixups)),
+            tuple(offset - start for offset in self.relocations[mark.relocations:]),
+            tuple((name, pc - base) for (name, pc)
+                  in tail(self.labels.items(), len(self.labels) - mark.labels)),
+            tuple((name, token, pc - base) for (name, (token, pc))
+                  in tail(self.debugger.breakpoints.items(),
+                          len(self.debugger.breakpoints) - mark.breakpoints)),
+            tuple(self.debugger.monitors[mark.monitors:]),
+            self.__main_jump is None or self.__main_jump < start)
+
+    def replay(self, fragment):
+        """
+        Emit a previously captured fragment at the current pc, relocating the
+        addresses that point into it.
+        """
+        start = self.__offset
+        delta = start + 0x200 - fragment.base
+        if delta != 0 and not fragment.relocatable:
+            raise EmitError("Fragment from 0x{:04X} can't move".format(fragment.base))
+        data = bytearray(fragment.data)
+        if delta != 0:
+            for offset in fragment.relocations:
+                target = ((data[offset] & 0xF) << 8 | data[offset+1]) + delta
+                data[offset] = (data[offset] & 0xF0) | (target >> 8)
+                data[offset+1] = target & 0xFF
+        self.__emit(data)
+
+        base = start + 0x200
+        add_fixup = self.fixups.add
+        for (token, offset, how) in fragment.fixups:
+            add_fixup(token, start + offset, how)
+        if self.hooks is not None:
+            # Blocks in replayed code were closed when it was recorded, so
+            # only its addresses are reported.
+            for (_, _, how) in fragment.fixups:
+                self.hooks.fixup("unpacks" if how == UNPACK else "jumpsandcalls")
+        self.relocations.extend(start + offset for offset in fragment.relocations)
+        for (name, offset) in fragment.labels:
+            self.labels[name] = base + offset
+        for (name, token, offset) in fragment.breakpoints:
+            self.debugger.breakpoints[name] = (token, base + offset)
+        self.debugger.monitors.extend(fragment.monitors)
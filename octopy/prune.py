@@ -0,0 +1,247 @@
+"""
+Dead code and unused data elimination (octopy --prune).
+
+Like the optimizer, this runs between parsing and resolving, on a program
+parsed with symbolic labels (see Program.symbolic), and takes out whatever
+nothing uses. The program is split into blocks, each running from a label
+(or the start of a segment) to the next. Starting from 0x200 (which jumps to
+main) and any labels asked to be kept, blocks are kept if:
+
+    - code reached by following the control flow runs through them
+    - a kept block uses their label as data (with i :=, i := long, :unpack,
+      or an entry in a jump0 table)
+    - their label is used in a { } expression, or as a number
+
+and every other block is taken out, with everything after it moving back.
+Data may be read past the label it's found by (i := font i += v0), so a
+block kept as data keeps the blocks after it too, up to the next label that
+code jumps or calls to. Nothing is taken out before an address used as a
+number, and nothing at all if kept code uses a numeric address into the
+program.
+"""
+from bisect import bisect_right
+from typing import NamedTuple
+
+from octopy.optimize import EXIT, RETURN, is_skip
+from octopy.program import ADDRESS
+
+class Block(NamedTuple):
+    start: int
+    end: int
+    labels: tuple
+
+class Report():
+    """
+    What was taken out: each block, as (address, length, labels), the bytes
+    taken out, and the labels that were dropped or moved. notes says why
+    blocks were left in, if they were.
+    """
+    def __init__(self):
+        self.removed = []
+        self.dropped = {}
+        self.moved = {}
+        self.notes = []
+
+    @property
+    def bytes(self):
+        return sum(length for (_, length, _) in self.removed)
+
+    def table(self):
+        lines = ["{:<24}{:>12}".format("blocks removed", len(self.removed)),
+                 "{:<24}{:>12}".format("bytes removed", self.bytes),
+                 "{:<24}{:>12}".format("labels moved", len(self.moved)),
+                 ""]
+        for address, length, labels in self.removed:
+            lines.append("0x{:04X} {:>6}  {}".format(address, length, " ".join(labels)))
+        for note in self.notes:
+            lines.append("not removing: {}".format(note))
+        return "\n".join(lines)
+
+class Pruner():
+    def __init__(self, program, keep=()):
+        self.program = program
+        self.keep = keep
+        self.report = Report()
+        self.rom = b""
+        self.sites = {}
+        self.starts = []
+        self.blocks_by_start = {}
+        self.kept = set()
+        self.data = set()
+        self.entries = set()
+        self.traced = set()
+        self.numeric = []
+
+    def blocks(self):
+        """The blocks the ROM splits into, in order."""
+        program = self.program
+        starts = {}
+        for name, pc in program.labels.items():
+            starts.setdefault(pc - 0x200, []).append(name)
+        ends = []
+        for address, data in program.segments():
+            starts.setdefault(address - 0x200, [])
+            ends.append(address - 0x200 + len(data))
+        blocks = []
+        offsets = sorted(starts)
+        for start, following in zip(offsets, offsets[1:] + [None]):
+            end = min((end for end in ends if end > start), default=start)
+            if following is not None:
+                end = min(end, following)
+            blocks.append(Block(start, end, tuple(starts[start])))
+        return blocks
+
+    def run(self):
+        program = self.program
+        self.rom = program.program
+        self.sites = {}
+        for token, offset, how in program.fixups.since(0):
+            self.sites.setdefault(offset, []).append((token.text, how))
+        blocks = [block for block in self.blocks() if block.end > block.start]
+        self.starts = [block.start for block in blocks]
+        self.blocks_by_start = {block.start: block for block in blocks}
+        self.kept = set()
+        self.data = set()
+        self.entries = self.code_labels()
+
+        missing = [name for name in self.keep if name not in program.labels]
+        if missing:
+            self.report.notes.append("no label {}".format(", ".join(missing)))
+        code = [0] + [program.labels[name] - 0x200 for name in self.keep if name in program.labels]
+        data = [name for (_, name) in self.named()]
+        data.extend(name for name in self.keep if name in program.labels)
+        self.traced = set()
+        self.numeric = []
+        while code or data:
+            while code:
+                code.extend(self.trace(code.pop(), data))
+            while data:
+                name = data.pop()
+                if name in program.labels:
+                    code.extend(self.keep_data(program.labels[name] - 0x200, data))
+
+        horizon = max((address - 0x200 for (_, address) in program.pins), default=0)
+        runs = []
+        for block in blocks:
+            if block.start in self.kept:
+                continue
+            if block.start < horizon:
+                self.report.notes.append("0x{:04X} is used as a number".format(horizon + 0x200))
+                continue
+            runs.append((block.start, block.end - block.start))
+            self.report.removed.append((block.start + 0x200, block.end - block.start, block.labels))
+            for name in block.labels:
+                self.report.dropped[name] = block.start + 0x200
+        if self.numeric:
+            self.report.notes.extend(self.numeric)
+            runs, self.report.removed, self.report.dropped = [], [], {}
+        self.report.notes = list(dict.fromkeys(self.report.notes))
+        if runs:
+            labels = dict(program.labels)
+            program.remove(runs)
+            for name in self.report.dropped:
+                del program.labels[name]
+            self.report.moved = {name: (pc, program.labels[name]) for (name, pc) in labels.items()
+                                 if name in program.labels and program.labels[name] != pc}
+        return self.report
+
+    def named(self):
+        """(token, name) for every label named in a { } or used as a number."""
+        program = self.program
+        expressions = [expression for (_, expression) in program.deferred_bytes]
+        expressions.extend(program.deferred_consts.values())
+        expressions.extend(expression for (expression, _) in program.guesses)
+        for expression in expressions:
+            for token in expression.tokens:
+                if token.text in program.labels:
+                    yield token, token.text
+        for token, _ in program.pins:
+            if token.text in program.labels:
+                yield token, token.text
+
+    def code_labels(self):
+        """The offsets of labels something jumps or calls to."""
+        entries = set()
+        for offset, sites in self.sites.items():
+            for name, how in sites:
+                if how == ADDRESS and self.rom[offset] >> 4 in (0x1, 0x2, 0xB):
+                    pc = self.program.labels.get(name)
+                    if pc is not None:
+                        entries.add(pc - 0x200)
+        return entries
+
+    def block(self, offset):
+        """The start of the block offset is in."""
+        index = bisect_right(self.starts, offset) - 1
+        return self.starts[index] if index >= 0 else None
+
+    def keep_data(self, offset, data):
+        """
+        Keep the block at offset, and those after it up to the next code
+        label, as data. Returns the offsets of code they jump to.
+        """
+        code = []
+        start = self.block(offset)
+        while start is not None and start not in self.data:
+            block = self.blocks_by_start[start]
+            self.kept.add(start)
+            self.data.add(start)
+            for site in range(block.start, block.end):
+                for name, how in self.sites.get(site, ()):
+                    if how == ADDRESS and self.rom[site] >> 4 in (0x1, 0x2, 0xB):
+                        pc = self.program.labels.get(name)
+                        if pc is not None:
+                            code.append(pc - 0x200)
+                    else:
+                        data.append(name)
+            start = block.end if block.end in self.blocks_by_start else None
+            if start in self.entries:
+                break
+        return code
+
+    def trace(self, offset, data):
+        """
+        Follow the control flow from offset, keeping the blocks it runs
+        through. Returns the offsets of code it goes to, and adds the names
+        it uses as data to data.
+        """
+        rom, program, code = self.rom, self.program, []
+        size = len(rom)
+        while offset not in self.traced and 0 <= offset and offset + 2 <= size:
+            self.traced.add(offset)
+            op = rom[offset] << 8 | rom[offset+1]
+            length = 4 if op == 0xF000 else 2
+            for n in range(length):
+                start = self.block(offset + n)
+                if start is not None:
+                    self.kept.add(start)
+            kind = op >> 12
+            for name, how in self.sites.get(offset, ()):
+                pc = program.labels.get(name)
+                if how != ADDRESS or kind in (0xA, 0xB):
+                    data.append(name)
+                if how == ADDRESS and kind in (0x1, 0x2, 0xB) and pc is not None:
+                    code.append(pc - 0x200)
+            for name, how in self.sites.get(offset + 2, ()):
+                if how != ADDRESS:
+                    data.append(name)
+            if not self.sites.get(offset) and kind in (0x1, 0x2, 0xA, 0xB):
+                address = op & 0xFFF
+                if offset in program.relocations:
+                    if kind in (0x1, 0x2):
+                        code.append(address - 0x200)
+                elif 0x200 <= address < size + 0x200:
+                    self.numeric.append("numeric address 0x{:03X} at 0x{:04X}".format(
+                        address, offset + 0x200))
+            if kind in (0x1, 0xB) or op in (RETURN, EXIT):
+                break
+            after = offset + length
+            if is_skip(op) and after + 2 <= size:
+                skipped = rom[after] << 8 | rom[after+1]
+                code.append(after + (4 if skipped == 0xF000 else 2))
+            offset = after
+        return code
+
+def prune(program, keep=()):
+    """Take out what a parsed, symbolic program doesn't use. Returns a Report."""
+    return Pruner(program, keep).run()
@@ -0,0 +1,821 @@
+"""
+A headless CHIP-8/SCHIP/XO-Chip interpreter, for checking what an assembled
+ROM does rather than what bytes it is.
+
+The machine runs frame by frame: each frame it runs a number of instructions
+(cycles, 20 by default, like Octo), then counts the timers down. Code is
+decoded a basic block at a time (straight-line code up to a jump, call,
+return, skip or key wait) into a function that runs the block's instructions
+one after the other, and the blocks are kept, by address, to run again. A
+write to memory that holds a decoded block throws the decoded blocks away, so
+self-modifying code works.
+
+The display is a NumPy array of two planes of 64x128 pixels, of which the top
+left 32x64 is used in lores, so sprites are XORed and tested for collision a
+row at a time. NumPy is optional: without it, the display is a pair of
+bytearrays instead, and sprites are drawn a pixel at a time.
+
+Keys are scripted: keys maps frame numbers to the keys held from that frame
+on, or is a function of the frame number. Each instruction run is counted
+against the label it's at (the nearest label at or before it), so profile()
+says where the cycles go.
+"""
+import argparse
+import random
+from bisect import bisect_right
+from typing import NamedTuple
+
+from octopy.assemble import assemble_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MEMORY = 0x10000
+STACK = 16
+CYCLES = 20
+
+# The longest block decoded at once.
+MAX_BLOCK = 64
+
+WIDTH, HEIGHT = 128, 64
+PLANES = 2
+
+FONT = bytes([
+    0xF0, 0x90, 0x90, 0x90, 0xF0, 0x20, 0x60, 0x20, 0x20, 0x70,
+    0xF0, 0x10, 0xF0, 0x80, 0xF0, 0xF0, 0x10, 0xF0, 0x10, 0xF0,
+    0x90, 0x90, 0xF0, 0x10, 0x10, 0xF0, 0x80, 0xF0, 0x10, 0xF0,
+    0xF0, 0x80, 0xF0, 0x90, 0xF0, 0xF0, 0x10, 0x20, 0x40, 0x40,
+    0xF0, 0x90, 0xF0, 0x90, 0xF0, 0xF0, 0x90, 0xF0, 0x10, 0xF0,
+    0xF0, 0x90, 0xF0, 0x90, 0x90, 0xE0, 0x90, 0xE0, 0x90, 0xE0,
+    0xF0, 0x80, 0x80, 0x80, 0xF0, 0xE0, 0x90, 0x90, 0x90, 0xE0,
+    0xF0, 0x80, 0xF0, 0x80, 0xF0, 0xF0, 0x80, 0xF0, 0x80, 0x80,
+])
+BIGFONT_ADDRESS = len(FONT)
+BIGFONT = bytes([
+    0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C,
+    0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C,
+    0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF,
+    0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C,
+    0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06,
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C,
+    0x3E, 0x7C, 0xC0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C,
+    0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60,
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C,
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C,
+    0x7E, 0xFF, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3,
+    0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC,
+    0x3C, 0xFF, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0xFF, 0x3C,
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC,
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0,
+])
+
+class Quirks(NamedTuple):
+    """
+    The behaviours interpreters disagree on. The defaults are Octo's.
+
+    shift       vx <<= vy and vx >>= vy shift vx, not vy
+    load_store  load and save leave i as it is
+    jump0       jump0 adds vx (x being the top digit of the address), not v0
+    logic       |=, &= and ^= clear vf
+    clip        sprites are clipped at the edges of the display, not wrapped
+    """
+    shift: bool = False
+    load_store: bool = False
+    jump0: bool = False
+    logic: bool = False
+    clip: bool = True
+
+class MachineError(Exception):
+    def __init__(self, msg, pc):
+        super().__init__(msg)
+        self.msg = msg
+        self.pc = pc
+
+    def __str__(self):
+        return "0x{:04X}: {}".format(self.pc, self.msg)
+
+class Block(NamedTuple):
+    start: int
+    end: int
+    run: object
+    cycles: int
+    # (label index, cycles) for each label the block runs through.
+    counts: tuple
+
+def script(keys):
+    """A function of the frame number giving the keys held, from keys as for Machine."""
+    if keys is None:
+        return lambda frame: frozenset()
+    if callable(keys):
+        return keys
+    frames = sorted(keys)
+    held = [frozenset(keys[frame]) for frame in frames]
+    def at(frame):
+        index = bisect_right(frames, frame) - 1
+        return held[index] if index >= 0 else frozenset()
+    return at
+
+class Instruction(NamedTuple):
+    """An op being decoded, split into its fields, and the quirks it runs with."""
+    op: int
+    x: int
+    y: int
+    n: int
+    nn: int
+    nnn: int
+    quirks: Quirks
+
+def instruction(op, quirks):
+    return Instruction(op, op >> 8 & 0xF, op >> 4 & 0xF, op & 0xF, op & 0xFF, op & 0xFFF, quirks)
+
+# Each of the functions below is given an Instruction, and returns the
+# function doing it, or None if it isn't one they do. They're found in the
+# tables after them, by the parts of the op that tell them apart.
+
+def assign(ins):
+    x, y = ins.x, ins.y
+    def f(m):
+        v = m.v
+        v[x] = v[y]
+    return f
+
+LOGIC = {0x1: int.__or__, 0x2: int.__and__, 0x3: int.__xor__}
+
+def logic(ins):
+    x, y, quirks = ins.x, ins.y, ins.quirks
+    operator = LOGIC[ins.n]
+    def f(m):
+        v = m.v
+        v[x] = operator(v[x], v[y])
+        if quirks.logic:
+            v[0xF] = 0
+    return f
+
+def add(ins):
+    x, y = ins.x, ins.y
+    def f(m):
+        v = m.v
+        total = v[x] + v[y]
+        v[x] = total & 0xFF
+        v[0xF] = total >> 8
+    return f
+
+def subtract(ins):
+    x, y = ins.x, ins.y
+    def f(m):
+        v = m.v
+        flag = int(v[x] >= v[y])
+        v[x] = (v[x] - v[y]) & 0xFF
+        v[0xF] = flag
+    return f
+
+def subtract_from(ins):
+    x, y = ins.x, ins.y
+    def f(m):
+        v = m.v
+        flag = int(v[y] >= v[x])
+        v[x] = (v[y] - v[x]) & 0xFF
+        v[0xF] = flag
+    return f
+
+def shift_right(ins):
+    x = ins.x
+    source = x if ins.quirks.shift else ins.y
+    def f(m):
+        v = m.v
+        flag = v[source] & 1
+        v[x] = v[source] >> 1
+        v[0xF] = flag
+    return f
+
+def shift_left(ins):
+    x = ins.x
+    source = x if ins.quirks.shift else ins.y
+    def f(m):
+        v = m.v
+        flag = v[source] >> 7
+        v[x] = (v[source] << 1) & 0xFF
+        v[0xF] = flag
+    return f
+
+# 8xyn, by n.
+ARITHMETIC = {
+    0x0: assign, 0x1: logic, 0x2: logic, 0x3: logic, 0x4: add,
+    0x5: subtract, 0x6: shift_right, 0x7: subtract_from, 0xE: shift_left,
+}
+
+def arithmetic(ins):
+    build = ARITHMETIC.get(ins.n)
+    return build(ins) if build is not None else None
+
+def display(ins):
+    op, n = ins.op, ins.n
+    if op == 0x00E0:
+        return lambda m: m.clear()
+    if op & 0xFFF0 == 0x00C0:
+        return lambda m: m.scroll(0, n)
+    if op & 0xFFF0 == 0x00D0:
+        return lambda m: m.scroll(0, -n)
+    if op == 0x00FB:
+        return lambda m: m.scroll(4, 0)
+    if op == 0x00FC:
+        return lambda m: m.scroll(-4, 0)
+    if op in (0x00FE, 0x00FF):
+        return lambda m: m.resolution(op == 0x00FF)
+    return None
+
+def save_load_range(ins):
+    x, y, n = ins.x, ins.y, ins.n
+    step = 1 if x <= y else -1
+    registers = list(range(x, y + step, step))
+    if n == 0x2:
+        return lambda m: m.store(m.i, bytes(m.v[r] for r in registers))
+    if n != 0x3:
+        return None
+    def f(m):
+        data = m.read(m.i, len(registers))
+        for r, value in zip(registers, data):
+            m.v[r] = value
+    return f
+
+def set_register(ins):
+    x, nn = ins.x, ins.nn
+    def f(m):
+        m.v[x] = nn
+    return f
+
+def add_byte(ins):
+    x, nn = ins.x, ins.nn
+    def f(m):
+        v = m.v
+        v[x] = (v[x] + nn) & 0xFF
+    return f
+
+def set_i(ins):
+    nnn = ins.nnn
+    def f(m):
+        m.i = nnn
+    return f
+
+def random_byte(ins):
+    x, nn = ins.x, ins.nn
+    def f(m):
+        m.v[x] = m.random.randrange(256) & nn
+    return f
+
+def sprite(ins):
+    x, y, n = ins.x, ins.y, ins.n
+    return lambda m: m.draw(m.v[x], m.v[y], n)
+
+def select_plane(ins):
+    x = ins.x
+    def f(m):
+        m.plane = x
+    return f
+
+def audio_pattern(ins):
+    if ins.op != 0xF002:
+        return None
+    def f(m):
+        m.pattern = m.read(m.i, 16)
+    return f
+
+def get_delay(ins):
+    x = ins.x
+    def f(m):
+        m.v[x] = m.delay
+    return f
+
+def set_delay(ins):
+    x = ins.x
+    def f(m):
+        m.delay = m.v[x]
+    return f
+
+def set_sound(ins):
+    x = ins.x
+    def f(m):
+        m.sound = m.v[x]
+    return f
+
+def add_i(ins):
+    x = ins.x
+    def f(m):
+        m.i = (m.i + m.v[x]) & 0xFFFF
+    return f
+
+def hex_font(ins):
+    x = ins.x
+    def f(m):
+        m.i = (m.v[x] & 0xF) * 5
+    return f
+
+def big_font(ins):
+    x = ins.x
+    def f(m):
+        m.i = BIGFONT_ADDRESS + (m.v[x] & 0xF) * 10
+    return f
+
+def bcd(ins):
+    x = ins.x
+    def f(m):
+        value = m.v[x]
+        m.store(m.i, bytes((value // 100, value // 10 % 10, value % 10)))
+    return f
+
+def set_pitch(ins):
+    x = ins.x
+    def f(m):
+        m.pitch = m.v[x]
+    return f
+
+def save(ins):
+    x, quirks = ins.x, ins.quirks
+    def f(m):
+        m.store(m.i, bytes(m.v[:x+1]))
+        if not quirks.load_store:
+            m.i = (m.i + x + 1) & 0xFFFF
+    return f
+
+def load(ins):
+    x, quirks = ins.x, ins.quirks
+    def f(m):
+        m.v[:x+1] = m.read(m.i, x + 1)
+        if not quirks.load_store:
+            m.i = (m.i + x + 1) & 0xFFFF
+    return f
+
+def save_flags(ins):
+    x = ins.x
+    def f(m):
+        m.flags[:x+1] = m.v[:x+1]
+    return f
+
+def load_flags(ins):
+    x = ins.x
+    def f(m):
+        m.v[:x+1] = m.flags[:x+1]
+    return f
+
+# Fxnn, by nn.
+MISC = {
+    0x01: select_plane, 0x02: audio_pattern, 0x07: get_delay, 0x15: set_delay,
+    0x18: set_sound, 0x1E: add_i, 0x29: hex_font, 0x30: big_font, 0x33: bcd,
+    0x3A: set_pitch, 0x55: save, 0x65: load, 0x75: save_flags, 0x85: load_flags,
+}
+
+def misc(ins):
+    build = MISC.get(ins.nn)
+    return build(ins) if build is not None else None
+
+# The ops that carry on to the next instruction, by their top digit.
+STRAIGHT = {
+    0x0: display, 0x5: save_load_range, 0x6: set_register, 0x7: add_byte,
+    0x8: arithmetic, 0xA: set_i, 0xC: random_byte, 0xD: sprite, 0xF: misc,
+}
+
+def straight(ins):
+    """
+    The function doing an Instruction that carries on to the next
+    instruction, or None if it isn't one.
+    """
+    build = STRAIGHT.get(ins.op >> 12)
+    return build(ins) if build is not None else None
+
+def writes(op):
+    """Whether op writes to memory (and so may change code)."""
+    return op >> 12 == 0xF and op & 0xFF in (0x33, 0x55) or op & 0xF00F == 0x5002
+
+# The tests of the skip ops, which are built like the functions doing the
+# other ops, but return whether to skip.
+
+def equal_byte(ins):
+    x, nn = ins.x, ins.nn
+    return lambda m: m.v[x] == nn
+
+def not_equal_byte(ins):
+    x, nn = ins.x, ins.nn
+    return lambda m: m.v[x] != nn
+
+def equal_register(ins):
+    x, y = ins.x, ins.y
+    if ins.n != 0:
+        return None
+    return lambda m: m.v[x] == m.v[y]
+
+def not_equal_register(ins):
+    x, y = ins.x, ins.y
+    if ins.n != 0:
+        return None
+    return lambda m: m.v[x] != m.v[y]
+
+def key_test(ins):
+    x = ins.x
+    if ins.nn == 0x9E:
+        return lambda m: m.v[x] & 0xF in m.keys
+    if ins.nn == 0xA1:
+        return lambda m: m.v[x] & 0xF not in m.keys
+    return None
+
+# The skips, by their top digit.
+TESTS = {0x3: equal_byte, 0x4: not_equal_byte, 0x5: equal_register,
+         0x9: not_equal_register, 0xE: key_test}
+
+def skip(ins, after):
+    """
+    The function doing a skip, returning the next pc given the pc of the
+    skip, or None if the Instruction isn't one. after is the size of the
+    instruction it skips.
+    """
+    build = TESTS.get(ins.op >> 12)
+    test = build(ins) if build is not None else None
+    if test is None:
+        return None
+    def f(m, pc):
+        return pc + 2 + after if test(m) else pc + 2
+    return f
+
+# Each of these is given an Instruction too, and returns the function ending
+# a block with it, which returns the next pc given the pc of the op.
+
+def return_or_exit(ins):
+    if ins.op == 0x00EE:
+        return lambda m, pc: m.ret(pc)
+    if ins.op != 0x00FD:
+        return None
+    def f(m, pc):
+        m.halted = True
+        return pc
+    return f
+
+def jump(ins):
+    nnn = ins.nnn
+    return lambda m, pc: nnn
+
+def call(ins):
+    nnn = ins.nnn
+    def f(m, pc):
+        m.call(pc, pc + 2)
+        return nnn
+    return f
+
+def jump0(ins):
+    nnn = ins.nnn
+    register = ins.x if ins.quirks.jump0 else 0
+    return lambda m, pc: nnn + m.v[register]
+
+def key_wait(ins):
+    x = ins.x
+    if ins.nn != 0x0A:
+        return None
+    def f(m, pc):
+        if not m.keys:
+            m.waiting = True
+            return pc
+        m.v[x] = min(m.keys)
+        return pc + 2
+    return f
+
+# The ops that end a block, other than skips, by their top digit.
+CONTROL = {0x0: return_or_exit, 0x1: jump, 0x2: call, 0xB: jump0, 0xF: key_wait}
+
+def control(ins, after):
+    """
+    The function ending a block with an Instruction, returning the next pc
+    given the pc of its op, or None if it doesn't end a block. after is the
+    size of the instruction after it.
+    """
+    build = CONTROL.get(ins.op >> 12)
+    finish = build(ins) if build is not None else None
+    return finish if finish is not None else skip(ins, after)
+
+def fall_through(_, pc):
+    """Ends a block that stops before an op that doesn't."""
+    return pc
+
+class Machine():
+    """
+    A CHIP-8 machine running rom, loaded at 0x200. labels (a name to address
+    mapping, such as Program.labels) is what cycles are counted against, and
+    keys is the scripted input: a mapping of frame numbers to the keys held
+    from that frame on, or a function of the frame number giving the keys
+    held.
+    """
+    def __init__(self, rom, labels=None, keys=None, cycles=CYCLES, quirks=Quirks(), seed=0):
+        if len(rom) > MEMORY - 0x200:
+            raise ValueError("ROM of {} bytes doesn't fit in memory".format(len(rom)))
+        self.memory = bytearray(MEMORY)
+        self.memory[0:len(FONT)] = FONT
+        self.memory[BIGFONT_ADDRESS:BIGFONT_ADDRESS + len(BIGFONT)] = BIGFONT
+        self.memory[0x200:0x200 + len(rom)] = rom
+        self.v = [0] * 16
+        self.flags = [0] * 16
+        self.i = 0
+        self.pc = 0x200
+        self.stack = []
+        self.delay = 0
+        self.sound = 0
+        self.pattern = bytes(16)
+        self.pitch = 64
+        self.hires = False
+        self.plane = 1
+        self.keys = frozenset()
+        self.script = script(keys)
+        self.random = random.Random(seed)
+        self.quirks = quirks
+        self.cycles_per_frame = cycles
+        self.halted = False
+        self.waiting = False
+        self.frame = 0
+        self.cycles = 0
+        self.carry = 0
+
+        if numpy is not None:
+            self.display = numpy.zeros((PLANES, HEIGHT, WIDTH), numpy.uint8)
+        else:
+            self.display = [bytearray(WIDTH * HEIGHT) for _ in range(PLANES)]
+
+        self.blocks = {}
+        self.decoded = bytearray(MEMORY)
+
+        labels = sorted((address, name) for (name, address) in (labels or {}).items())
+        self.label_addresses = [address for (address, _) in labels]
+        self.label_names = [None] + [name for (_, name) in labels]
+        self.counts = [0] * len(self.label_names)
+
+    @property
+    def width(self):
+        return WIDTH if self.hires else WIDTH // 2
+
+    @property
+    def height(self):
+        return HEIGHT if self.hires else HEIGHT // 2
+
+    def read(self, address, length):
+        return self.memory[address:address + length]
+
+    def store(self, address, data):
+        end = address + len(data)
+        if end > MEMORY:
+            raise MachineError("write past the end of memory at 0x{:04X}".format(address), self.pc)
+        if any(self.decoded[address:end]):
+            self.blocks.clear()
+            self.decoded = bytearray(MEMORY)
+        self.memory[address:end] = data
+
+    def call(self, pc, ret):
+        if len(self.stack) >= STACK:
+            raise MachineError("stack overflow", pc)
+        self.stack.append(ret)
+
+    def ret(self, pc):
+        if not self.stack:
+            raise MachineError("return with an empty stack", pc)
+        return self.stack.pop()
+
+    def planes(self):
+        return [plane for plane in range(PLANES) if self.plane >> plane & 1]
+
+    def clear(self):
+        for plane in self.planes():
+            if numpy is not None:
+                self.display[plane] = 0
+            else:
+                self.display[plane][:] = bytes(WIDTH * HEIGHT)
+
+    def resolution(self, hires):
+        self.hires = hires
+        for plane in range(PLANES):
+            if numpy is not None:
+                self.display[plane] = 0
+            else:
+                self.display[plane][:] = bytes(WIDTH * HEIGHT)
+
+    def scroll(self, dx, dy):
+        """Scroll the selected planes right by dx and down by dy (in hires pixels)."""
+        if not self.hires:
+            dx, dy = int(dx / 2), int(dy / 2)
+        width, height = self.width, self.height
+        for plane in self.planes():
+            if numpy is not None:
+                screen = self.display[plane, :height, :width]
+                moved = numpy.zeros_like(screen)
+                moved[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+                    screen[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)]
+                screen[:] = moved
+            else:
+                screen = self.display[plane]
+                rows = [screen[row * WIDTH:row * WIDTH + width] for row in range(height)]
+                for row in range(height):
+                    source = row - dy
+                    line = rows[source] if 0 <= source < height else bytearray(width)
+                    if dx > 0:
+                        line = bytes(dx) + line[:width - dx]
+                    elif dx < 0:
+                        line = line[-dx:] + bytes(-dx)
+                    screen[row * WIDTH:row * WIDTH + width] = line
+
+    def sprite(self, address, rows):
+        """The sprite at address, as a list of rows of bits, and its width."""
+        if rows == 0:
+            data = self.read(address, 32)
+            return [data[n] << 8 | data[n+1] for n in range(0, 32, 2)], 16
+        return list(self.read(address, rows)), 8
+
+    def draw(self, x, y, rows):
+        width, height = self.width, self.height
+        x, y = x % width, y % height
+        address = self.i
+        collision = 0
+        for plane in self.planes():
+            if numpy is not None:
+                collision |= self.draw_numpy(plane, address, x, y, rows)
+            else:
+                collision |= self.draw_pixels(plane, address, x, y, rows)
+            address += 32 if rows == 0 else rows
+        self.v[0xF] = collision
+
+    def draw_numpy(self, plane, address, x, y, rows):
+        if rows == 0:
+            data = numpy.frombuffer(self.read(address, 32), numpy.uint8).reshape(16, 2)
+        else:
+            data = numpy.frombuffer(self.read(address, rows), numpy.uint8).reshape(-1, 1)
+        bits = numpy.unpackbits(data, axis=1)
+        height, width = bits.shape
+        if self.quirks.clip:
+            height, width = min(height, self.height - y), min(width, self.width - x)
+            screen = self.display[plane, y:y + height, x:x + width]
+            bits = bits[:height, :width]
+            collision = bool((screen & bits).any())
+            screen ^= bits
+        else:
+            rows = (numpy.arange(height) + y) % self.height
+            columns = (numpy.arange(width) + x) % self.width
+            index = numpy.ix_(rows, columns)
+            screen = self.display[plane]
+            collision = bool((screen[index] & bits).any())
+            screen[index] ^= bits
+        return collision
+
+    def draw_pixels(self, plane, address, x, y, rows):
+        data, size = self.sprite(address, rows)
+        screen = self.display[plane]
+        collision = False
+        for row, line in enumerate(data):
+            py = y + row
+            if py >= self.height:
+                if self.quirks.clip:
+                    break
+                py %= self.height
+            for column in range(size):
+                if not line >> (size - 1 - column) & 1:
+                    continue
+                px = x + column
+                if px >= self.width:
+                    if self.quirks.clip:
+                        break
+                    px %= self.width
+                pixel = py * WIDTH + px
+                collision |= screen[pixel] == 1
+                screen[pixel] ^= 1
+        return collision
+
+    def screen(self):
+        """The visible display, as rows of pixel values (a bit per plane)."""
+        width, height = self.width, self.height
+        if numpy is not None:
+            pixels = self.display[0, :height, :width] | self.display[1, :height, :width] << 1
+            return pixels.tolist()
+        return [[self.display[0][row * WIDTH + column] | self.display[1][row * WIDTH + column] << 1
+                 for column in range(width)] for row in range(height)]
+
+    def op(self, pc):
+        memory = self.memory
+        return memory[pc] << 8 | memory[pc+1] if pc + 1 < MEMORY else 0
+
+    def size(self, pc):
+        """The size of the instruction at pc."""
+        return 4 if self.op(pc) == 0xF000 else 2
+
+    def decode(self, start):
+        """Decode the block at start."""
+        quirks = self.quirks
+        ops = []
+        pc = start
+        addresses = []
+        end = None
+        while end is None:
+            if pc + 1 >= MEMORY:
+                raise MachineError("ran off the end of memory", pc)
+            op = self.op(pc)
+            addresses.append(pc)
+            if op == 0xF000:
+                def f(m, address=self.op(pc + 2)):
+                    m.i = address
+                ops.append(f)
+                pc += 4
+            else:
+                ins = instruction(op, quirks)
+                finish = control(ins, self.size(pc + 2))
+                if finish is not None:
+                    last, end = pc, pc + 2
+                    break
+                f = straight(ins)
+                if f is None:
+                    raise MachineError("unknown instruction {:04X}".format(op), pc)
+                ops.append(f)
+                pc += 2
+            if writes(op) or len(ops) >= MAX_BLOCK:
+                last, end = pc, pc
+                finish = fall_through
+
+        counts = {}
+        for address in addresses:
+            label = bisect_right(self.label_addresses, address)
+            counts[label] = counts.get(label, 0) + 1
+
+        ops = tuple(ops)
+        def run_block(m):
+            for f in ops:
+                f(m)
+            return finish(m, last)
+
+        block = Block(start, end, run_block, len(addresses), tuple(counts.items()))
+        self.blocks[start] = block
+        self.decoded[start:end] = b"\x01" * (end - start)
+        return block
+
+    def run_frame(self):
+        """Run a frame's worth of cycles, then count the timers down."""
+        if self.halted:
+            return
+        self.keys = frozenset(self.script(self.frame))
+        self.waiting = False
+        budget = self.cycles_per_frame
+        executed = self.carry
+        blocks, counts = self.blocks, self.counts
+        while executed < budget and not self.halted and not self.waiting:
+            block = blocks.get(self.pc) or self.decode(self.pc)
+            self.pc = block.run(self)
+            executed += block.cycles
+            for label, cycles in block.counts:
+                counts[label] += cycles
+        self.cycles += executed - self.carry
+        self.carry = max(executed - budget, 0)
+        self.delay = max(self.delay - 1, 0)
+        self.sound = max(self.sound - 1, 0)
+        self.frame += 1
+
+    def run(self, frames):
+        """Run up to frames frames, stopping if the program exits. Returns the frames run."""
+        for frame in range(frames):
+            if self.halted:
+                return frame
+            self.run_frame()
+        return frames
+
+    def profile(self):
+        """(label, cycles) for each label code ran at, busiest first."""
+        counts = [(name, cycles) for (name, cycles) in zip(self.label_names, self.counts) if cycles]
+        return sorted(counts, key=lambda count: -count[1])
+
+    def table(self):
+        total = sum(self.counts) or 1
+        lines = ["{:<24}{:>12}".format("frames", self.frame),
+                 "{:<24}{:>12}".format("cycles", self.cycles),
+                 ""]
+        for name, cycles in self.profile():
+            lines.append("{:<24}{:>12}{:>7.1f}%".format(
+                name if name is not None else "(before any label)", cycles, 100 * cycles / total))
+        return "\n".join(lines)
+
+def run(program, frames, keys=None, cycles=CYCLES, quirks=Quirks(), seed=0):
+    """Run an assembled program for frames frames. Returns the Machine."""
+    machine = Machine(program.program, program.labels, keys, cycles, quirks, seed)
+    machine.run(frames)
+    return machine
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        prog="octopy run", description="Run a program headlessly and profile it by label.")
+    parser.add_argument("-f", "--frames", type=int, default=600, help="frames to run (default 600)")
+    parser.add_argument("-c", "--cycles", type=int, default=CYCLES,
+                        help="cycles per frame (default {})".format(CYCLES))
+    parser.add_argument("source")
+    options = parser.parse_args(args)
+
+    program = assemble_file(options.source)
+    if program.error is not None:
+        print("Assembly failed:")
+        print(program.error)
+        return 1
+    try:
+        machine = run(program, options.frames, cycles=options.cycles)
+    except MachineError as e:
+        print("Run failed: {}".format(e))
+        return 1
+    print(machine.table())
+    return 0
@@ -0,0 +1,315 @@
+"""
+A long running assembler, serving requests over a Unix domain socket.
+
+Keeping the assembler warm avoids paying for interpreter start-up and imports
+on every build. Each connection sends newline separated JSON requests and gets
+one JSON response line per request:
+
+    {"op": "assemble", "path": "game.8o"}
+    {"op": "assemble", "source": ": main ..."}
+        -> {"rom": <base64>, "symbols": {...}, "error": null, "cached": false}
+    {"op": "stats"}
+        -> {"requests": 12, "hits": 9, "latency_ms": {"p50": ..., "p90": ..., ...}}
+    {"op": "shutdown"}
+
+Results are kept by a hash of the source text, and of the files it includes,
+so unchanged inputs are answered from memory, and sources requested by path are
+rebuilt incrementally, with their includes found next to them. Sources sent as
+text can't include files. With --watch, a directory is polled and sources are
+rebuilt (writing .ch8 and .sym files next to them) as soon as they, or any
+file they include, are saved; files that are only ever included aren't built
+on their own.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from octopy.assemble import assemble
+from octopy.include import NoIncludes, file_digest
+from octopy.incremental import IncrementalAssembler
+from octopy.symbols import symbol_table, write_symbols
+from octopy.symindex import write_symbol_index
+
+DEFAULT_SOCKET = "octopy.sock"
+
+class Assembler():
+    """
+    Assembles sources, remembering results by content hash. Safe to share
+    between the threads serving connections: only the results (and counts)
+    are locked, so different sources are assembled at the same time.
+    """
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+        self.__results = OrderedDict()
+        # Paths to their IncrementalAssembler, and the lock for using it.
+        self.__incremental = {}
+        self.__lock = threading.Lock()
+        self.latencies = deque(maxlen=10000)
+        self.requests = 0
+        self.hits = 0
+
+    def assemble_path(self, path):
+        """
+        Assemble a file, returning the result, the Program it came from, and
+        the digests of the files it included, by real path. The Program and
+        digests are kept with the result, so that they're there for a cached
+        one.
+        """
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        return self.__assemble(source, os.path.abspath(path))
+
+    def assemble_source(self, source):
+        """Assemble source text, which can't include files, as assemble_path()."""
+        return self.__assemble(source, None)
+
+    def __assemble(self, source, path):
+        # A source without a path can't include files, so it's kept apart
+        # from the same text in a file.
+        key = (hashlib.sha256(source.encode()).hexdigest(), path and os.path.dirname(path))
+        with self.__lock:
+            self.requests += 1
+            cached = self.__results.get(key)
+        # Each file it included has to be unchanged too.
+        if cached is not None and all(file_digest(name) == digest
+                                      for name, digest in cached[2].items()):
+            with self.__lock:
+                self.hits += 1
+                if key in self.__results:
+                    self.__results.move_to_end(key)
+            result, program, files = cached
+            return dict(result, cached=True), program, files
+
+        if path is None:
+            includes = NoIncludes(jobs=1)
+            program = assemble(io.StringIO(source), includes=includes)
+        else:
+            with self.__lock:
+                incremental, lock = self.__incremental.setdefault(
+                    path, (IncrementalAssembler(path), threading.Lock()))
+            # An IncrementalAssembler builds on its last build, so only one
+            # thread at a time can use each.
+            with lock:
+                program = incremental.assemble(source)
+                includes = incremental.includes
+        files = dict(includes.digests)
+
+        result = {
+            "rom": base64.b64encode(program.program).decode(),
+            "symbols": symbol_table(program) if program.error is None else None,
+            "error": None if program.error is None else str(program.error),
+        }
+        with self.__lock:
+            self.__results[key] = result, program, files
+            self.__results.move_to_end(key)
+            if len(self.__results) > self.cache_size:
+                self.__results.popitem(last=False)
+        return dict(result, cached=False), program, files
+
+    def record_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return None
+            rank = min(len(latencies) - 1, int(p / 100 * len(latencies)))
+            return round(latencies[rank] * 1000, 3)
+
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "latency_ms": {
+                "p50": percentile(50),
+                "p90": percentile(90),
+                "p99": percentile(99),
+                "max": percentile(100),
+            },
+        }
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            start = time.perf_counter()
+            response = self.respond(line)
+            self.server.assembler.record_latency(time.perf_counter() - start)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+            if response.get("shutdown"):
+                # shutdown() waits for serve_forever(), so it can't run on this thread.
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+    def respond(self, line):
+        assembler = self.server.assembler
+        try:
+            message = json.loads(line)
+            op = message.get("op", "assemble")
+            if op == "assemble":
+                for field in ("path", "source"):
+                    if not isinstance(message.get(field, ""), str):
+                        raise ValueError("{} must be a string".format(field))
+                if "path" in message:
+                    response, _, _ = assembler.assemble_path(message["path"])
+                elif "source" in message:
+                    response, _, _ = assembler.assemble_source(message["source"])
+                else:
+                    return {"error": "assemble needs a path or source"}
+                return response
+            if op == "stats":
+                return assembler.stats()
+            if op == "shutdown":
+                return {"shutdown": True}
+            return {"error": "unknown op: {}".format(op)}
+        except OSError as error:
+            return {"error": str(error)}
+        except (ValueError, AttributeError) as error:
+            return {"error": "bad request: {}".format(error)}
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, assembler):
+        self.assembler = assembler
+        super().__init__(path, Handler)
+
+def write_outputs(program, source):
+    basename = os.path.splitext(source)[0]
+    with open(basename + ".ch8", "wb") as fout:
+        fout.write(program.program)
+    with open(basename + ".sym", "w", encoding="utf-8") as fout:
+        write_symbols(program, fout)
+    with open(basename + ".symx", "wb") as fout:
+        write_symbol_index(program, fout)
+
+def sources(directory):
+    """The .8o files under the directory."""
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.endswith(".8o"):
+                yield os.path.join(dirpath, filename)
+
+def signature(path):
+    """What changes when the file at path is saved, or None if it isn't there."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def watch(directory, assembler, interval, stop, log=sys.stderr):
+    """
+    Poll the directory for changed .8o files until stop is set, rebuilding
+    each one as it changes, or as any file it included changes. Files that
+    a source includes aren't built on their own.
+    """
+    # The signatures of the sources and the files they include, and the
+    # files each source included, all by real path.
+    seen = {}
+    depends = {}
+    while not stop.is_set():
+        found = {os.path.realpath(path): path for path in sources(directory)}
+        for key in list(depends):
+            if key not in found:
+                del depends[key]
+        changed = set()
+        for key in set(found).union(*depends.values()):
+            current = signature(key)
+            if key not in seen or seen[key] != current:
+                seen[key] = current
+                changed.add(key)
+
+        included = set().union(*depends.values())
+        built = {}
+        for key, path in found.items():
+            if key in included:
+                continue
+            if key in changed or not changed.isdisjoint(depends.get(key, ())):
+                built[key] = build(path, assembler, log)
+                if built[key] is not None:
+                    depends[key] = set(built[key][2])
+
+        # A file first seen with the sources including it may have been
+        # built before it was known to be included.
+        included = set().union(*depends.values())
+        for key, done in built.items():
+            if done is not None and key not in included:
+                write(found[key], done[0], done[1], log)
+        stop.wait(interval)
+
+def build(path, assembler, log):
+    """
+    Assemble the source at path, as assemble_path(), or None if it can't be
+    read.
+    """
+    try:
+        return assembler.assemble_path(path)
+    except (OSError, UnicodeDecodeError) as error:
+        log.write("{}: {}\n".format(path, error))
+        return None
+
+def write(path, result, program, log):
+    if result["error"] is not None:
+        log.write("{}: assembly failed\n{}\n".format(path, result["error"]))
+    else:
+        # Written even when the result was cached: the source may have gone
+        # back to an earlier version, and the outputs with it.
+        write_outputs(program, path)
+        log.write("{}: rebuilt\n".format(path))
+
+def rebuild(path, assembler, log):
+    """Assemble the source at path, and write its outputs."""
+    done = build(path, assembler, log)
+    if done is not None:
+        write(path, done[0], done[1], log)
+
+def request(message, path=DEFAULT_SOCKET):
+    """
+    Send one request to a running server and return its response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as response:
+            return json.loads(response.readline())
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog="octopy serve", description="Run a warm assembler.")
+    argparser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix socket")
+    argparser.add_argument("--watch", metavar="DIR", help="rebuild sources in DIR when they change")
+    argparser.add_argument("--interval", type=float, default=0.5,
+                           help="seconds between checks for changes (default: 0.5)")
+    args = argparser.parse_args(argv)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    assembler = Assembler()
+    stop = threading.Event()
+    if args.watch is not None:
+        watcher = threading.Thread(target=watch, args=(args.watch, assembler, args.interval, stop))
+        watcher.daemon = True
+        watcher.start()
+
+    with Server(args.socket, assembler) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            os.unlink(args.socket)
+            print(json.dumps(assembler.stats()), file=sys.stderr)
+    return 0
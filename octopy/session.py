@@ -0,0 +1,74 @@
+"""
+Assembly of many sources from one process.
+
+An AssemblerSession holds the tables every assembly starts from (the
+predefined consts, OCTO_KEY_* and friends, and both casings of the
+registers, plus any extra names the session was given). They're built once,
+and each assembly gets its own shallow copy, so nothing a source defines is
+seen by the next one. Results come back as plain data:
+
+    session = AssemblerSession()
+    result = session.assemble(": main jump main")
+    result.rom, result.symbols, result.error
+
+Sources given as str or bytes read no files: an :include in one is an
+error, from the one NoIncludes the session keeps for them. Beyond those, a
+session is a thin layer over assemble(): it adds only the copy of the ROM
+and the symbol table to each call. Paths must be given as os.PathLike objects (like pathlib.Path),
+since a str is the source text itself.
+"""
+import io
+import os
+from typing import NamedTuple
+
+from octopy.assemble import assemble, assemble_file
+from octopy.errors import ParseError
+from octopy.include import NoIncludes
+from octopy.program import Program
+from octopy.symbols import symbol_table
+from octopy.tokenizer import CONSTS, REGISTERS
+
+class Assembly(NamedTuple):
+    """
+    The ROM image and symbol table of one assembly, or the error that stopped
+    it (with no symbols). The Program is kept for anything else.
+    """
+    rom: bytes
+    symbols: dict
+    error: ParseError
+    program: Program
+
+class AssemblerSession():
+    """
+    Assembles any number of sources, each starting from the same predefined
+    names. consts and registers add to (or replace) the standard ones.
+    """
+    def __init__(self, consts=None, registers=None):
+        self.consts = dict(CONSTS)
+        self.consts.update(consts or {})
+        self.registers = dict(REGISTERS)
+        self.registers.update(registers or {})
+        # Reads nothing, so holds nothing, and serves every assembly.
+        self.includes = NoIncludes(jobs=1)
+        self.assemblies = 0
+
+    def assemble(self, source, hooks=None):
+        """
+        Assemble source text (str), UTF-8 source bytes (bytes, bytearray,
+        memoryview or mmap), or the file at an os.PathLike path.
+        """
+        if isinstance(source, os.PathLike):
+            program = assemble_file(source, hooks=hooks,
+                                    consts=self.consts, registers=self.registers)
+        else:
+            if isinstance(source, str):
+                source = io.StringIO(source)
+            elif isinstance(source, memoryview):
+                source = source.tobytes()
+            program = assemble(source, hooks, self.consts, self.registers,
+                               includes=self.includes)
+        self.assemblies += 1
+
+        if program.error is not None:
+            return Assembly(bytes(program.program), None, program.error, program)
+        return Assembly(bytes(program.program), symbol_table(program), None, program)
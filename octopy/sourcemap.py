@@ -0,0 +1,219 @@
+"""
+Source maps: where in the source each byte of the ROM came from.
+
+With a SourceMap given to a Program (assemble(source_map=name) does this),
+the parser notes the file, line and macro call sites of each statement as
+it's parsed, and the address its code starts at. The code up to the next
+statement's is put down to it. Code from a macro expansion is put down to
+the line in the macro's body it came from, along with the chain of calls
+that got there: the call of the macro, the call of the macro that call was
+in, and so on.
+
+write_source_map() writes it as a .map file, in the same way as the binary
+symbol index (see octopy/symindex.py), so that it's read where it is with
+mmap, and looking up an address is a bisect:
+
+    header          HEADER: the magic, the version, and the counts of runs,
+                    call sites, files and strings, and the size of the
+                    string data
+    runs            u32 start addresses, ascending
+                    u32 end addresses
+                    u32 files, lines and call sites (NONE if not in a macro)
+    call sites      u32 parent call sites (NONE for a call outside any
+                    macro), macro names, files and lines
+    strings         u32 offsets, one more than there are strings
+                    the strings, UTF-8: the file names, then the macro names
+
+SourceMapFile reads one.
+"""
+import struct
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+from octopy.symindex import Mapped, write_sections
+
+MAGIC = b"OCTOSMAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIII")
+
+# The call site of code that isn't in a macro.
+NONE = 0xFFFFFFFF
+
+class Call(NamedTuple):
+    macro: str
+    file: str
+    line: int
+
+class Location(NamedTuple):
+    file: str
+    line: int
+    # Where the macro the line is in was called from, innermost first.
+    calls: tuple
+
+class SourceMap():
+    """
+    Where each statement of a program came from, as it's parsed. Call sites
+    are kept once each, as (parent, macro, file, line), and numbered in the
+    order they're first seen. Files are numbered in the same way, from the
+    name of the source, then the files it includes.
+    """
+    def __init__(self, name):
+        self.files = [name]
+        self.file_numbers = {None: 0}
+        self.addresses = array("I")
+        self.lines = array("I")
+        self.file_ids = array("I")
+        self.sites = array("I")
+        self.calls = []
+        self.call_ids = {}
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def file(self, name):
+        """The number of the included file name (None for the source)."""
+        number = self.file_numbers.get(name)
+        if number is None:
+            number = self.file_numbers[name] = len(self.files)
+            self.files.append(name)
+        return number
+
+    def call(self, parent, macro, token, file=0):
+        """The call site of macro, called by token inside parent."""
+        key = (NONE if parent is None else parent, macro, file, token.line)
+        site = self.call_ids.get(key)
+        if site is None:
+            site = self.call_ids[key] = len(self.calls)
+            self.calls.append(key)
+        return site
+
+    def add(self, address, token, site, file=0):
+        """Note a statement at address, from token, in the macro call site."""
+        site = NONE if site is None else site
+        addresses = self.addresses
+        if addresses and addresses[-1] == address:
+            # The last statement emitted nothing.
+            self.lines[-1], self.file_ids[-1], self.sites[-1] = token.line, file, site
+        elif not (addresses and self.lines[-1] == token.line and self.sites[-1] == site
+                  and self.file_ids[-1] == file):
+            addresses.append(address)
+            self.lines.append(token.line)
+            self.file_ids.append(file)
+            self.sites.append(site)
+
+    def move(self, move):
+        """Move every address with move(), after code is taken out."""
+        self.addresses = array("I", (move(address) for address in self.addresses))
+
+    def runs(self, segments):
+        """
+        (start, end, file, line, call site) for each run of code in the
+        segments, (address, bytes) as Program.segments() gives them, in
+        address order.
+        """
+        # Code written again (after going back with :org) is put down to the
+        # last statement to write it.
+        latest = {}
+        for n, address in enumerate(self.addresses):
+            latest[address] = n
+        starts = sorted(latest)
+        bounds = sorted((address, address + len(data)) for (address, data) in segments)
+        segment_starts = [start for (start, _) in bounds]
+        runs = []
+        for start, following in zip(starts, starts[1:] + [None]):
+            index = bisect_right(segment_starts, start) - 1
+            if index < 0 or start >= bounds[index][1]:
+                continue
+            end = bounds[index][1] if following is None else min(following, bounds[index][1])
+            n = latest[start]
+            runs.append((start, end, self.file_ids[n], self.lines[n], self.sites[n]))
+        return runs
+
+def write_source_map(program, fout):
+    """Write the source map of program (program.source_map) to the binary file fout."""
+    source_map = program.source_map
+    runs = source_map.runs(program.segments())
+    macros = list(dict.fromkeys(macro for (_, macro, _, _) in source_map.calls))
+    names = {macro: n + len(source_map.files) for (n, macro) in enumerate(macros)}
+    strings = bytearray()
+    offsets = [0]
+    for text in source_map.files + macros:
+        strings.extend(text.encode("utf-8"))
+        offsets.append(len(strings))
+    columns = list(zip(*runs)) or [(), (), (), (), ()]
+    calls = list(zip(*source_map.calls)) or [(), (), (), ()]
+    sections = [array("I", column) for column in columns]
+    sections.append(array("I", calls[0]))
+    sections.append(array("I", [names[macro] for macro in calls[1]]))
+    sections.append(array("I", calls[2]))
+    sections.append(array("I", calls[3]))
+    sections.append(array("I", offsets))
+    header = HEADER.pack(MAGIC, VERSION, 0, len(runs), len(source_map.calls),
+                         len(source_map.files), len(offsets) - 1, len(strings))
+    write_sections(fout, header, sections, strings)
+
+class SourceMapFile(Mapped):
+    """
+    A source map written by write_source_map(), mapped from path. Use it as a
+    context manager, or call close() when done.
+    """
+    header = HEADER
+    magic = MAGIC
+    version = VERSION
+    kind = "source map"
+
+    def load(self, counts):
+        runs, calls, files, strings, size = counts
+        # The file names are the first of the strings, then the macro names.
+        if files > strings:
+            raise ValueError("{} names more files than it has strings".format(self.kind))
+        section = self.section
+        self.starts = section("I", runs)
+        self.ends = section("I", runs)
+        self.files = section("I", runs)
+        self.lines = section("I", runs)
+        self.sites = section("I", runs)
+        self.parents = section("I", calls)
+        self.macros = section("I", calls)
+        self.call_files = section("I", calls)
+        self.call_lines = section("I", calls)
+        self.offsets = section("I", strings + 1)
+        self.data = self.string_data(size)
+        self.texts = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, n):
+        text = self.texts.get(n)
+        if text is None:
+            text = self.texts[n] = str(self.data[self.offsets[n]:self.offsets[n+1]], "utf-8")
+        return text
+
+    def run(self, address):
+        """The number of the run address is in, or None."""
+        n = bisect_right(self.starts, address) - 1
+        if n < 0 or address >= self.ends[n]:
+            return None
+        return n
+
+    def line(self, address):
+        """The (file, line) the code at address came from, or None."""
+        n = self.run(address)
+        if n is None:
+            return None
+        return self.text(self.files[n]), self.lines[n]
+
+    def lookup(self, address):
+        """The Location of the code at address, or None."""
+        n = self.run(address)
+        if n is None:
+            return None
+        calls = []
+        site = self.sites[n]
+        while site != NONE:
+            calls.append(Call(self.text(self.macros[site]), self.text(self.call_files[site]),
+                              self.call_lines[site]))
+            site = self.parents[site]
+        return Location(self.text(self.files[n]), self.lines[n], tuple(calls))
@@ -0,0 +1,178 @@
+"""
+Statistics about an assembly, collected only when asked for.
+
+Pass hooks to assemble() (or --stats on the command line) to have the
+assembler report what it is doing. The hook API is the Hooks class:
+subclass it and override the events you care about. Events are reported
+in the order they happened once assembly finishes, followed by the time
+spent in each phase. A source with :org { } expressions using names
+defined after them is assembled more than once, and only the last pass is
+reported:
+
+    phase(name, seconds)    time spent in one of PHASES
+    statement(handler)      a statement was parsed by the named handler
+                            (the statement keyword, or one of data,
+                            register, label, return, call, byte, or
+                            expansion for a macro being used)
+    expansion(macro, tokens)
+                            a macro was expanded, producing that many tokens
+                            (0 when the code of an earlier expansion with
+                            the same arguments was replayed instead)
+    fixup(kind)             an address was left to fill in later; kind is
+                            one of FIXUPS
+    emitted(size)           assembly finished with a ROM of size bytes
+
+Stats is a Hooks that totals everything up, for as_dict() (JSON ready) or
+table().
+
+The parser and program call their hooks, if they have any, where each
+event happens. For each pass, assemble() gives both the same Instruments,
+which keeps the events and times the phases between its switch() calls.
+The Instruments of the last pass passes them on.
+"""
+import time
+from collections import Counter
+
+# Time is split between these, with each second counted in exactly one.
+# Macro expansion includes parsing the statements in macro bodies.
+PHASES = ("tokenize", "parse", "calc", "macro", "resolve")
+
+FIXUPS = ("jumpsandcalls", "unpacks", "begins", "whiles")
+
+class Hooks():
+    """
+    Receives events from an assembly. Every method does nothing here.
+    """
+    def phase(self, name, seconds):
+        pass
+
+    def statement(self, handler):
+        pass
+
+    def expansion(self, macro, tokens):
+        pass
+
+    def fixup(self, kind):
+        pass
+
+    def emitted(self, size):
+        pass
+
+class Stats(Hooks):
+    """
+    Totals of everything reported by an assembly.
+    """
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.statements = Counter()
+        self.expansions = Counter()
+        self.macro_tokens = Counter()
+        self.fixups = Counter(dict.fromkeys(FIXUPS, 0))
+        self.bytes = 0
+
+    def phase(self, name, seconds):
+        self.phases[name] += seconds
+
+    def statement(self, handler):
+        self.statements[handler] += 1
+
+    def expansion(self, macro, tokens):
+        self.expansions[macro] += 1
+        self.macro_tokens[macro] += tokens
+
+    def fixup(self, kind):
+        self.fixups[kind] += 1
+
+    def emitted(self, size):
+        self.bytes += size
+
+    def as_dict(self):
+        return {
+            "seconds": dict(self.phases),
+            "statements": dict(self.statements.most_common()),
+            "macros": {name: {"expansions": count, "tokens": self.macro_tokens[name]}
+                       for name, count in self.expansions.most_common()},
+            "fixups": dict(self.fixups),
+            "bytes": self.bytes,
+        }
+
+    def table(self):
+        lines = []
+        total = sum(self.phases.values())
+        lines.append("{:<24}{:>12}{:>8}".format("phase", "ms", "%"))
+        for name, seconds in self.phases.items():
+            share = 100 * seconds / total if total else 0
+            lines.append("{:<24}{:>12.3f}{:>8.1f}".format(name, seconds * 1000, share))
+        lines.append("{:<24}{:>12.3f}".format("total", total * 1000))
+
+        lines.append("")
+        lines.append("{:<24}{:>12}".format("statement", "count"))
+        for name, count in self.statements.most_common():
+            lines.append("{:<24}{:>12}".format(name, count))
+
+        if self.expansions:
+            lines.append("")
+            lines.append("{:<24}{:>12}{:>8}".format("macro", "expansions", "tokens"))
+            for name, count in self.expansions.most_common():
+                lines.append("{:<24}{:>12}{:>8}".format(name, count, self.macro_tokens[name]))
+
+        lines.append("")
+        lines.append("{:<24}{:>12}".format("fixup", "count"))
+        for name, count in self.fixups.items():
+            lines.append("{:<24}{:>12}".format(name, count))
+
+        lines.append("")
+        lines.append("{:<24}{:>12}".format("bytes emitted", self.bytes))
+        return "\n".join(lines)
+
+class Instruments(Hooks):
+    """
+    Keeps the events of one pass of an assembly for hooks, and keeps the
+    clock: the time since the last switch() goes to the current phase.
+    """
+    def __init__(self, hooks):
+        self.hooks = hooks
+        # (hook, arguments) for each event.
+        self.events = []
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.current = "parse"
+        self.since = time.perf_counter()
+
+    def switch(self, phase):
+        now = time.perf_counter()
+        self.seconds[self.current] += now - self.since
+        self.since = now
+        previous, self.current = self.current, phase
+        return previous
+
+    def statement(self, handler):
+        self.events.append((self.hooks.statement, (handler,)))
+
+    def expansion(self, macro, tokens):
+        self.events.append((self.hooks.expansion, (macro, tokens)))
+
+    def fixup(self, kind):
+        self.events.append((self.hooks.fixup, (kind,)))
+
+    def tokens(self, tokengen):
+        """Time taken making each token from the source."""
+        switch = self.switch
+        while True:
+            previous = switch("tokenize")
+            token = next(tokengen, None)
+            switch(previous)
+            if token is None:
+                return
+            yield token
+
+    def tokenizer(self, tokenizer):
+        tokenizer.tokengen = self.tokens(tokenizer.tokengen)
+
+    def finish(self, program):
+        """Report the events, the phase times, and the size of the program."""
+        self.switch(self.current)
+        for hook, arguments in self.events:
+            hook(*arguments)
+        for name, seconds in self.seconds.items():
+            self.hooks.phase(name, seconds)
+        self.hooks.emitted(program.size())
@@ -0,0 +1,40 @@
+def write_symbols(program, fout):
+    """
+    Write the text symbol file: labels, constants, breakpoints and monitors.
+    """
+    for name, pc in program.labels.items():
+        fout.write("{} = 0x{:04X}\n".format(name, pc))
+    for name, pc in program.consts.items():
+        if name not in program.labels:
+            fout.write("{} = {}\n".format(name, pc))
+
+    breakpoints = program.debugger.breakpoints
+
+    for name, (token, pc) in breakpoints.items():
+        fout.write("{} = 0x{:04X}   # breakpoint: {}\n".format(name, pc, token))
+
+    format_breakpoint = "0x{:04X}".format
+    formatted_breakpoints = (format_breakpoint(pc) for (token, pc) in breakpoints.values())
+    fout.write("breakpoints=[{}]\n".format(", ".join(formatted_breakpoints)))
+
+    format_monitor = "(0x{:04X}, {})".format
+    monitors = program.debugger.monitors
+    formatted_monitors = (format_monitor(addr, monlen) for (addr, monlen) in monitors)
+
+    fout.write("monitors=[{}]\n".format(", ".join(formatted_monitors)))
+
+def symbol_table(program):
+    """
+    The same symbols as write_symbols, as plain data.
+    """
+    # Copying the consts and dropping the labels is quicker than filtering
+    # them, since every assembly starts with the many predefined consts.
+    consts = dict(program.consts)
+    for name in program.labels:
+        consts.pop(name, None)
+    return {
+        "labels": dict(program.labels),
+        "consts": consts,
+        "breakpoints": {name: pc for name, (token, pc) in program.debugger.breakpoints.items()},
+        "monitors": [list(monitor) for monitor in program.debugger.monitors],
+    }
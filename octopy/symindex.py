@@ -0,0 +1,276 @@
+"""
+The binary symbol index (.symx), written next to the text .sym file.
+
+It holds the same symbols, less the predefined consts (OCTO_KEY_*, PI and
+E) unless a program redefines them, laid out so that a reader can mmap the
+file and use it as it is, with nothing to parse. All numbers are little
+endian, and every section starts on an 8 byte boundary:
+
+    header          HEADER: the magic, the version, and the counts of labels,
+                    consts, breakpoints and monitors, and the size of the
+                    string data
+    labels          u32 addresses, ascending (ties by name)
+                    u32 name offsets, one more than there are labels
+                    u32 label numbers, in name order
+    consts          f64 values, in name order
+                    u32 name offsets, one more than there are consts
+    breakpoints     u32 addresses, ascending
+                    u32 name offsets, one more than there are breakpoints
+    monitors        u32 address and length pairs, in the order given
+    strings         the names, UTF-8, one after the other
+
+Name i of a table runs from its offset i to offset i+1 in the strings. So
+finding the label at or before an address is a bisect of the label
+addresses, and finding a label or const by name is a bisect in name order.
+
+SymbolIndex reads one. Names are only decoded when asked for (and then
+kept), and when NumPy is installed, labels_at() finds the labels of a whole
+array of addresses at once.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from octopy.tokenizer import CONSTS
+
+MAGIC = b"OCTOSYMX"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIII")
+
+def align(size):
+    return -size % 8
+
+def write_sections(fout, header, sections, strings):
+    """Write a header, then arrays, each starting on an 8 byte boundary, then strings."""
+    data = bytearray(header)
+    data.extend(bytes(align(len(data))))
+    for section in sections:
+        if sys.byteorder != "little":
+            section.byteswap()
+        data.extend(section.tobytes())
+        data.extend(bytes(align(len(data))))
+    data.extend(strings)
+    fout.write(data)
+
+class Mapped():
+    """
+    A file written by write_sections(), mapped from path, with its arrays
+    read where they are. Subclasses give the header, and read their
+    sections in load(). Use it as a context manager, or call close() when
+    done.
+    """
+    header = None
+    magic = None
+    version = None
+    kind = None
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.views = [memoryview(self.mmap)]
+        try:
+            view = self.views[0]
+            if len(view) < self.header.size:
+                raise ValueError("not a {}: too short".format(self.kind))
+            magic, version, _, *counts = self.header.unpack_from(view)
+            if magic != self.magic:
+                raise ValueError("not a {}".format(self.kind))
+            if version != self.version:
+                raise ValueError("{} version {} isn't {}".format(self.kind, version, self.version))
+            self.position = self.header.size + align(self.header.size)
+            self.load(counts)
+        except Exception:
+            self.close()
+            raise
+
+    def load(self, counts):
+        """Read the sections, given the counts after the version in the header."""
+        raise NotImplementedError
+
+    def section(self, typecode, count):
+        """The next section, an array of count numbers of typecode (I or d)."""
+        view = self.views[0]
+        width = 8 if typecode == "d" else 4
+        start = self.position
+        end = start + count * width
+        if end > len(view):
+            raise ValueError("{} is truncated".format(self.kind))
+        self.position = end + align(end)
+        if sys.byteorder != "little":
+            data = array(typecode, view[start:end])
+            data.byteswap()
+            return data
+        data = view[start:end]
+        self.views.append(data)
+        self.views.append(data.cast(typecode))
+        return self.views[-1]
+
+    def string_data(self, size):
+        """The string data, the last section."""
+        view = self.views[0]
+        if self.position + size > len(view):
+            raise ValueError("{} is truncated".format(self.kind))
+        self.views.append(view[self.position:self.position + size])
+        return self.views[-1]
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def builtin(name, value):
+    return name in CONSTS and CONSTS[name] == value
+
+def write_symbol_index(program, fout):
+    """Write the binary symbol index of program to the binary file fout."""
+    labels = sorted((pc, name) for (name, pc) in program.labels.items())
+    consts = sorted((name, value) for (name, value) in program.consts.items()
+                    if name not in program.labels and not builtin(name, value))
+    breakpoints = sorted((pc, name) for (name, (token, pc)) in program.debugger.breakpoints.items())
+    monitors = program.debugger.monitors
+
+    strings = bytearray()
+    def names(items):
+        offsets = [len(strings)]
+        for name in items:
+            strings.extend(name.encode("utf-8"))
+            offsets.append(len(strings))
+        return offsets
+
+    by_name = sorted(range(len(labels)), key=lambda n: labels[n][1].encode("utf-8"))
+    sections = [
+        array("I", [pc for (pc, _) in labels]),
+        array("I", names(name for (_, name) in labels)),
+        array("I", by_name),
+        array("d", [value for (_, value) in consts]),
+        array("I", names(name for (name, _) in consts)),
+        array("I", [pc for (pc, _) in breakpoints]),
+        array("I", names(name for (_, name) in breakpoints)),
+        array("I", [n for monitor in monitors for n in monitor]),
+    ]
+    header = HEADER.pack(MAGIC, VERSION, 0, len(labels), len(consts), len(breakpoints),
+                         len(monitors), len(strings))
+    write_sections(fout, header, sections, strings)
+
+class SymbolIndex(Mapped):
+    """
+    A binary symbol index, mapped from path. Use it as a context manager, or
+    call close() when done.
+    """
+    header = HEADER
+    magic = MAGIC
+    version = VERSION
+    kind = "symbol index"
+
+    def load(self, counts):
+        labels, consts, breakpoints, monitors, size = counts
+        section = self.section
+        self.addresses = section("I", labels)
+        self.label_offsets = section("I", labels + 1)
+        self.by_name = section("I", labels)
+        self.const_values = section("d", consts)
+        self.const_offsets = section("I", consts + 1)
+        self.breakpoint_addresses = section("I", breakpoints)
+        self.breakpoint_offsets = section("I", breakpoints + 1)
+        self.monitor_pairs = section("I", monitors * 2)
+        self.strings = self.string_data(size)
+        self.names = {}
+        self.table = None
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def string(self, offsets, n):
+        return str(self.strings[offsets[n]:offsets[n+1]], "utf-8")
+
+    def name(self, n):
+        """The name of label n, in address order."""
+        name = self.names.get(n)
+        if name is None:
+            name = self.names[n] = self.string(self.label_offsets, n)
+        return name
+
+    def label_at(self, address):
+        """The (name, offset) of the label at or before address, or None."""
+        n = bisect_right(self.addresses, address) - 1
+        if n < 0:
+            return None
+        return self.name(n), address - self.addresses[n]
+
+    def labels_at(self, addresses):
+        """
+        The numbers of the labels at or before each address (-1 if there's
+        none), for name(). With NumPy, addresses may be any array, and the
+        numbers are an array.
+        """
+        if numpy is not None:
+            # A copy, so the file can be closed with the results still around.
+            if self.table is None:
+                self.table = numpy.array(self.addresses, numpy.uint32)
+            return numpy.searchsorted(self.table, numpy.asarray(addresses), side="right") - 1
+        return [bisect_right(self.addresses, address) - 1 for address in addresses]
+
+    def find(self, offsets, order, name, count):
+        """The position of name among count names in order, or None."""
+        key = name.encode("utf-8")
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            n = order(middle)
+            if self.strings[offsets[n]:offsets[n+1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count and self.strings[offsets[order(low)]:offsets[order(low)+1]] == key:
+            return order(low)
+        return None
+
+    def address(self, name):
+        """The address of the label name. Raises KeyError if there isn't one."""
+        n = self.find(self.label_offsets, self.by_name.__getitem__, name, len(self.by_name))
+        if n is None:
+            raise KeyError(name)
+        return self.addresses[n]
+
+    def const(self, name):
+        """The value of the const name. Raises KeyError if there isn't one."""
+        n = self.find(self.const_offsets, int, name, len(self.const_values))
+        if n is None:
+            raise KeyError(name)
+        value = self.const_values[n]
+        return int(value) if value.is_integer() else value
+
+    @property
+    def labels(self):
+        return {self.name(n): self.addresses[n] for n in range(len(self.addresses))}
+
+    @property
+    def consts(self):
+        values = (int(value) if value.is_integer() else value for value in self.const_values)
+        return {self.string(self.const_offsets, n): value for (n, value) in enumerate(values)}
+
+    @property
+    def breakpoints(self):
+        return {self.string(self.breakpoint_offsets, n): address
+                for (n, address) in enumerate(self.breakpoint_addresses)}
+
+    @property
+    def monitors(self):
+        pairs = self.monitor_pairs
+        return [(pairs[n], pairs[n+1]) for n in range(0, len(pairs), 2)]
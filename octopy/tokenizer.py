@@ -1,46 +1,316 @@
+from array import array
+from enum import Enum
+from functools import lru_cache
 from typing import NamedTuple
 
 import math
+import mmap
 import re
 import copy
 from octopy.errors import ParseError
 
+class Kind(Enum):
+    NUMBER = "number"
+    REGISTER = "register"
+    KEYWORD = "keyword"
+    OPERATOR = "operator"
+    IDENT = "identifier"
+
 class Token(NamedTuple):
+    """
+    A token, tagged with its kind when it was scanned. Numbers carry their
+    parsed value, and registers their index. Tokens built by hand without a
+    kind are classified when they're looked at. Tokens from a file read by
+    :include carry its name; those from the source being assembled don't.
+    """
     text: str
     line: int
     field: int
+    kind: Kind = None
+    value: object = None
+    file: str = None
 
     def __repr__(self):
+        if self.file is not None:
+            return "`{}` (at {} line {} field {})".format(
+                self.text, self.file, self.line, self.field)
         return "`{}` (at line {} field {})".format(self.text, self.line, self.field)
 
 validIdent = re.compile(r'[^\d\s][\S]*')
 
+KEYWORDS = frozenset((
+    ":alias", ":breakpoint", ":byte", ":calc", ":const", ":include", ":macro",
+    ":monitor", ":next", ":org", ":unpack",
+    "again", "audio", "bcd", "begin", "bighex", "buzzer", "clear", "delay",
+    "else", "end", "exit", "hex", "hires", "i", "if", "jump", "jump0", "key",
+    "-key", "load", "loadflags", "long", "loop", "lores", "plane", "random",
+    "return", "save", "saveflags", "scroll-down", "scroll-left",
+    "scroll-right", "scroll-up", "sprite", "then", "while",
+))
+
+OPERATORS = frozenset((
+    ":", ";", "{", "}", "(", ")", "@",
+    ":=", "+=", "-=", "|=", "&=", "^=", ">>=", "<<=", "=-",
+    "==", "!=", "<", ">", "<=", ">=",
+    "+", "-", "*", "/", "%", "&", "|", "^", "~", "<<", ">>",
+))
+
+REGISTERS = {"v{:x}".format(i): i for i in range(0, 16)}
+REGISTERS.update({"v{:X}".format(i): i for i in range(0, 16)})
+
+KEYS = ('X', '1', '2', '3', 'Q', 'W', 'E', 'A', 'S', 'D', 'Z', 'C', '4', 'R', 'F', 'V')
+CONSTS = {"OCTO_KEY_{}".format(k): i for i, k in enumerate(KEYS)}
+CONSTS["PI"] = math.pi
+CONSTS["E"] = math.e
+
+NUMBER_START = frozenset("+-0123456789")
+
+def parse_literal(text):
+    # Only a sign or a digit can start a number (non-ASCII digits included).
+    if text[0] not in NUMBER_START and text[0].isascii():
+        return None
+    try:
+        return int(text, 0)
+    except ValueError:
+        # Decimal numbers with leading 0 do not parse in Python.
+        # So also attempt exlicit decimal parsing ot handle those.
+        try:
+            return int(text, 10)
+        except ValueError:
+            return None
+
+@lru_cache(maxsize=1 << 16)
+def classify(text):
+    """
+    The kind of a token's text, and its value for numbers and registers.
+    Source text repeats a lot, so the answers are cached.
+    """
+    if text in KEYWORDS:
+        return Kind.KEYWORD, None
+    if text in OPERATORS:
+        return Kind.OPERATOR, None
+    if text in REGISTERS:
+        return Kind.REGISTER, REGISTERS[text]
+    number = parse_literal(text)
+    if number is not None:
+        return Kind.NUMBER, number
+    return Kind.IDENT, None
+
+def tokenize(source, first_line=1):
+    """
+    Generate the tokens for an iterable of source lines, numbering the lines
+    from first_line. Whitespace and comments are stripped out.
+    """
+    for line_num, line in enumerate(source, first_line):
+
+        fields = line.split()
+
+        for field_num, field in enumerate(fields):
+            # Comments will consume the rest of the line, so we can ignore
+            if field.startswith("#"):
+                break
+
+            kind, value = classify(field)
+            yield Token(field, line_num, field_num+1, kind, value)
+
+# Bytes that make a line need decoding before it's split into fields.
+UNUSUAL_BYTES = re.compile(rb"[^\x00-\x1b\x20-\x7f]")
+
+# How much of a byte source is scanned at a time.
+BLOCK_SIZE = 1 << 18
+
+def split_fields(line):
+    """
+    The fields of a line of source bytes, leaving out a comment if the first
+    # in the line starts one.
+    """
+    if UNUSUAL_BYTES.search(line):
+        # Only str.split() knows about Unicode whitespace, and it also splits
+        # on the ASCII separators \x1c-\x1f.
+        return [field.encode() for field in line.decode().split()]
+    comment = line.find(b"#")
+    if comment == 0 or comment > 0 and line[comment-1] in b" \t\f\v":
+        line = line[:comment]
+    return line.split()
+
+def byte_lines(buffer):
+    """
+    Split a byte source into lines, a block at a time, ending lines at \r
+    and \r\n as well as \n, like reading a text file does.
+    """
+    start = 0
+    end = len(buffer)
+    while start < end:
+        stop = end
+        if end - start > BLOCK_SIZE:
+            stop = buffer.rfind(b"\n", start, start + BLOCK_SIZE)
+            if stop < 0:
+                stop = buffer.find(b"\n", start + BLOCK_SIZE)
+                stop = end if stop < 0 else stop
+        block = buffer[start:stop]
+        if stop < end and block.endswith(b"\r"):
+            # The \r of a \r\n split across blocks.
+            block = block[:-1]
+        if hasattr(buffer, "madvise") and start > 0:
+            # The pages already scanned won't be read again.
+            buffer.madvise(mmap.MADV_DONTNEED, 0, start - start % mmap.PAGESIZE)
+        start = stop + 1
+        if b"\r" in block:
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        yield from block.split(b"\n")
+
+def tokenize_bytes(buffer, first_line=1):
+    """
+    Generate the tokens for the raw UTF-8 bytes of a source, as tokenize()
+    does for its lines. The buffer can be an mmap, and is scanned a block at
+    a time, so memory use doesn't grow with the size of the source. Each
+    distinct field is decoded once, and its text shared from then on.
+    """
+    seen = {}
+    new = tuple.__new__
+    for line_num, line in enumerate(byte_lines(buffer), first_line):
+        for field_num, field in enumerate(split_fields(line), 1):
+            if field.startswith(b"#"):
+                break
+            scanned = seen.get(field)
+            if scanned is None:
+                if len(seen) >= 1 << 16:
+                    seen.clear()
+                text = field.decode()
+                scanned = seen[field] = (text,) + classify(text)
+            text, kind, value = scanned
+            yield new(Token, (text, line_num, field_num, kind, value, None))
+
+class TokenStore():
+    """
+    Tokens kept in columns instead of as Token tuples: an interned text id, a
+    line, a field and a file for each token. Macro bodies and { } clusters
+    live here, and are passed around as TokenSpans.
+    """
+    def __init__(self):
+        self.texts = []
+        self.classes = []
+        self.ids = {}
+        self.text_ids = array("I")
+        self.lines = array("I")
+        self.fields = array("I")
+        self.files = []
+
+    def __len__(self):
+        return len(self.text_ids)
+
+    def intern(self, text):
+        text_id = self.ids.get(text)
+        if text_id is None:
+            text_id = self.ids[text] = len(self.texts)
+            self.texts.append(text)
+            self.classes.append(classify(text))
+        return text_id
+
+    def append(self, token):
+        self.text_ids.append(self.intern(token.text))
+        self.lines.append(token.line)
+        self.fields.append(token.field)
+        self.files.append(token.file)
+
+    def token(self, index):
+        text_id = self.text_ids[index]
+        kind, value = self.classes[text_id]
+        return Token(self.texts[text_id], self.lines[index], self.fields[index], kind, value,
+                     self.files[index])
+
+    def span(self, start):
+        """The tokens from start up to the end of the store."""
+        return TokenSpan(self, start, len(self))
+
+class TokenSpan():
+    """
+    A run of tokens in a TokenStore. Token objects are built from the columns
+    the first time the span is read, and reused after that, so expanding a
+    macro many times doesn't copy its body. Only the substituted arguments are
+    new tokens.
+    """
+    __slots__ = ("store", "start", "end", "__tokens")
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+        self.__tokens = None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        return self.expand()
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def texts(self):
+        texts = self.store.texts
+        return tuple(texts[text_id] for text_id in self.store.text_ids[self.start:self.end])
+
+    def reversed(self):
+        """The tokens, last first."""
+        store = self.store
+        return (store.token(i) for i in range(self.end - 1, self.start - 1, -1))
+
+    def slots(self, names):
+        """
+        Where each of names is used, as a map from offset in the span to the
+        index of the name. Worked out once, when a macro is defined.
+        """
+        return {offset: names.index(text) for offset, text in enumerate(self.texts())
+                if text in names}
+
+    def expand(self, slots=None, args=()):
+        """
+        Iterate over the tokens, with the token at each offset in slots
+        replaced by the argument it indexes, positioned where it's used.
+        """
+        if self.__tokens is None:
+            store = self.store
+            self.__tokens = [store.token(i) for i in range(self.start, self.end)]
+        if not slots:
+            return iter(self.__tokens)
+        tokens = self.__tokens.copy()
+        for offset, index in slots.items():
+            arg, token = args[index], tokens[offset]
+            kind, value = (arg.kind, arg.value) if arg.kind is not None else classify(arg.text)
+            tokens[offset] = Token(arg.text, token.line, token.field, kind, value, token.file)
+        return iter(tokens)
+
 class Tokenizer():
-    def __init__(self, source):
-        keys = ('X', '1', '2', '3', 'Q', 'W', 'E', 'A', 'S', 'D', 'Z', 'C', '4', 'R', 'F', 'V')
-        self.consts = {"OCTO_KEY_{}".format(k):i for i, k in enumerate(keys)}
-        self.consts["PI"] = math.pi
-        self.consts["E"] = math.e
-        self.registers = {"v{:x}".format(i): i for i in range(0, 16)}
-        self.registers.update({"v{:X}".format(i): i for i in range(0, 16)})
+    # How deeply macros may expand inside one another, which stops recursive
+    # macros from expanding forever.
+    max_depth = 256
+
+    def __init__(self, source, consts=CONSTS, registers=REGISTERS):
+        # The predefined names are only ever copied, so every tokenizer
+        # starts from the same tables.
+        self.consts = consts.copy()
+        self.registers = registers.copy()
         self.current_token = None
         self.repeat_token = False
         self.calls = []
-
-        # Strip out whitespace and comments while tokenizing
-        def tokenize(source):
-            for line_num, line in enumerate(source):
-
-                fields = line.split()
-
-                for field_num, field in enumerate(fields):
-                    # Comments will consume the rest of the line, so we can ignore
-                    if field.startswith("#"):
-                        break
-
-                    yield Token(field, line_num+1, field_num+1)
-
-        self.tokengen = tokenize(source)
+        # The source map call site of each expansion, alongside calls.
+        self.sites = []
+        self.frames = []
+        self.store = TokenStore()
+        # With labels set to a symbolic program's, a label's name is given as
+        # an ident wherever a location can be, so that it becomes a fixup, and
+        # every other use of one as a number is logged in pins.
+        self.labels = {}
+        self.pins = []
+        if isinstance(source, (bytes, bytearray, mmap.mmap)):
+            self.tokengen = tokenize_bytes(source)
+        else:
+            self.tokengen = tokenize(source)
+        # The file being read, if it's one that was included, and the
+        # tokens and names of the files that included it, outermost first.
+        self.file = None
+        self.sources = []
 
     def error(self, msg):
         raise ParseError(msg, self.current_token)
@@ -61,32 +331,56 @@ class Tokenizer():
         if self.repeat_token:
             self.repeat_token = False
         else:
-            self.current_token = next(self.tokengen, None)
+            # Read from the innermost macro being expanded, dropping the
+            # ones that have run out, and then from the source.
+            frames = self.frames
+            while frames:
+                token = next(frames[-1], None)
+                if token is not None:
+                    break
+                frames.pop()
+                self.calls.pop()
+                self.sites.pop()
+            else:
+                token = next(self.tokengen, None)
+                while token is None and self.sources:
+                    # The end of an included file.
+                    self.tokengen, self.file = self.sources.pop()
+                    token = next(self.tokengen, None)
+            self.current_token = token
         if matcher is not None:
             return matcher()
         return self.current_token
 
-    def emit_macro(self, calls, tokens, mapping):
-        def convert_token(token):
-            if token.text in mapping:
-                return Token(mapping[token.text].text, token.line, token.field)
-            return token
-        macrotokengen = (convert_token(t) for t in tokens)
-
+    def include(self, tokens, name):
+        """Read tokens, from the file name, before the rest of this file."""
+        self.sources.append((self.tokengen, self.file))
+        self.tokengen = tokens
+        self.file = name
+
+    def emit_macro(self, calls, tokens, slots, args, site=None):
+        """
+        Read the expanded macro body before anything else. Expansions are kept
+        as a stack of cursors into their bodies, so reading a token costs the
+        same however deeply macros are nested. site is the expansion's call
+        site in the source map, if there is one.
+        """
+        if len(self.frames) >= self.max_depth:
+            self.error("macros nested more than {} deep".format(self.max_depth))
+        if self.repeat_token:
+            # A token that was given back is read after the macro.
+            self.repeat_token = False
+            self.frames.append(iter((self.current_token,)))
+            self.calls.append(self.calls[-1] if self.calls else None)
+            self.sites.append(self.sites[-1] if self.sites else None)
+        self.frames.append(tokens.expand(slots, args))
         self.calls.append(calls)
-
-        curgen = self.tokengen
-        def newgen():
-            yield from macrotokengen
-            self.calls.pop()
-            self.tokengen = curgen
-            yield next(curgen, None)
-
-        self.tokengen = newgen()
+        self.sites.append(site)
 
     def copy(self, tokens):
         copied = copy.copy(self)
         copied.tokengen = tokens
+        copied.frames = []
         return copied
 
     def expect(self, matcher, msg):
@@ -119,21 +413,18 @@ class Tokenizer():
         return self.expect(self.accept_register, "register")
 
     def parse_number(self):
-        if self.current_token.text == "CALLS":
+        token = self.current_token
+        if token.text == "CALLS":
             return self.calls[-1]
 
-        if self.current_token.text in self.consts:
-            return self.consts[self.current_token.text]
+        value = self.consts.get(token.text)
+        if value is not None:
+            if token.text in self.labels:
+                self.pins.append((token, value))
+            return value
 
-        try:
-            return int(self.current_token.text, 0)
-        except ValueError:
-            # Decimal numbers with leading 0 do not parse in Python.
-            # So also attempt exlicit decimal parsing ot handle those.
-            try:
-                return int(self.current_token.text, 10)
-            except ValueError:
-                return None
+        kind, value = (token.kind, token.value) if token.kind is not None else classify(token.text)
+        return value if kind is Kind.NUMBER else None
 
     def accept_ranged_number(self, low, high):
         num = self.parse_number()
@@ -180,12 +471,16 @@ class Tokenizer():
         return self.advance(self.expect_number)
 
     def expect_location(self):
+        if self.current_token.text in self.labels:
+            return self.expect_ident()
         num = self.accept_address()
         if num is not None:
             return num
         return self.expect_ident()
 
     def expect_long_location(self):
+        if self.current_token.text in self.labels:
+            return self.expect_ident()
         num = self.accept_long_address()
         if num is not None:
             return num
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import octopy.batch
+from octopy.batch import EXIT_FAILED, EXIT_OK, EXIT_USAGE, Job, Result, build, report
+
+from helpers import filehere
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.sources = os.path.join(self.directory, "src")
+        self.outdir = os.path.join(self.directory, "out")
+        os.makedirs(os.path.join(self.sources, "sub"))
+        self.write("good.8o", ": main v0 := 1")
+        self.write("sub/bad.8o", ": main v0 := nope")
+
+    def write(self, name, text):
+        with open(os.path.join(self.sources, name), "w") as f:
+            f.write(text)
+
+    def batch(self, *args):
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(self.directory, "cache"))
+        return subprocess.run([sys.executable, "-m", "octopy", "batch", *args],
+                              cwd=filehere(os.pardir), env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, check=False)
+
+    def test_batch(self):
+        done = self.batch("-o", self.outdir, "-j", "2", self.sources)
+        self.assertEqual(done.returncode, EXIT_FAILED)
+        self.assertEqual(done.stdout, "1 assembled, 1 failed\n")
+        bad = os.path.join(self.sources, "sub", "bad.8o")
+        self.assertTrue(done.stderr.startswith(bad + ":\n    "))
+        with open(os.path.join(self.outdir, "good.ch8"), "rb") as f:
+            self.assertEqual(f.read(), b"\x60\x01")
+        for ext in (".sym", ".symx"):
+            self.assertTrue(os.path.exists(os.path.join(self.outdir, "good" + ext)))
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, "sub", "bad.ch8")))
+
+    def test_all_good(self):
+        good = os.path.join(self.sources, "good.8o")
+        done = self.batch("-o", self.outdir, good)
+        self.assertEqual(done.returncode, EXIT_OK)
+        self.assertEqual((done.stdout, done.stderr), ("1 assembled, 0 failed\n", ""))
+
+    def test_same_outputs(self):
+        # Given as separate roots, both would be written to out/x.*.
+        for name in ("a", "b"):
+            os.makedirs(os.path.join(self.sources, name))
+            self.write(name + "/x.8o", ": main v0 := {}".format(len(name)))
+        first, second = (os.path.join(self.sources, name, "x.8o") for name in ("a", "b"))
+        done = self.batch("-o", self.outdir, first, second)
+        self.assertEqual(done.returncode, EXIT_FAILED)
+        self.assertEqual(done.stdout, "1 assembled, 1 failed\n")
+        self.assertEqual(done.stderr, "{}:\n    would overwrite the outputs of {}\n".format(
+            second, first))
+
+    def test_crash(self):
+        def crash(*args, **kwargs):
+            raise RuntimeError("boom")
+        saved = octopy.batch.assemble_file
+        octopy.batch.assemble_file = crash
+        try:
+            result = build(Job(os.path.join(self.sources, "good.8o"), self.outdir))
+        finally:
+            octopy.batch.assemble_file = saved
+        self.assertTrue(result.error.startswith("assembler crash:"))
+        self.assertIn("RuntimeError: boom", result.error)
+
+    def test_cache(self):
+        self.write("lib.8o", "v1 := 2")
+        self.write("good.8o", ":include lib.8o\n: main v0 := 1")
+        good = os.path.join(self.sources, "good.8o")
+        cache = os.path.join(self.directory, "cache", "octopy", "tokens")
+        self.assertEqual(self.batch("-o", self.outdir, good).returncode, EXIT_OK)
+        self.assertFalse(os.path.exists(cache))
+        self.assertEqual(self.batch("-o", self.outdir, "--cache", good).returncode, EXIT_OK)
+        self.assertEqual(len(os.listdir(cache)), 1)
+
+    def test_no_sources(self):
+        done = self.batch(os.path.join(self.directory, "*.none"))
+        self.assertEqual(done.returncode, EXIT_USAGE)
+        self.assertEqual((done.stdout, done.stderr), ("", "No sources found\n"))
+
+    def test_report(self):
+        out, err = io.StringIO(), io.StringIO()
+        results = [Result("a.8o", None, 2), Result("b.8o", "first\nsecond", 0)]
+        self.assertEqual(report(results, out, err), EXIT_FAILED)
+        self.assertEqual(out.getvalue(), "1 assembled, 1 failed\n")
+        self.assertEqual(err.getvalue(), "b.8o:\n    first\n    second\n")
+
+if __name__ == '__main__':
+    unittest.main()
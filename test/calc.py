@@ -1,7 +1,7 @@
 import unittest
 
 from octopy.tokenizer import Tokenizer, Token
-from octopy.calc import calc
+from octopy.calc import calc, compile_expression, compile_group, Constant, Interpret
 from octopy.parser import ParseError
 
 def no_rom(n): 
@@ -15,13 +15,19 @@ class TestCalc(unittest.TestCase):
         tokenizer.tokengen = reversed(tokens)
         if consts is not None:
             tokenizer.consts.update(consts)
+        compiled = compile_expression(tuple(expr.split(" ")))
         if isinstance(expect, type):
             print("CHECK RAISES", msg)
             with self.assertRaisesRegex(expect, msg):
                 calc(tokenizer, rom_lookup)
+            # Errors are left for calc() to report.
+            if compiled is not None:
+                with self.assertRaises(Interpret):
+                    compiled(tokenizer.consts, [], rom_lookup)
         else:
             result = calc(tokenizer, rom_lookup)
             self.assertEqual(result, expect)
+            self.assertEqual(compiled(tokenizer.consts, [], rom_lookup), expect)
 
     def test_simple(self):
         self.expr_test("4 + 3", 7)
@@ -75,5 +81,27 @@ class TestCalc(unittest.TestCase):
             return [11, 2, 33, 44][n]
         self.expr_test("2 * @ somewhere + @ somewhere", 88, consts=consts, rom_lookup=lookup)
 
+class TestCompiledCalc(unittest.TestCase):
+    def test_folds_constants(self):
+        tree = compile_group(iter(reversed("4 * ( 2 + ( 3 * ( 1 + 1 ) ) + 3 ) - 2".split())), set())
+        self.assertEqual(tree, Constant(36))
+
+    def test_names_given_at_evaluation(self):
+        compiled = compile_expression(tuple("( HERE - table ) * CALLS".split()))
+        self.assertEqual(compiled({"HERE": 0x210, "table": 0x200}, [3], no_rom), 48)
+        self.assertEqual(compiled({"HERE": 0x204, "table": 0x200}, [0, 2], no_rom), 8)
+        with self.assertRaises(Interpret):
+            compiled({"HERE": 0x204}, [1], no_rom)
+
+    def test_consts_shadowing_operators(self):
+        compiled = compile_expression(tuple("2 - min".split()))
+        self.assertIsNone(compiled)
+        compiled = compile_expression(tuple("2 * -1".split()))
+        self.assertEqual(compiled({}, [], no_rom), -2)
+        with self.assertRaises(Interpret):
+            compiled({"-1": 5}, [], no_rom)
+
+    def test_cached_by_text(self):
+        self.assertIs(compile_expression(("1", "+", "x")), compile_expression(("1", "+", "x")))
 
 if __name__ == '__main__': unittest.main()
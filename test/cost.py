@@ -0,0 +1,116 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.cost import Heavy, analyze
+
+from helpers import testsources
+
+def analyzed(text):
+    program = assemble(io.StringIO(text))
+    if program.error is not None:
+        raise program.error
+    return analyze(program)
+
+class TestCost(unittest.TestCase):
+    def test_branches(self):
+        analysis = analyzed("""
+            : main
+                draw
+                jump main
+            : draw
+                if v0 == 1 begin
+                    v1 := 2
+                    sprite v1 v1 5
+                end
+                bcd v1
+                ;
+        """)
+        draw = analysis.subroutine("draw")
+        # Skip, then the sprite or the jump past it, then bcd and return.
+        self.assertEqual((draw.entry.best, draw.entry.worst), (4, 5))
+        self.assertEqual([(h.kind, h.amount) for h in draw.entry.heavy],
+                         [("sprite", 5), ("bcd", 3)])
+        self.assertEqual(draw.depth, 0)
+        main = analysis.subroutine("main")
+        # main is a loop: the call and the jump back, and all of draw.
+        self.assertEqual([segment.address for segment in main.segments], [0x200])
+        self.assertEqual((main.entry.best, main.entry.worst), (2, 2))
+        self.assertEqual((main.entry.best_calls, main.entry.worst_calls), (6, 7))
+        self.assertEqual(analysis.depth, 1)
+
+    def test_loops(self):
+        analysis = analyzed("""
+            : main
+                v0 := 0
+                clear
+                loop
+                    v0 += 1
+                    i := table
+                    load v3
+                    if v0 != 8 then
+                again
+                wait
+                exit
+            : wait
+                loop
+                    v0 := delay
+                    if v0 != 0 then
+                again
+                ;
+            : table
+                1 2 3 4
+        """)
+        main = analysis.subroutine("main")
+        self.assertEqual([segment.address for segment in main.segments], [0x200, 0x204])
+        entry, loop = main.segments
+        self.assertEqual((entry.best, entry.worst), (2, 2))
+        # Round again, or out to wait and exit.
+        self.assertEqual((loop.best, loop.worst), (5, 6))
+        self.assertEqual(loop.heavy, (Heavy(0x208, "load", 4),))
+        self.assertTrue(loop.loops)
+        self.assertFalse(entry.loops)
+        wait = analysis.subroutine("wait")
+        # Starting with a loop, the entry is the loop.
+        self.assertEqual(len(wait.segments), 1)
+        self.assertEqual((wait.entry.best, wait.entry.worst), (3, 3))
+
+    def test_depth(self):
+        analysis = analyzed("""
+            : main a b jump main
+            : a b ;
+            : b c ;
+            : c ;
+        """)
+        self.assertEqual(analysis.depth, 3)
+        self.assertEqual(analysis.subroutine("a").calls, ("b",))
+        self.assertEqual(analysis.subroutine("c").depth, 0)
+
+    def test_recursion(self):
+        analysis = analyzed("""
+            : main a jump main
+            : a if v0 == 0 then ; v0 += -1 a ;
+        """)
+        self.assertIsNone(analysis.depth)
+        self.assertIsNone(analysis.subroutine("a").depth)
+        self.assertIn("recursive calls", analysis.notes)
+        self.assertIn("unbounded", analysis.table())
+
+    def test_jump0(self):
+        analysis = analyzed("""
+            : main
+                jump0 table
+            : table
+                jump main
+        """)
+        self.assertIn("jump0 at 0x0200", analysis.notes)
+
+    def test_everything_analyzes(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                program = assemble(io.StringIO(text))
+                if program.error is None:
+                    analyze(program).table()
+
+if __name__ == '__main__':
+    unittest.main()
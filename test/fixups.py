@@ -0,0 +1,78 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.program import ADDRESS, LONG, UNPACK, Program
+from octopy.tokenizer import Token
+
+from helpers import testsources
+
+SOURCE = """
+: main
+    sub
+    jump sub
+    i := long far
+    :unpack 0xA far
+    sub
+: sub ;
+:org 0x1234
+: far 0x12
+"""
+
+def moved(source, shift):
+    """The source, with far shifted along by shift bytes of padding."""
+    return source.replace(": far", "{} : far".format(" 0" * shift))
+
+class TestFixups(unittest.TestCase):
+    def test_sites_by_name(self):
+        program = assemble(io.StringIO(SOURCE))
+        self.assertIsNone(program.error)
+        fixups = program.fixups
+        self.assertEqual(fixups.names, ["sub", "far"])
+        self.assertEqual(len(fixups), 5)
+        self.assertEqual([how for (_, _, how) in fixups.since(0)],
+                         [ADDRESS, ADDRESS, LONG, UNPACK, ADDRESS])
+
+    def test_relink(self):
+        program = assemble(io.StringIO(SOURCE))
+        expected = assemble(io.StringIO(moved(SOURCE, 3)))
+        self.assertIsNone(expected.error)
+        program.relink({"far": expected.labels["far"]})
+        # Only the code referring to far changed, not the padding before it.
+        code = expected.labels["sub"] + 2 - 0x200
+        self.assertEqual(program.program[:code], expected.program[:code])
+        self.assertEqual(program.labels, expected.labels)
+
+    def test_relink_everything(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                program = assemble(io.StringIO(text))
+                if program.error is not None:
+                    continue
+                rom, labels = program.program, dict(program.labels)
+                program.relink({name: 0x555 for name in program.fixups.names})
+                self.assertEqual(len(program.program), len(rom))
+                program.relink({name: labels[name] for name in program.fixups.names})
+                self.assertEqual(program.program, rom)
+
+    def test_unresolved(self):
+        program = assemble(io.StringIO(": main jump nowhere :unpack 1 elsewhere"))
+        self.assertEqual(program.error.token.text, "elsewhere")
+
+    def test_fragments(self):
+        program = Program()
+        program.JMP(0x300)
+        mark = program.mark()
+        program.CALL(Token("sub", 0, 0))
+        program.emit_unpack(1, Token("sub", 0, 0))
+        fragment = program.fragment(mark)
+        self.assertEqual([(token.text, offset, how) for (token, offset, how) in fragment.fixups],
+                         [("sub", 0, ADDRESS), ("sub", 6, UNPACK)])
+        program.replay(fragment)
+        self.assertEqual(len(program.fixups.sites[0]), 4)
+        program.labels["sub"] = 0x345
+        program.resolve()
+        self.assertEqual(program.program[8:14], b"\x23\x45\x60\x13\x61\x45")
+
+if __name__ == '__main__':
+    unittest.main()
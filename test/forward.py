@@ -0,0 +1,213 @@
+import io
+import unittest
+
+from octopy.assemble import MAX_PASSES, assemble
+from octopy.incremental import IncrementalAssembler
+
+def assembled(text):
+    program = assemble(io.StringIO(text))
+    if program.error is not None:
+        raise program.error
+    return program
+
+class TestForwardReferences(unittest.TestCase):
+    def assertSameAssembly(self, text, expected):
+        self.assertEqual(assembled(text).program, assembled(expected).program)
+
+    def test_byte(self):
+        self.assertSameAssembly("""
+            : main
+                jump main
+            : table
+                :byte { table_end - table }
+                1 2 3
+            : table_end
+        """, """
+            : main
+                jump main
+            : table
+                4 1 2 3
+            : table_end
+        """)
+
+    def test_calc(self):
+        self.assertSameAssembly("""
+            : main
+                :calc SIZE { data_end - data }
+                :calc HALF { SIZE / 2 }
+                :byte { HALF }
+                i := AFTER
+                jump main
+            :calc AFTER { data_end + 2 }
+            : data
+                1 2 3 4 5 6
+            : data_end
+        """, """
+            : main
+                3
+                i := 0x20D
+                jump main
+            : data
+                1 2 3 4 5 6
+            : data_end
+        """)
+
+    def test_here_and_calls(self):
+        self.assertSameAssembly("""
+            :macro entry { :byte { ( CALLS * 16 ) + done - HERE } }
+            : main
+                entry entry entry
+            : done
+        """, """
+            : main
+                3 18 33
+            : done
+        """)
+
+    def test_names_keep_their_meaning(self):
+        # The deferred expression sees X as it was, not as it's redefined.
+        self.assertSameAssembly("""
+            :const X 1
+            : main
+                :byte { ( later - 0x200 ) + X }
+            :const X 5
+            : later
+        """, """
+            : main
+                2
+            : later
+        """)
+
+    def test_rom_lookup(self):
+        self.assertSameAssembly("""
+            : main
+                :byte { @ table }
+            : table
+                0x42
+        """, """
+            : main
+                0x42
+            : table
+                0x42
+        """)
+
+    def test_org(self):
+        program = assembled("""
+            : main
+                i := data
+                jump main
+            :org { tail_end }
+            : data
+                1 2 3
+            :org 0x400
+            : tail
+                jump tail
+            : tail_end
+        """)
+        self.assertEqual(program.labels["data"], 0x402)
+        self.assertSameAssembly("""
+            : main
+                i := data
+                jump main
+            :org { tail_end }
+            : data
+                1 2 3
+            :org 0x400
+            : tail
+                jump tail
+            : tail_end
+        """, """
+            : main
+                i := data
+                jump main
+            :org 0x402
+            : data
+                1 2 3
+            :org 0x400
+            : tail
+                jump tail
+            : tail_end
+        """)
+
+    def test_org_unsettled(self):
+        program = assemble(io.StringIO("""
+            : main
+                jump main
+            :org { after + 2 }
+            : after
+        """))
+        self.assertIn("still changing after {} passes".format(MAX_PASSES), str(program.error))
+
+    def test_org_needs_rereading(self):
+        lines = iter([": main", ":org { after }", "0", ":org 0x300 : after"])
+        program = assemble(lines)
+        self.assertIn("read again", str(program.error))
+
+    def test_circular(self):
+        program = assemble(io.StringIO("""
+            : main
+                :calc A { B + 1 }
+                :calc B { A + 1 }
+                :byte { A }
+        """))
+        self.assertIn("in terms of itself", str(program.error))
+
+    def test_undefined(self):
+        program = assemble(io.StringIO(": main :byte { nowhere + 1 }"))
+        self.assertIsNotNone(program.error)
+        self.assertIn("nowhere", str(program.error))
+
+    def test_unused_calc(self):
+        # Every :calc is worked out, whether it's used or not, and kept with
+        # the consts, for the symbol files.
+        program = assembled("""
+            : main
+                :calc SIZE { data_end - data }
+                jump main
+            : data
+                1 2 3
+            : data_end
+        """)
+        self.assertEqual(program.consts["SIZE"], 3)
+        program = assemble(io.StringIO("""
+            : main
+                :calc SIZE { endd - data }
+                jump main
+            : data
+            : data_end
+        """))
+        self.assertEqual(program.error.token.text, "endd")
+        self.assertEqual(program.error.token.line, 3)
+
+    def test_errors_reported_once(self):
+        program = assemble(io.StringIO("""
+            : main
+                :calc A { nowhere + 1 }
+                :calc B { A + 1 }
+                :byte { B }
+        """), recover=True)
+        self.assertEqual([error.token.text for error in program.errors], ["nowhere"])
+
+    def test_out_of_range(self):
+        program = assemble(io.StringIO(": main :byte { later * 4 } : later"))
+        self.assertIn("out of range", str(program.error))
+
+    def test_alias_is_not_deferred(self):
+        program = assemble(io.StringIO(": main :alias x { later } : later"))
+        self.assertIsNotNone(program.error)
+
+    def test_incremental(self):
+        text = """
+            : main
+                :byte { table_end - table }
+                jump main
+            : table
+                1 2 3
+            : table_end
+        """
+        assembler = IncrementalAssembler()
+        for edit in (text, text.replace("1 2 3", "1 2 3 4")):
+            self.assertEqual(assembler.assemble(edit).program, assembled(edit).program)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+"""What the test scripts share. They're run as test/<name>.py, so this is
+imported as helpers."""
+import os
+
+curdir = os.path.dirname(__file__)
+def filehere(name): return os.path.join(curdir, name)
+
+def testpaths():
+    """The name and path of each source in testdata."""
+    testdata = filehere("testdata")
+    for name in sorted(os.listdir(testdata)):
+        if name.endswith(".8o"):
+            yield name, os.path.join(testdata, name)
+
+def testsources():
+    """The name and text of each source in testdata."""
+    for name, path in testpaths():
+        with open(path) as src:
+            yield name, src.read()
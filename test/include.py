@@ -0,0 +1,167 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import octopy.include
+from octopy.assemble import assemble, assemble_file
+from octopy.include import CachedTokens, Includes, tokenize_file, write_token_file
+from octopy.tokenizer import tokenize_bytes
+
+FILES = {
+    "main.8o": """
+        :include "lib/draw.8o"
+        :include lib/math.8o   # already included by draw
+        : main
+            v0 := 3
+            double v0
+            draw-ball
+            loop again
+    """,
+    "lib/draw.8o": """
+        :include "math.8o"
+        : draw-ball
+            i := ball
+            sprite v0 v1 3
+            ;
+        : ball 0x40 0xE0 0x40
+    """,
+    "lib/math.8o": """
+        :macro double r { r += r }
+    """,
+}
+
+# The same program in one file.
+FLAT = """
+    :macro double r { r += r }
+    : draw-ball
+        i := ball
+        sprite v0 v1 3
+        ;
+    : ball 0x40 0xE0 0x40
+    : main
+        v0 := 3
+        double v0
+        draw-ball
+        loop again
+"""
+
+class TestInclude(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, files):
+        for name, text in files.items():
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+        return os.path.join(self.directory, "main.8o")
+
+    def assembled(self, files, **kwargs):
+        program = assemble_file(self.write(files), **kwargs)
+        if program.error is not None:
+            raise program.error
+        return program
+
+    def test_include(self):
+        program = self.assembled(FILES)
+        expected = assemble(io.StringIO(FLAT))
+        self.assertEqual(program.program, expected.program)
+        self.assertEqual(program.labels, expected.labels)
+        here = lambda name: os.path.join(self.directory, name)
+        self.assertEqual(program.includes, {
+            here("main.8o"): [here("lib/draw.8o"), here("lib/math.8o")],
+            here("lib/draw.8o"): [here("lib/math.8o")],
+        })
+
+    def test_errors(self):
+        program = assemble_file(self.write({
+            "main.8o": ":include a.8o\n:include missing.8o\n: main\n  v0 += nope\n",
+            "a.8o": ":include b.8o\n",
+            "b.8o": ":include a.8o\n",
+        }), recover=True)
+        messages = [str(error).splitlines()[-1] for error in program.errors]
+        a, b = os.path.join(self.directory, "a.8o"), os.path.join(self.directory, "b.8o")
+        self.assertTrue(messages[0].startswith("`a.8o` (at {} line 1 field 2)".format(b)))
+        self.assertTrue(messages[0].endswith("includes itself: {} -> {} -> {}".format(a, b, a)))
+        self.assertIn("can't include", messages[1])
+        self.assertEqual(program.errors[2].token.line, 4)
+        self.assertIsNone(program.errors[2].token.file)
+
+        program = assemble_file(self.write({
+            "main.8o": ":macro m { :include a.8o }\n: main m\n",
+        }))
+        self.assertEqual(program.error.__cause__.msg, ":include can't be used in a macro")
+
+    def test_error_in_included_macro(self):
+        program = assemble_file(self.write({
+            "main.8o": ":include lib.8o\n: main\n  bad 1\n",
+            "lib.8o": "\n:macro bad x {\n  x := 2\n}\n",
+        }))
+        innermost = program.error
+        while innermost.__cause__ is not None:
+            innermost = innermost.__cause__
+        self.assertEqual(innermost.token.file, os.path.join(self.directory, "lib.8o"))
+        self.assertEqual(innermost.token.line, 3)
+
+    def test_cache(self):
+        cache = os.path.join(self.directory, "cache")
+        expected = self.assembled(FILES, cache=cache).program
+        self.assertEqual(len(os.listdir(cache)), 2)
+        saved = octopy.include.tokenize_file
+        def fail(data):
+            raise AssertionError("tokenized again")
+        octopy.include.tokenize_file = fail
+        try:
+            self.assertEqual(self.assembled(FILES, cache=cache).program, expected)
+        finally:
+            octopy.include.tokenize_file = saved
+        # Entries that can't be read are tokenized again, and replaced.
+        for name in os.listdir(cache):
+            with open(os.path.join(cache, name), "wb") as f:
+                f.write(b"OCTOTOKS")
+        self.assertEqual(self.assembled(FILES, cache=cache).program, expected)
+        with CachedTokens(os.path.join(cache, os.listdir(cache)[0])) as cached:
+            self.assertGreater(len(cached.text_ids), 0)
+
+    def test_token_files(self):
+        source = "v0 := 1 # comment\n\n  : label 0x12 # more\nsprite\tv0 v1 0\n".encode()
+        tokens = tokenize_file(source)
+        path = os.path.join(self.directory, "tokens.tok")
+        with open(path, "wb") as fout:
+            write_token_file(tokens, fout)
+        with CachedTokens(path) as cached:
+            read = cached.token_file()
+        expected = [token._replace(file="f") for token in tokenize_bytes(source)]
+        self.assertEqual(list(tokens.tokens("f")), expected)
+        self.assertEqual(list(read.tokens("f")), expected)
+
+    def test_prefetch(self):
+        path = self.write(FILES)
+        includes = Includes(path, jobs=2)
+        includes.parallel_size = 0
+        with open(path, "rb") as f:
+            includes.prefetch(f.read())
+        self.assertEqual(len(includes.files), 2)
+        with open(path) as f:
+            program = assemble(f, includes=includes)
+        self.assertEqual(program.program, self.assembled(FILES, jobs=1).program)
+
+    def test_source_map(self):
+        program = self.assembled(FILES, source_map=True)
+        source_map = program.source_map
+        draw, math = (os.path.join(self.directory, name) for name in ("lib/draw.8o", "lib/math.8o"))
+        self.assertEqual(source_map.files[1:], [draw, math])
+        runs = {start: (source_map.files[file], line)
+                for (start, _, file, line, _) in source_map.runs(program.segments())}
+        self.assertEqual(runs[program.labels["draw-ball"]], (draw, 4))
+        # The expansion of double is put down to its body, in math.8o.
+        self.assertEqual(runs[program.labels["main"] + 2], (math, 2))
+
+if __name__ == '__main__':
+    unittest.main()
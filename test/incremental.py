@@ -0,0 +1,127 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from octopy.assemble import assemble, assemble_file
+from octopy.incremental import IncrementalAssembler
+
+from helpers import testsources
+
+def subroutines(count):
+    parts = [": main\n  loop\n  sub0\n  again\n"]
+    for n in range(count):
+        parts.append(": sub{}\n  v0 := {}\n  if v0 == 3 begin v1 := 2 end\n  i := data{}\n  sub{}\n  return\n"
+                     .format(n, n, n, n+1))
+    parts.append(": sub{} return\n".format(count))
+    for n in range(count):
+        parts.append(": data{}\n  0x{:02X} 0x10\n".format(n, n))
+    return "".join(parts)
+
+class TestIncremental(unittest.TestCase):
+    def assertSameAssembly(self, assembler, text):
+        program = assembler.assemble(text)
+        full = assemble(io.StringIO(text))
+        self.assertEqual(str(program.error), str(full.error))
+        self.assertEqual(program.program, full.program)
+        self.assertEqual(program.labels, full.labels)
+        self.assertEqual(dict(program.consts), dict(full.consts))
+
+    def test_matches_full_assembly(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                assembler = IncrementalAssembler()
+                self.assertSameAssembly(assembler, text)
+                self.assertSameAssembly(assembler, text)
+
+    def test_edits_match_full_assembly(self):
+        edits = [
+            lambda lines, i: lines.insert(i, "v1 := 2"),
+            lambda lines, i: lines.insert(i, "# comment"),
+            lambda lines, i: lines.pop(i),
+            lambda lines, i: lines.__setitem__(i, lines[i].replace("1", "3", 1)),
+        ]
+        for name, text in testsources():
+            assembler = IncrementalAssembler()
+            assembler.assemble(text)
+            lines = text.split("\n")
+            for i in range(0, len(lines), max(1, len(lines) // 4)):
+                for edit in edits:
+                    with self.subTest(name, line=i):
+                        edited = list(lines)
+                        edit(edited, i)
+                        self.assertSameAssembly(assembler, "\n".join(edited))
+
+    def test_only_changed_regions_parsed(self):
+        text = subroutines(50)
+        assembler = IncrementalAssembler()
+        assembler.assemble(text)
+        self.assertEqual(assembler.parsed, len(assembler.regions))
+
+        assembler.assemble(text)
+        self.assertEqual(assembler.parsed, 0)
+
+        edited = text.replace(": sub20\n  v0 := 20", ": sub20\n  v0 := 21")
+        self.assertSameAssembly(assembler, edited)
+        self.assertEqual(assembler.parsed, 1)
+
+    def test_moved_regions_are_relocated(self):
+        text = subroutines(50)
+        assembler = IncrementalAssembler()
+        assembler.assemble(text)
+
+        edited = text.replace(": sub20\n", ": sub20\n  v5 := 1\n")
+        self.assertSameAssembly(assembler, edited)
+        self.assertEqual(assembler.parsed, 1)
+
+    def test_dependent_regions_parsed(self):
+        text = ":const speed 3\n: main\n  v0 := speed\n: other\n  v1 := 2\n"
+        assembler = IncrementalAssembler()
+        assembler.assemble(text)
+
+        self.assertSameAssembly(assembler, text.replace("speed 3", "speed 4"))
+        self.assertEqual(assembler.parsed, 2)
+
+    def test_regions_using_their_own_labels(self):
+        # Backward references to a region's own labels are numbers, not
+        # relocations, so the region is parsed again when it moves.
+        cases = [
+            (": main\n jump main\n", "1 2 3\n: main\n jump main\n"),
+            (":macro point { i := main }\n: main\n point\n",
+             ":macro point { i := main }\n0x12\n: main\n point\n"),
+            (": main\n v0 := 1\n: sub\n :const here sub\n v1 := here\n jump sub\n",
+             ": main\n v0 := 1\n 0x12\n: sub\n :const here sub\n v1 := here\n jump sub\n"),
+        ]
+        for text, edited in cases:
+            with self.subTest(edited):
+                assembler = IncrementalAssembler()
+                assembler.assemble(text)
+                self.assertSameAssembly(assembler, edited)
+
+    def test_includes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        def write(name, text):
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(text)
+        path = os.path.join(directory, "main.8o")
+        text = ": main\n  :include lib.8o\n  v0 := 1\n: sub\n  :include lib.8o\n  ;\n"
+        write("main.8o", text)
+        write("lib.8o", "v1 := 7\n")
+        assembler = IncrementalAssembler(path)
+        self.assertEqual(assembler.assemble(text).program, assemble_file(path).program)
+
+        # Only the region that read lib.8o is parsed again when it changes.
+        write("lib.8o", "v1 := 9\n")
+        program = assembler.assemble(text)
+        self.assertEqual(program.program, assemble_file(path).program)
+        self.assertEqual(assembler.parsed, 1)
+        self.assertEqual(program.includes, {path: [os.path.join(directory, "lib.8o")] * 2})
+
+        # Each file is read once, by whichever region includes it first.
+        edited = text.replace("  :include lib.8o\n  v0", "  v0")
+        write("main.8o", edited)
+        self.assertEqual(assembler.assemble(edited).program, assemble_file(path).program)
+
+if __name__ == '__main__': unittest.main()
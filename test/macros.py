@@ -0,0 +1,131 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.errors import ParseError
+from octopy.parser import Parser
+from octopy.program import Program
+from octopy.tokenizer import Tokenizer
+
+from helpers import testsources
+
+def assemble_uncached(text):
+    cache_size = Parser.expansion_cache_size
+    Parser.expansion_cache_size = 0
+    try:
+        return assemble(io.StringIO(text))
+    finally:
+        Parser.expansion_cache_size = cache_size
+
+class TestExpansionCache(unittest.TestCase):
+    def assertSameAssembly(self, text):
+        program = assemble(io.StringIO(text))
+        uncached = assemble_uncached(text)
+        self.assertIsNone(uncached.error)
+        self.assertIsNone(program.error)
+        self.assertEqual(program.program, uncached.program)
+        self.assertEqual(program.labels, uncached.labels)
+        return program
+
+    def test_matches_uncached(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                program = assemble(io.StringIO(text))
+                uncached = assemble_uncached(text)
+                self.assertEqual(str(program.error), str(uncached.error))
+                self.assertEqual(program.program, uncached.program)
+
+    def test_replays_blocks_at_new_addresses(self):
+        self.assertSameAssembly("""
+            :macro wait t {
+                v0 := t
+                loop
+                    while v0 != 0
+                    v0 += -1
+                    if v0 == 5 begin v1 := 1 else v1 := 2 end
+                again
+            }
+            : main
+                wait 10 wait 10 wait 20 wait 10
+        """)
+
+    def test_names_that_changed_meaning(self):
+        self.assertSameAssembly("""
+            :macro put { v0 := N vx := 1 later }
+            :const N 1
+            :alias vx v1
+            : main
+                put put
+            :const N 2
+                put
+            :alias vx v2
+                put
+            : later return
+                put
+            :macro later { v3 := 3 }
+                put
+        """)
+
+    def test_partial_statements(self):
+        self.assertSameAssembly("""
+            :macro if-flag FLAG { vf := FLAG vf &= v8 if vf == 0 }
+            :macro store r { i := 0x300 save r }
+            : main
+                if-flag 0x80 then v0 := 1
+                if-flag 0x80 then v0 := 2
+                store v3 - v5
+                store v3
+                store v3
+                store v3 - v5
+        """)
+
+    def test_volatile_expansions_are_not_kept(self):
+        program = Program()
+        parser = Parser(Tokenizer(io.StringIO("""
+            :macro count { v0 := CALLS }
+            :macro here { :calc h { HERE } i := h }
+            :macro nested { count }
+            :macro plain a { v0 := a }
+            : main
+                count count here here nested nested plain 1 plain 1 plain 2
+        """)), program)
+        parser.parse()
+        program.resolve()
+        self.assertEqual(program.program, bytes.fromhex("6000 6001 A204 A206 6002 6003 6001 6001 6002"))
+        kept = {name: len(entry.macro.expansions) for name, entry in parser.macros.items()}
+        self.assertEqual(kept, {"count": 0, "here": 0, "nested": 0, "plain": 2})
+
+def nested(depth, calls=2):
+    lines = [":macro m0 { v0 += 1 }"]
+    lines += [":macro m{} {{ m{} }}".format(n, n - 1) for n in range(1, depth + 1)]
+    lines.append(": main")
+    lines += ["  m{}".format(depth)] * calls
+    return "\n".join(lines)
+
+class TestNesting(unittest.TestCase):
+    def test_deep_nesting(self):
+        program = assemble(io.StringIO(nested(Tokenizer.max_depth - 1)))
+        self.assertIsNone(program.error)
+        self.assertEqual(program.program, bytes.fromhex("7001 7001"))
+
+    def test_depth_limit(self):
+        program = assemble(io.StringIO(nested(Tokenizer.max_depth)))
+        self.assertIn("nested more than {} deep".format(Tokenizer.max_depth), str(program.error))
+
+        program = assemble(io.StringIO(":macro forever { v0 += 1 forever }\n: main forever"))
+        self.assertIn("nested more than", str(program.error))
+
+    def test_configurable_limit(self):
+        tokenizer = Tokenizer(io.StringIO(nested(5)))
+        tokenizer.max_depth = 4
+        parser = Parser(tokenizer, Program())
+        with self.assertRaisesRegex(ParseError, "nested more than 4 deep"):
+            parser.parse()
+
+        tokenizer = Tokenizer(io.StringIO(nested(2000)))
+        tokenizer.max_depth = 3000
+        program = Program()
+        Parser(tokenizer, program).parse()
+        self.assertEqual(program.program, bytes.fromhex("7001 7001"))
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,165 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.parser import Parser
+from octopy.program import Program
+from octopy.tokenizer import Tokenizer
+
+from helpers import testsources
+
+def symbolic(text):
+    program = Program()
+    program.symbolic = True
+    Parser(Tokenizer(io.StringIO(text)), program).parse()
+    program.resolve()
+    return program
+
+def optimized(text):
+    program = assemble(io.StringIO(text), optimize=True)
+    if program.error is not None:
+        raise program.error
+    return program
+
+def ops(program):
+    rom = program.program
+    return ["{:02X}{:02X}".format(rom[n], rom[n+1]) for n in range(0, len(rom) - 1, 2)]
+
+class TestOptimize(unittest.TestCase):
+    def test_symbolic(self):
+        # Parsing with labels kept as fixups gives the same ROM.
+        for name, text in testsources():
+            with self.subTest(name):
+                expected = assemble(io.StringIO(text))
+                if expected.error is None:
+                    self.assertEqual(symbolic(text).program, expected.program)
+
+    def test_everything_assembles(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                program = assemble(io.StringIO(text))
+                if program.error is None:
+                    self.assertIsNone(assemble(io.StringIO(text), optimize=True).error)
+
+    def test_thread(self):
+        program = optimized("""
+            : main
+                jump a
+                v2 := 3
+            : a
+                jump b
+                v0 := 1
+            : b
+                v1 := 2
+                jump main
+        """)
+        self.assertEqual(ops(program), ["1208", "6203", "1208", "6001", "6102", "1208"])
+        self.assertEqual(program.report.count("thread"), 2)
+
+    def test_tail_call(self):
+        program = optimized("""
+            : main
+                sub
+                jump main
+            : sub
+                v0 := 1
+                other
+                ;
+            : other
+                v1 := 2
+                ;
+        """)
+        # The jump to other is to the next instruction once the return's gone.
+        self.assertEqual(ops(program), ["2204", "1200", "6001", "6102", "00EE"])
+        self.assertEqual(program.report.count("tail call"), 1)
+        self.assertEqual(program.report.count("return"), 1)
+        self.assertEqual(program.report.count("jump next"), 1)
+        self.assertEqual(program.labels["other"], 0x206)
+        self.assertEqual(program.report.moved["other"], (0x20A, 0x206))
+
+    def test_jump_next(self):
+        program = optimized("""
+            : main
+                if v0 == 1 begin
+                    v1 := 1
+                else
+                end
+                if v2 == 3 begin
+                end
+                jump main
+        """)
+        # The jump to the else that's gone is threaded through to main.
+        self.assertEqual(ops(program), ["3001", "1200", "6101", "1200"])
+        self.assertEqual(program.report.count("jump next"), 2)
+        self.assertEqual(program.report.removed, 6)
+
+    def test_loads(self):
+        program = optimized("""
+            : main
+                vf := 5
+                if v1 < 5 then v2 := 1
+                v3 := v4
+                v3 := v4
+                v5 := 1
+                v5 := 2
+                jump main
+        """)
+        self.assertEqual(ops(program), ["6F05", "8F17", "4F00", "6201", "8340", "6502", "1200"])
+        self.assertEqual(program.report.count("dead load"), 3)
+        self.assertEqual(program.report.count("reload"), 0)
+
+    def test_skipped_loads_stay(self):
+        program = optimized("""
+            : main
+                if v0 == 1 then v1 := 2
+                v1 := 2
+                jump main
+        """)
+        self.assertEqual(ops(program), ["4001", "6102", "6102", "1200"])
+
+    def test_jump0(self):
+        text = """
+            : main
+                jump0 table
+            : table
+                jump a
+                jump main
+            : a
+                if v0 == 1 begin
+                end
+                jump main
+        """
+        program = optimized(text)
+        self.assertEqual(program.program, assemble(io.StringIO(text)).program)
+        self.assertEqual(program.report.removed, 0)
+        self.assertIn("jump0", program.report.notes[0])
+
+    def test_address_used_as_number(self):
+        program = optimized("""
+            : main
+                if v0 == 1 begin
+                end
+            : rest
+                :calc X { HERE }
+                if v0 == 2 begin
+                end
+                jump main
+        """)
+        self.assertEqual(ops(program), ["3001", "1204", "1200"])
+        self.assertEqual(program.labels["rest"], 0x204)
+        self.assertIn("0x0204", program.report.notes[0])
+
+    def test_code_used_as_data(self):
+        program = optimized("""
+            : main
+                i := patched
+                save v1
+            : patched
+                jump onward
+            : onward
+                jump main
+        """)
+        self.assertEqual(ops(program), ["A204", "F155", "1206", "1200"])
+
+if __name__ == '__main__':
+    unittest.main()
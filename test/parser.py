@@ -0,0 +1,56 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.incremental import IncrementalAssembler
+
+def assembled(text, **kwargs):
+    program = assemble(io.StringIO(text), **kwargs)
+    if program.error is not None:
+        raise program.error
+    return program
+
+class TestDispatch(unittest.TestCase):
+    def assertSameAssembly(self, text, expected):
+        self.assertEqual(assembled(text).program, assembled(expected).program)
+
+    def test_spellings(self):
+        # Directives with or without their colon, and statements with _
+        # for - or extra colons.
+        self.assertSameAssembly(
+            "const speed 3 : main v0 := speed :clear scroll_down 2 ::jump main",
+            ":const speed 3 : main v0 := speed clear scroll-down 2 jump main")
+
+    def test_shadowing(self):
+        # Macros, aliases, labels and consts named like statements are used
+        # instead of them.
+        self.assertSameAssembly(":macro clear { v0 := 1 } : main clear",
+                                ": main v0 := 1")
+        self.assertSameAssembly(":alias save v3 : main save := 2",
+                                ": main v3 := 2")
+        self.assertSameAssembly(": buzzer ; : main buzzer",
+                                ": sub ; : main sub")
+        self.assertSameAssembly(":const exit 7 : main exit",
+                                ": main 7")
+        self.assertSameAssembly(":calc exit { 3 + 4 } : main exit",
+                                ": main 7")
+        # Until it's defined, a statement is still a statement.
+        self.assertSameAssembly(": main clear :macro clear { v0 := 1 } clear",
+                                ": main clear v0 := 1")
+
+    def test_predefined_consts(self):
+        program = assemble(io.StringIO(": main exit"), consts={"exit": 5})
+        self.assertEqual(program.program, b"\x05")
+
+    def test_incremental_shadowing(self):
+        # Regions after one that starts or stops shadowing a statement are
+        # parsed again.
+        text = ": early\n  v1 := 2\n: main\n  clear\n"
+        edited = ": early\n  v1 := 2\n  :macro clear { v0 := 1 }\n: main\n  clear\n"
+        assembler = IncrementalAssembler()
+        for source in (text, edited, text):
+            with self.subTest(source):
+                self.assertEqual(assembler.assemble(source).program, assembled(source).program)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+from octopy.symbols import symbol_table
+
+from helpers import testsources
+
+def pruned(text, keep=()):
+    program = assemble(io.StringIO(text), prune=True, keep=keep)
+    if program.error is not None:
+        raise program.error
+    return program
+
+LIBRARY = """
+: unused-sub
+    v0 := 1
+    ;
+: unused-sprite
+    0x18 0x18
+: used-sub
+    i := ball
+    sprite v0 v1 5
+    ;
+: ball
+    0x70 0xF8 0xF8 0xF8 0x70
+: digits-sub
+    i := digits
+    i += v2
+    ;
+: digits
+    1 2 3
+: digit-four
+    4
+: main
+    used-sub
+    digits-sub
+    jump main
+"""
+
+class TestPrune(unittest.TestCase):
+    def test_library(self):
+        program = pruned(LIBRARY)
+        report = program.pruning
+        self.assertEqual([labels for (_, _, labels) in report.removed],
+                         [("unused-sub",), ("unused-sprite",)])
+        self.assertEqual(report.bytes, 6)
+        self.assertEqual(set(report.dropped), {"unused-sub", "unused-sprite"})
+        self.assertNotIn("unused-sub", program.labels)
+        # Read past the label it's found by, digits keeps digit-four.
+        self.assertIn("digit-four", program.labels)
+        expected = assemble(io.StringIO(LIBRARY.replace(
+            ": unused-sub\n    v0 := 1\n    ;\n: unused-sprite\n    0x18 0x18", "")))
+        self.assertEqual(program.program, expected.program)
+        self.assertEqual(program.labels["main"], expected.labels["main"])
+
+    def test_symbols(self):
+        symbols = symbol_table(pruned(LIBRARY))
+        self.assertNotIn("unused-sub", symbols["labels"])
+        self.assertNotIn("unused-sub", symbols["consts"])
+
+    def test_keep(self):
+        program = pruned(LIBRARY, keep=("unused-sub",))
+        self.assertIn("unused-sub", program.labels)
+        # Kept as data, it keeps what's after it up to the next code label.
+        self.assertIn("unused-sprite", program.labels)
+
+    def test_jump0_table(self):
+        program = pruned("""
+            : main
+                jump0 table
+            : table
+                jump a
+                jump b
+            : a
+                jump main
+            : b
+                jump main
+            : c
+                jump main
+        """)
+        self.assertEqual(list(program.pruning.dropped), ["c"])
+
+    def test_numeric_address(self):
+        program = pruned(": main jump 0x204 : unused 0 0 : there jump main")
+        self.assertEqual(program.pruning.removed, [])
+        self.assertIn("numeric", program.pruning.notes[0])
+
+    def test_expressions(self):
+        program = pruned("""
+            : main
+                i := size
+                load v0
+                jump main
+            : dead
+                0 0
+            : size
+                :byte { table-end - table }
+            : table
+                1 2 3
+            : table-end
+        """)
+        self.assertEqual(list(program.pruning.dropped), ["dead"])
+        self.assertEqual(program.labels["size"], 0x206)
+        self.assertEqual(program.program[6:], b"\x03\x01\x02\x03")
+
+    def test_deferred_calc(self):
+        # X is worked out once the program is resolved, from where tbl is
+        # after dead is taken out.
+        program = pruned("""
+            : main
+                :calc X { tbl + 1 }
+                i := X
+                load v0
+                ;
+            : dead
+                ;
+            : tbl
+                1 2
+        """)
+        self.assertEqual(list(program.pruning.dropped), ["dead"])
+        self.assertEqual(program.labels["tbl"], 0x206)
+        self.assertEqual(program.consts["tbl"], 0x206)
+        self.assertEqual(program.program, bytes.fromhex("a207f06500ee0102"))
+
+    def test_everything_assembles(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                expected = assemble(io.StringIO(text))
+                if expected.error is not None:
+                    continue
+                program = assemble(io.StringIO(text), prune=True)
+                self.assertIsNone(program.error)
+                if not program.pruning.removed:
+                    self.assertEqual(program.program, expected.program)
+
+if __name__ == '__main__':
+    unittest.main()
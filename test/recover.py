@@ -0,0 +1,102 @@
+import io
+import unittest
+
+from octopy.assemble import assemble
+
+from helpers import testsources
+
+def recovered(text, **kwargs):
+    return assemble(io.StringIO(text), recover=True, **kwargs)
+
+def located(program):
+    """(line, message) of each error, at the token where it went wrong."""
+    located = []
+    for error in program.errors:
+        while error.__cause__ is not None:
+            error = error.__cause__
+        located.append((error.token.line, error.msg))
+    return located
+
+BROKEN = """
+: main
+    v0 := 5
+    v1 += bogus stuff
+    i := data
+    v2 := 300
+    frob
+    jump nowhere
+    frob
+: data
+    0x12 0x34
+"""
+
+class TestRecover(unittest.TestCase):
+    def test_all_errors(self):
+        program = recovered(BROKEN)
+        self.assertEqual(located(program), [
+            (4, "Unknown operand"),
+            (6, "number 300 out of range [-127, 255]"),
+            (7, "Unresolved name"),
+            (8, "Unresolved name"),
+        ])
+        self.assertIs(program.error, program.errors[0])
+
+    def test_placeholders(self):
+        # Each statement that failed leaves two bytes, so data is where it
+        # would have been, and the code around it is still filled in.
+        program = recovered(BROKEN)
+        self.assertEqual(program.labels["data"], 0x200 + 7 * 2)
+        rom = program.program
+        self.assertEqual(rom[0:2], b"\x60\x05")
+        self.assertEqual(rom[2:4], b"\x00\x00")
+        self.assertEqual(rom[4:6], b"\xA2\x0E")
+        self.assertEqual(rom[14:16], b"\x12\x34")
+
+    def test_without_recover(self):
+        program = assemble(io.StringIO(BROKEN))
+        self.assertEqual(len(program.errors), 1)
+        self.assertEqual(program.error.token.line, 4)
+
+    def test_skips_braces(self):
+        program = recovered("""
+            : main
+                :calc x { 1 + }
+                :const y {
+                    : inside
+                    3
+                }
+                v2 := 3
+                : later
+        """)
+        self.assertEqual([line for (line, _) in located(program)], [3, 4])
+        self.assertNotIn("inside", program.labels)
+        self.assertEqual(program.labels["later"], 0x202)
+        self.assertEqual(program.program, b"\x62\x03")
+
+    def test_in_macros(self):
+        program = recovered("""
+            :macro set r n {
+                r := n
+            }
+            : main
+                set v0 1
+                set v1 bogus
+                set v2 3
+                undefined-label
+        """)
+        self.assertEqual([message for (_, message) in located(program)][-1], "Unresolved name")
+        self.assertEqual(len(program.errors), 2)
+        self.assertEqual(program.program[0:2], b"\x60\x01")
+
+    def test_unchanged_without_errors(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                expected = assemble(io.StringIO(text))
+                program = recovered(text)
+                self.assertEqual(program.errors, [])
+                self.assertIsNone(program.error)
+                self.assertEqual(program.program, expected.program)
+                self.assertEqual(program.labels, expected.labels)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import io
+import unittest
+
+import octopy.run
+from octopy.assemble import assemble
+from octopy.run import Machine, MachineError, Quirks, run
+
+def assembled(text, **kwargs):
+    program = assemble(io.StringIO(text), **kwargs)
+    if program.error is not None:
+        raise program.error
+    return program
+
+def ran(text, frames=10, **kwargs):
+    return run(assembled(text), frames, **kwargs)
+
+SPRITES = """
+: main
+    i := box
+    v0 := 2
+    v1 := 3
+    sprite v0 v1 3
+    v0 := 4
+    sprite v0 v1 3
+    v2 := vf
+    v0 := 62
+    v1 := 31
+    sprite v0 v1 3
+    exit
+: box
+    0xF0 0x90 0xF0
+"""
+
+class TestRun(unittest.TestCase):
+    def test_arithmetic(self):
+        program = assembled("""
+            : main
+                v0 := 200
+                v1 := 100
+                v0 += v1
+                v2 := vf
+                v3 := 5
+                v3 -= v1
+                v4 := vf
+                v5 := 3
+                v5 <<= v5
+                i := result
+                v6 := 123
+                bcd v6
+                load v2
+                exit
+            : result
+                0 0 0
+        """)
+        machine = run(program, 10)
+        self.assertTrue(machine.halted)
+        self.assertEqual(machine.v[:6], [1, 2, 3, 161, 0, 6])
+        self.assertEqual(machine.i, program.labels["result"] + 3)
+
+    def test_calls_and_profile(self):
+        program = assembled("""
+            : main
+                loop
+                    work
+                    v0 += 1
+                    if v0 == 10 then exit
+                again
+            : work
+                v1 := 1
+                v2 := 2
+                ;
+        """)
+        machine = run(program, 10)
+        self.assertEqual(machine.v[0], 10)
+        profile = dict(machine.profile())
+        # Each of the ten times round: call, add, skip, and jump (or exit),
+        # and three in work.
+        self.assertEqual(profile, {"main": 40, "work": 30})
+        self.assertEqual(machine.cycles, 70)
+
+    def test_frames_and_timers(self):
+        machine = ran("""
+            : main
+                v0 := 10
+                delay := v0
+                loop
+                    v1 := delay
+                    if v1 != 0 then
+                again
+                exit
+        """, frames=100)
+        self.assertTrue(machine.halted)
+        # Counted down at the end of each frame, it's 0 on the eleventh.
+        self.assertEqual(machine.frame, 11)
+
+    def test_sprites(self):
+        machine = ran(SPRITES)
+        screen = machine.screen()
+        self.assertEqual(len(screen), 32)
+        self.assertEqual(len(screen[0]), 64)
+        self.assertEqual(screen[3][2:10], [1, 1, 0, 0, 1, 1, 0, 0])
+        self.assertEqual(screen[4][2:10], [1, 0, 1, 1, 0, 1, 0, 0])
+        self.assertEqual(machine.v[2], 1)
+        # Clipped at the edges.
+        self.assertEqual(screen[31][60:], [0, 0, 1, 1])
+        self.assertEqual(screen[0][:4], [0, 0, 0, 0])
+
+    def test_sprites_wrap(self):
+        screen = ran(SPRITES, quirks=Quirks(clip=False)).screen()
+        self.assertEqual(screen[31][62:], [1, 1])
+        self.assertEqual(screen[0][:2], [0, 1])
+        self.assertEqual(screen[0][62:], [1, 0])
+
+    def test_without_numpy(self):
+        for quirks in (Quirks(), Quirks(clip=False)):
+            expected = ran(SPRITES, quirks=quirks).screen()
+            saved, octopy.run.numpy = octopy.run.numpy, None
+            try:
+                self.assertEqual(ran(SPRITES, quirks=quirks).screen(), expected)
+            finally:
+                octopy.run.numpy = saved
+
+    def test_keys(self):
+        program = assembled("""
+            : main
+                loop
+                    v0 := 5
+                    if v0 key then v1 += 1
+                    v2 := key
+                    v3 += 1
+                again
+        """)
+        machine = run(program, 20, keys={5: [5], 8: []})
+        # Waits for a key until frame 5, and again once it's let go.
+        self.assertEqual(machine.v[2], 5)
+        self.assertGreater(machine.v[1], 0)
+        self.assertGreater(machine.v[3], 0)
+        self.assertTrue(machine.waiting)
+        counted = []
+        machine = run(program, 3, keys=lambda frame: counted.append(frame) or {1})
+        self.assertEqual(counted, [0, 1, 2])
+        self.assertEqual(machine.v[2], 1)
+
+    def test_self_modifying(self):
+        program = assembled("""
+            : main
+                v1 := 0
+                loop
+                    v1 += 1
+                    patch
+                    i := patch
+                    v3 := 0x62
+                    v4 := 7
+                    save v3 - v4
+                    if v1 != 2 then
+                again
+                exit
+            : patch
+                v2 := 3
+                ;
+        """)
+        machine = run(program, 10)
+        # The second time round, patch loads 7.
+        self.assertEqual(machine.v[2], 7)
+        patch = program.labels["patch"]
+        self.assertEqual(machine.memory[patch:patch+2], b"\x62\x07")
+
+    def test_long_and_hires(self):
+        machine = ran("""
+            : main
+                hires
+                i := long far
+                load v0
+                v1 := 127
+                v2 := 63
+                sprite v1 v2 1
+                exit
+            :org 0x1234
+            : far
+                0x42
+        """)
+        self.assertEqual(machine.v[0], 0x42)
+        screen = machine.screen()
+        self.assertEqual((len(screen), len(screen[0])), (64, 128))
+        self.assertEqual(screen[63][127], 0)
+
+    def test_errors(self):
+        with self.assertRaises(MachineError):
+            ran(": main ;")
+        with self.assertRaises(MachineError):
+            ran(": main main")
+        # Ops that only some values of their last digits are.
+        for op in (0x5011, 0x8008, 0x9011, 0xE0FF, 0xF003, 0xF1FF, 0x00B0):
+            with self.subTest("{:04X}".format(op)):
+                with self.assertRaisesRegex(MachineError, "unknown instruction"):
+                    Machine(op.to_bytes(2, "big")).run(1)
+
+    def test_skips(self):
+        machine = ran("""
+            : main
+                v0 := 3
+                v1 := 3
+                if v0 != v1 then v2 := 1
+                if v0 == v1 then v3 := 1
+                if v0 != 3 then v4 := 1
+                if v0 == 4 then v5 := 1
+                exit
+        """)
+        self.assertEqual(machine.v[2:6], [0, 1, 0, 0])
+
+    def test_optimized_runs_the_same(self):
+        text = """
+            : main
+                v0 := 0
+                loop
+                    count
+                    if v0 == 50 then exit
+                again
+            : count
+                if v0 == 200 begin
+                else
+                end
+                v0 += 1
+                double
+                ;
+            : double
+                v1 := v0
+                v1 += v0
+                ;
+        """
+        expected = Machine(assembled(text).program)
+        expected.run(100)
+        machine = Machine(assembled(text, optimize=True).program)
+        machine.run(100)
+        self.assertTrue(machine.halted)
+        self.assertEqual(machine.v, expected.v)
+        self.assertLess(machine.cycles, expected.cycles)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import io
+import random
+import unittest
+
+from octopy.assemble import assemble
+from octopy.program import Program
+
+def flat(writes):
+    """The ROM image the writes make, as (address, data) pairs, in order."""
+    image = bytearray()
+    for address, data in writes:
+        offset = address - 0x200
+        if data and len(image) < offset + len(data):
+            image.extend(bytes(offset + len(data) - len(image)))
+        image[offset:offset + len(data)] = data
+    return image
+
+def written(writes):
+    program = Program()
+    for address, data in writes:
+        program.org(address)
+        for byte in data:
+            program.emit_byte(byte)
+    return program
+
+class TestSegments(unittest.TestCase):
+    def test_far_org(self):
+        program = assemble(io.StringIO("""
+            : main
+                i := long data
+                load v3
+                jump main
+            :org 0xF000
+            : data
+                1 2 3 4
+        """))
+        self.assertIsNone(program.error)
+        self.assertEqual(program.segments(), [
+            (0x200, b"\xf0\x00\xf0\x00\xf3\x65\x12\x00"),
+            (0xF000, b"\x01\x02\x03\x04"),
+        ])
+        self.assertEqual(program.size(), 0xF004 - 0x200)
+        image = program.program
+        self.assertEqual(len(image), program.size())
+        self.assertEqual(image[0xF000 - 0x200:], b"\x01\x02\x03\x04")
+        self.assertEqual(image[8:0xF000 - 0x200], bytes(0xF000 - 0x208))
+        self.assertEqual(program.lookup(0x1000), 0)
+        self.assertEqual(program.lookup(0xF002), 3)
+
+    def test_fixups_across_segments(self):
+        program = assemble(io.StringIO("""
+            : main
+                far
+                jump main
+            :org 0xF00
+            : far
+                v0 := 1
+                if v0 == 1 begin
+                    later
+                end
+                return
+            :org 0xA00
+            : later
+                :unpack 0xA far
+                return
+        """))
+        self.assertIsNone(program.error)
+        segments = dict(program.segments())
+        self.assertEqual(segments[0x200], b"\x2f\x00\x12\x00")
+        self.assertEqual(segments[0xF00], b"\x60\x01\x30\x01\x1f\x08\x2a\x00\x00\xee")
+        self.assertEqual(segments[0xA00], b"\x60\xaf\x61\x00\x00\xee")
+
+    def test_overlapping(self):
+        writes = [(0x300, b"\x11" * 16), (0x280, b"\x22" * 8),
+                  (0x2F8, b"\x33" * 12), (0x200, b"\x44" * 4)]
+        program = written(writes)
+        self.assertEqual(program.program, flat(writes))
+        self.assertEqual(program.segments(), [
+            (0x200, b"\x44" * 4),
+            (0x280, b"\x22" * 8),
+            (0x2F8, b"\x33" * 12 + b"\x11" * 12),
+        ])
+
+    def test_random_writes(self):
+        rng = random.Random(17)
+        for _ in range(200):
+            writes = []
+            for _ in range(rng.randrange(1, 8)):
+                address = 0x200 + rng.randrange(0, 0x400)
+                data = bytes(rng.randrange(256) for _ in range(rng.randrange(0, 48)))
+                writes.append((address, data))
+            program = written(writes)
+            image = flat(writes)
+            self.assertEqual(program.program, image, writes)
+            for address, data in program.segments():
+                self.assertEqual(image[address - 0x200:address - 0x200 + len(data)], data)
+            if image:
+                address = 0x200 + rng.randrange(len(image))
+                self.assertEqual(program.lookup(address), image[address - 0x200])
+
+    def test_below_0x200(self):
+        program = Program()
+        program.org(0x100)
+        program.org(0x200)
+        program.emit_byte(1)
+        program.org(0x100)
+        with self.assertRaises(Exception):
+            program.emit_byte(2)
+        self.assertEqual(program.segments(), [(0x200, b"\x01")])
+
+if __name__ == '__main__':
+    unittest.main()
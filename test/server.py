@@ -0,0 +1,128 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from octopy.server import Assembler, Server, rebuild, request, watch
+
+class Polls():
+    """
+    Stands in for watch()'s stop event: runs each step between polls, and
+    stops after the poll following the last one.
+    """
+    def __init__(self, *steps):
+        self.steps = steps
+        self.polls = 0
+
+    def is_set(self):
+        return self.polls > len(self.steps)
+
+    def wait(self, _):
+        if self.polls < len(self.steps):
+            self.steps[self.polls]()
+        self.polls += 1
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_cache(self):
+        assembler = Assembler()
+        result, program, _ = assembler.assemble_source(": main v0 := 1")
+        self.assertFalse(result["cached"])
+        self.assertEqual(base64.b64decode(result["rom"]), b"\x60\x01")
+        self.assertEqual(result["symbols"]["labels"]["main"], 0x200)
+        again, cached, _ = assembler.assemble_source(": main v0 := 1")
+        self.assertTrue(again["cached"])
+        self.assertIs(cached, program)
+        failed, _, _ = assembler.assemble_source(": main v0 := nope")
+        self.assertIsNotNone(failed["error"])
+        self.assertIsNone(failed["symbols"])
+        self.assertEqual((assembler.requests, assembler.hits), (3, 1))
+
+    def test_included_files(self):
+        path = self.write("main.8o", ": main\n  :include lib.8o\n")
+        self.write("lib.8o", "v2 := 4\n")
+        assembler = Assembler()
+        self.assertEqual(assembler.assemble_path(path)[1].program, b"\x62\x04")
+        self.assertTrue(assembler.assemble_path(path)[0]["cached"])
+        self.write("lib.8o", "v2 := 9\n")
+        result, program, files = assembler.assemble_path(path)
+        self.assertFalse(result["cached"])
+        self.assertEqual(program.program, b"\x62\x09")
+        self.assertIn(os.path.realpath(os.path.join(self.directory, "lib.8o")), files)
+
+    def test_text_includes(self):
+        self.write("lib.8o", "v2 := 4\n")
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+        result, _, files = Assembler().assemble_source(": main\n  :include lib.8o\n")
+        self.assertIn("can't include files", result["error"])
+        self.assertEqual(files, {})
+
+    def test_watch(self):
+        self.write("main.8o", ": main\n  :include lib.8o\n")
+        self.write("lib.8o", "v2 := 4\n")
+        log = io.StringIO()
+        watch(self.directory, Assembler(), 0, Polls(lambda: self.write("lib.8o", "v2 := 19\n")),
+              log)
+        with open(os.path.join(self.directory, "main.ch8"), "rb") as f:
+            self.assertEqual(f.read(), b"\x62\x13")
+        # Only ever included, so not a program.
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "lib.ch8")))
+        self.assertEqual(log.getvalue().count("main.8o: rebuilt"), 2)
+        self.assertNotIn("lib.8o", log.getvalue())
+
+    def test_rebuild(self):
+        path = self.write("game.8o", ": main v0 := 1")
+        assembler = Assembler()
+        log = io.StringIO()
+        rebuild(path, assembler, log)
+        rom = os.path.join(self.directory, "game.ch8")
+        with open(rom, "rb") as f:
+            self.assertEqual(f.read(), b"\x60\x01")
+        for name in ("game.ch8", "game.sym", "game.symx"):
+            os.unlink(os.path.join(self.directory, name))
+        # A source back to a version already built is written out again.
+        rebuild(path, assembler, log)
+        with open(rom, "rb") as f:
+            self.assertEqual(f.read(), b"\x60\x01")
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "game.symx")))
+        self.write("game.8o", ": main v0 := nope")
+        rebuild(path, assembler, log)
+        self.assertIn("assembly failed", log.getvalue())
+
+    def test_protocol(self):
+        socket_path = os.path.join(self.directory, "octopy.sock")
+        server = Server(socket_path, Assembler())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            path = self.write("game.8o", ": main v0 := 2")
+            response = request({"op": "assemble", "path": path}, socket_path)
+            self.assertEqual(base64.b64decode(response["rom"]), b"\x60\x02")
+            response = request({"source": ": main v0 := 2"}, socket_path)
+            self.assertFalse(response["cached"])
+            self.assertEqual(request({"op": "stats"}, socket_path)["requests"], 2)
+            self.assertIn("needs a path", request({"op": "assemble"}, socket_path)["error"])
+            self.assertIn("unknown op", request({"op": "frob"}, socket_path)["error"])
+            self.assertIn("must be a string", request({"path": 5}, socket_path)["error"])
+            self.assertEqual(request({"op": "shutdown"}, socket_path), {"shutdown": True})
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
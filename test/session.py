@@ -0,0 +1,57 @@
+import io
+import pathlib
+import unittest
+
+from octopy.assemble import assemble
+from octopy.session import AssemblerSession
+from octopy.symbols import symbol_table
+from octopy.tokenizer import CONSTS, REGISTERS
+
+from helpers import testpaths
+
+class TestSession(unittest.TestCase):
+    def test_matches_assemble(self):
+        session = AssemblerSession()
+        for name, path in testpaths():
+            with self.subTest(name):
+                with open(path) as src:
+                    text = src.read()
+                program = assemble(io.StringIO(text))
+                for source in (text, text.encode(), pathlib.Path(path)):
+                    result = session.assemble(source)
+                    self.assertIsNone(result.error)
+                    self.assertEqual(result.rom, bytes(program.program))
+                    self.assertEqual(result.symbols, symbol_table(program))
+
+    def test_sources_are_separate(self):
+        session = AssemblerSession()
+        first = session.assemble(":const SPEED 3\n:alias x v4\n: main x := SPEED")
+        self.assertEqual(first.rom, b"\x64\x03")
+        self.assertEqual(first.symbols["consts"]["SPEED"], 3)
+
+        second = session.assemble(": main x := SPEED")
+        self.assertIsNotNone(second.error)
+        self.assertIsNone(second.symbols)
+        self.assertNotIn("SPEED", CONSTS)
+        self.assertNotIn("x", REGISTERS)
+        self.assertEqual(session.assemblies, 2)
+
+    def test_predefined(self):
+        session = AssemblerSession(consts={"SPEED": 7}, registers={"x": 4})
+        self.assertEqual(session.assemble(": main x := SPEED").rom, b"\x64\x07")
+        self.assertEqual(session.assemble(": main x := OCTO_KEY_W").rom, b"\x64\x05")
+
+    def test_error(self):
+        result = AssemblerSession().assemble(b": main jump nowhere")
+        self.assertIsNotNone(result.error)
+        self.assertIn("nowhere", str(result.error))
+
+    def test_no_includes(self):
+        # Even with a file of the name in the working directory.
+        for source in (":include Makefile\n: main ;", b":include Makefile\n: main ;"):
+            result = AssemblerSession().assemble(source)
+            self.assertIn("can't include Makefile: sources given as text can't include files",
+                          str(result.error))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import io
+import os
+import tempfile
+import unittest
+
+from octopy.assemble import assemble, assemble_file
+from octopy.sourcemap import HEADER, Call, Location, SourceMapFile, write_source_map
+
+from helpers import testpaths
+
+MACROS = """:macro inc R {
+    R += 1
+}
+:macro twice R {
+    inc R
+    inc R
+}
+: main
+    v0 := 1
+    twice v1
+    jump main
+"""
+
+class TestSourceMap(unittest.TestCase):
+    def mapped(self, program):
+        fd, path = tempfile.mkstemp(suffix=".map")
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, "wb") as fout:
+            write_source_map(program, fout)
+        source_map = SourceMapFile(path)
+        self.addCleanup(source_map.close)
+        return source_map
+
+    def test_macros(self):
+        program = assemble(io.StringIO(MACROS), source_map="game.8o")
+        source_map = self.mapped(program)
+        self.assertEqual(source_map.lookup(0x200), Location("game.8o", 9, ()))
+        twice = Call("twice", "game.8o", 10)
+        self.assertEqual(source_map.lookup(0x202),
+                         Location("game.8o", 2, (Call("inc", "game.8o", 5), twice)))
+        self.assertEqual(source_map.lookup(0x205),
+                         Location("game.8o", 2, (Call("inc", "game.8o", 6), twice)))
+        self.assertEqual(source_map.line(0x206), ("game.8o", 11))
+        self.assertIsNone(source_map.lookup(0x208))
+        self.assertIsNone(source_map.lookup(0x100))
+        # The same code, with the map or without.
+        self.assertEqual(program.program, assemble(io.StringIO(MACROS)).program)
+
+    def test_org(self):
+        program = assemble(io.StringIO("""
+            : main
+                jump later
+            :org 0x300
+            : later
+                v0 := 1
+                jump main
+            :org 0x202
+                v1 := 2
+        """), source_map="org.8o")
+        source_map = self.mapped(program)
+        self.assertEqual(source_map.line(0x200), ("org.8o", 3))
+        self.assertEqual(source_map.line(0x202), ("org.8o", 9))
+        self.assertIsNone(source_map.line(0x204))
+        self.assertEqual(source_map.line(0x300), ("org.8o", 6))
+        self.assertEqual(source_map.line(0x302), ("org.8o", 7))
+
+    def test_optimized(self):
+        text = """
+            : main
+                if v0 == 1 begin
+                end
+                v1 := 2
+                jump main
+        """
+        program = assemble(io.StringIO(text), optimize=True, source_map="o.8o")
+        # The skip and the jump past nothing are taken out.
+        self.assertEqual(program.report.removed, 4)
+        source_map = self.mapped(program)
+        self.assertEqual(source_map.line(0x200), ("o.8o", 5))
+        self.assertEqual(source_map.line(0x202), ("o.8o", 6))
+        self.assertIsNone(source_map.line(0x204))
+
+    def test_everything_mapped(self):
+        for name, path in testpaths():
+            with self.subTest(name):
+                program = assemble_file(path, source_map=True)
+                if program.error is not None:
+                    continue
+                with open(path) as f:
+                    lines = len(f.readlines())
+                source_map = self.mapped(program)
+                for address, data in program.segments():
+                    for n in range(len(data)):
+                        location = source_map.lookup(address + n)
+                        self.assertIsNotNone(location)
+                        self.assertEqual(location.file, path)
+                        self.assertTrue(1 <= location.line <= lines)
+
+    def test_bad_header(self):
+        program = assemble(io.StringIO(MACROS), source_map="game.8o")
+        fd, path = tempfile.mkstemp(suffix=".map")
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, "wb") as fout:
+            write_source_map(program, fout)
+        with open(path, "r+b") as f:
+            fields = list(HEADER.unpack(f.read(HEADER.size)))
+            # More files than there are strings.
+            fields[5] = fields[6] + 1
+            f.seek(0)
+            f.write(HEADER.pack(*fields))
+        with self.assertRaisesRegex(ValueError, "more files"):
+            SourceMapFile(path)
+
+if __name__ == '__main__':
+    unittest.main()
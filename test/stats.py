@@ -0,0 +1,117 @@
+import io
+import json
+import unittest
+
+from octopy.assemble import assemble
+from octopy.program import UNPACK
+from octopy.stats import FIXUPS, PHASES, Hooks, Stats
+
+from helpers import testsources
+
+def collect(text):
+    stats = Stats()
+    program = assemble(io.StringIO(text), hooks=stats)
+    return program, stats
+
+class TestStats(unittest.TestCase):
+    def test_same_assembly(self):
+        for name, text in testsources():
+            with self.subTest(name):
+                program, stats = collect(text)
+                plain = assemble(io.StringIO(text))
+                self.assertEqual(program.program, plain.program)
+                self.assertEqual(program.labels, plain.labels)
+                self.assertEqual(str(program.error), str(plain.error))
+                self.assertEqual(stats.bytes, len(plain.program))
+                unpacks = sum(1 for (_, _, how) in plain.fixups.since(0) if how == UNPACK)
+                self.assertEqual(stats.fixups["jumpsandcalls"], len(plain.fixups) - unpacks)
+                self.assertEqual(stats.fixups["unpacks"], unpacks)
+
+    def test_statements(self):
+        _, stats = collect("""
+            : main
+                v0 := 1
+                if v0 == 1 then v1 := 2
+                loop
+                    while v0 != 3
+                    v0 += 1
+                again
+                if v0 == 3 begin clear else sub end
+                :next target i := 0x123
+                0x12 0x34
+                scroll_down 2
+            : sub ;
+        """)
+        self.assertEqual(stats.statements, {
+            "label": 2, "register": 3, "if": 2, "loop": 1, "while": 1, "again": 1,
+            "clear": 1, "else": 1, "call": 1, "end": 1, "next": 1, "i": 1, "data": 2,
+            "scroll-down": 1, "return": 1})
+        self.assertEqual(stats.fixups, {"jumpsandcalls": 1, "unpacks": 0, "begins": 2, "whiles": 1})
+
+    def test_macros(self):
+        _, stats = collect("""
+            :macro twice X { X += 1 X += 1 }
+            :macro draw { twice v2 sprite v0 v1 5 }
+            : main
+                draw draw draw
+                twice v3
+        """)
+        self.assertEqual(stats.expansions, {"twice": 4, "draw": 3})
+        self.assertEqual(stats.statements["expansion"], 7)
+        self.assertEqual(stats.statements["macro"], 2)
+        self.assertEqual(stats.statements["sprite"], 3)
+        # The expansions of twice v2 inside the second and third draw are
+        # replayed, without making its tokens or parsing its statements
+        # again.
+        self.assertEqual(stats.macro_tokens, {"twice": 12, "draw": 18})
+        self.assertEqual(stats.statements["register"], 4)
+        self.assertGreater(stats.phases["macro"], 0)
+
+    def test_passes(self):
+        # far is only known once the first pass is over, so the source is
+        # assembled twice, and only the second pass is counted.
+        _, stats = collect("""
+            : main
+                v0 := 1
+                jump far
+            :org { far - 4 }
+            : near
+                v1 := 2
+            :org 0x300
+            : far
+                jump main
+        """)
+        self.assertEqual(stats.statements, {"label": 3, "register": 2, "jump": 2, "org": 2})
+        self.assertEqual(stats.fixups["jumpsandcalls"], 1)
+        self.assertEqual(stats.bytes, 0x102)
+
+    def test_phases(self):
+        _, stats = collect("""
+            : main
+                :calc size { 4 * 8 + HERE }
+                :byte { size & 0xFF }
+                jump main
+        """)
+        self.assertEqual(set(stats.phases), set(PHASES))
+        for phase in ("tokenize", "parse", "calc", "resolve"):
+            self.assertGreater(stats.phases[phase], 0, phase)
+
+    def test_report(self):
+        _, stats = collect(": main jump later : later ;")
+        report = json.loads(json.dumps(stats.as_dict()))
+        self.assertEqual(report["bytes"], 4)
+        self.assertEqual(report["fixups"]["jumpsandcalls"], 1)
+        self.assertEqual(set(report["fixups"]), set(FIXUPS))
+        self.assertIn("jumpsandcalls", stats.table())
+
+    def test_hooks(self):
+        events = []
+        class Recorder(Hooks):
+            def fixup(self, kind):
+                events.append(kind)
+        program = assemble(io.StringIO(": main jump sub : sub ; :unpack 1 sub"), hooks=Recorder())
+        self.assertIsNone(program.error)
+        self.assertEqual(events, ["jumpsandcalls", "unpacks"])
+
+if __name__ == '__main__':
+    unittest.main()
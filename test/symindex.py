@@ -0,0 +1,114 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import octopy.symindex
+from octopy.assemble import assemble
+from octopy.symbols import symbol_table
+from octopy.symindex import SymbolIndex, builtin, write_symbol_index
+
+from helpers import testsources
+
+SOURCE = """
+:const lives 3
+: main
+    :breakpoint start
+    draw
+    jump main
+: draw
+    i := ball
+    :breakpoint drawing
+    sprite v0 v1 4
+    ;
+: ball
+    0x60 0xF0 0xF0 0x60
+:monitor ball 4
+: über
+    0
+"""
+
+class TestSymbolIndex(unittest.TestCase):
+    def index(self, program):
+        fd, path = tempfile.mkstemp(suffix=".symx")
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, "wb") as fout:
+            write_symbol_index(program, fout)
+        index = SymbolIndex(path)
+        self.addCleanup(index.close)
+        return index
+
+    def test_same_symbols(self):
+        program = assemble(io.StringIO(SOURCE))
+        index = self.index(program)
+        table = symbol_table(program)
+        self.assertEqual(index.labels, table["labels"])
+        self.assertEqual(index.breakpoints, table["breakpoints"])
+        self.assertEqual([list(monitor) for monitor in index.monitors], table["monitors"])
+        # Less the predefined ones.
+        consts = table["consts"]
+        self.assertIn("OCTO_KEY_A", consts)
+        self.assertEqual(index.consts, {name: value for (name, value) in consts.items()
+                                        if not builtin(name, value)})
+        self.assertEqual(index.consts["lives"], 3)
+
+    def test_lookups(self):
+        program = assemble(io.StringIO(SOURCE))
+        index = self.index(program)
+        draw = program.labels["draw"]
+        self.assertEqual(index.label_at(draw), ("draw", 0))
+        self.assertEqual(index.label_at(draw + 3), ("draw", 3))
+        self.assertIsNone(index.label_at(0x100))
+        self.assertEqual(index.address("über"), program.labels["über"])
+        self.assertEqual(index.address("main"), 0x200)
+        self.assertEqual(index.const("lives"), 3)
+        with self.assertRaises(KeyError):
+            index.address("missing")
+        with self.assertRaises(KeyError):
+            index.const("OCTO_KEY_A")
+
+    def test_labels_at(self):
+        program = assemble(io.StringIO(SOURCE))
+        index = self.index(program)
+        addresses = [0x100, 0x200, 0x205, program.labels["ball"] + 1]
+        expected = [-1, 0, 1, 2]
+        self.assertEqual(list(index.labels_at(addresses)), expected)
+        saved, octopy.symindex.numpy = octopy.symindex.numpy, None
+        try:
+            self.assertEqual(index.labels_at(addresses), expected)
+        finally:
+            octopy.symindex.numpy = saved
+        self.assertEqual([index.name(n) for n in expected[1:]], ["main", "draw", "ball"])
+
+    def test_everything(self):
+        rng = random.Random(8)
+        for name, text in testsources():
+            program = assemble(io.StringIO(text))
+            if program.error is not None:
+                continue
+            with self.subTest(name):
+                index = self.index(program)
+                self.assertEqual(index.labels, program.labels)
+                for name, pc in program.labels.items():
+                    self.assertEqual(index.address(name), pc)
+                ordered = sorted(program.labels.values())
+                for _ in range(50):
+                    address = rng.randrange(0x1F0, 0x200 + len(program.program) + 16)
+                    found = index.label_at(address)
+                    before = [pc for pc in ordered if pc <= address]
+                    if not before:
+                        self.assertIsNone(found)
+                    else:
+                        self.assertEqual(address - found[1], before[-1])
+
+    def test_not_an_index(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(b"main = 0x0200\n" * 4)
+        with self.assertRaises(ValueError):
+            SymbolIndex(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import tempfile
+import unittest
+
+import octopy.tokenizer
+from octopy.assemble import assemble_file
+from octopy.tokenizer import Tokenizer, Token, Kind, tokenize, tokenize_bytes
+
+from helpers import testpaths
+
+class TestTokenizer(unittest.TestCase):
+    def kinds(self, line):
+        return [(t.text, t.kind, t.value) for t in tokenize([line])]
+
+    def test_numbers(self):
+        self.assertEqual(self.kinds("0x1F 0b101 010 -3 12"), [
+            ("0x1F", Kind.NUMBER, 31),
+            ("0b101", Kind.NUMBER, 5),
+            ("010", Kind.NUMBER, 10),
+            ("-3", Kind.NUMBER, -3),
+            ("12", Kind.NUMBER, 12),
+        ])
+
+    def test_registers(self):
+        self.assertEqual(self.kinds("va vA v0"), [
+            ("va", Kind.REGISTER, 10),
+            ("vA", Kind.REGISTER, 10),
+            ("v0", Kind.REGISTER, 0),
+        ])
+
+    def test_keywords_operators_idents(self):
+        self.assertEqual([t.kind for t in tokenize([":const foo := { 0x1x scroll-down # x"])], [
+            Kind.KEYWORD, Kind.IDENT, Kind.OPERATOR, Kind.OPERATOR, Kind.IDENT, Kind.KEYWORD,
+        ])
+
+    def test_consts_before_literals(self):
+        tokenizer = Tokenizer(["speed 7"])
+        tokenizer.add_const("speed", 3)
+        self.assertEqual(tokenizer.advance(tokenizer.parse_number), 3)
+        self.assertEqual(tokenizer.advance(tokenizer.parse_number), 7)
+
+    def test_untagged_tokens(self):
+        tokenizer = Tokenizer("")
+        tokenizer.tokengen = iter([Token("0x10", 0, 0), Token("v3", 0, 0)])
+        self.assertEqual(tokenizer.advance(tokenizer.parse_number), 16)
+        self.assertIsNone(tokenizer.advance(tokenizer.parse_number))
+
+    def test_macro_arguments_keep_their_kind(self):
+        tokenizer = Tokenizer(["after"])
+        for token in tokenize(["v1 := x"], 10):
+            tokenizer.store.append(token)
+        body = tokenizer.store.span(0)
+        slots = body.slots(["x"])
+        self.assertEqual(slots, {2: 0})
+        tokenizer.emit_macro(0, body, slots, [Token("0x20", 1, 3, Kind.NUMBER, 32)])
+        tokens = [tokenizer.advance() for _ in range(4)]
+        self.assertEqual(tokens[2], Token("0x20", 10, 3, Kind.NUMBER, 32))
+        self.assertEqual(tokens[3].text, "after")
+
+class TestBytes(unittest.TestCase):
+    def assertSameTokens(self, raw):
+        text = io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8")
+        self.assertEqual(list(tokenize_bytes(raw)), list(tokenize(text)))
+
+    def test_testdata(self):
+        for name, path in testpaths():
+            with self.subTest(name), open(path, "rb") as f:
+                self.assertSameTokens(f.read())
+
+    def test_comments(self):
+        self.assertSameTokens(b"# all comment\n  v0 := 1 # comment\na#b c # d\n#\n\tx\t#y")
+
+    def test_line_endings(self):
+        self.assertSameTokens(b"a b\r\nc\rd e\r\r\n\n f\r")
+
+    def test_blocks(self):
+        block_size = octopy.tokenizer.BLOCK_SIZE
+        octopy.tokenizer.BLOCK_SIZE = 4
+        try:
+            self.assertSameTokens(b"a b\r\nc\rd e\r\r\n\n f\r\nlong_line_over_a_block # x\r\n\r\n")
+        finally:
+            octopy.tokenizer.BLOCK_SIZE = block_size
+
+    def test_unicode(self):
+        self.assertSameTokens("caf\u00e9 x\u00a0y z\x1cw \u2003# c\u00e9\n q".encode())
+
+    def test_assemble_file(self):
+        for name, path in testpaths():
+            with self.subTest(name):
+                mapped = assemble_file(path, use_mmap=True)
+                read = assemble_file(path, use_mmap=False)
+                self.assertEqual(str(mapped.error), str(read.error))
+                self.assertEqual(mapped.program, read.program)
+
+        with tempfile.NamedTemporaryFile(suffix=".8o") as empty:
+            self.assertEqual(assemble_file(empty.name, use_mmap=True).program, b"")
+
+if __name__ == '__main__': unittest.main()